@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   https://warwick.ac.uk/fac/sci/eng/staff/jrk
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+"""
+Error of single precision descriptors in the energies of a GAP model
+
+The sparse GP energy of a GAP model with ard_se kernels is evaluated in numpy from
+descriptors computed with Descriptor(dtype=np.float64) and Descriptor(dtype=np.float32),
+and the differences are reported together with the memory and time of the descriptor
+calculation. The double precision result is checked against the energy of the same
+model evaluated by QUIP.
+
+    python descriptor_precision.py [--gap ../tests/GAP.xml] [--xyz ../tests/gap_sample.xyz]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import ase.io
+
+import quippy
+
+test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tests')
+
+
+def read_gap_model(filename):
+    """Reads the e0 values and the ard_se sparse GP coordinates of a GAP xml file"""
+    root = ET.parse(filename).getroot()
+    gap_data = root.find('.//GAP_data')
+    e0 = dict((int(e.get('Z')), float(e.get('value'))) for e in gap_data.findall('e0'))
+
+    coordinates = []
+    for gp in root.iter('gpCoordinates'):
+        if int(gp.get('covariance_type')) != 1:
+            raise ValueError('only ard_se covariance is supported, got covariance_type={0}'
+                             .format(gp.get('covariance_type')))
+        dimensions = int(gp.get('dimensions'))
+        sparse = sorted(gp.findall('sparseX'), key=lambda s: int(s.get('i')))
+        sparse_x = np.loadtxt(os.path.join(os.path.dirname(filename), gp.get('sparseX_filename')))
+        coordinates.append(dict(descriptor=gp.find('descriptor').text.strip(),
+                                delta=float(gp.get('signal_variance')),
+                                theta=np.array(gp.find('theta').text.split(), dtype=float),
+                                alpha=np.array([float(s.get('alpha')) for s in sparse]),
+                                sparse_cutoff=np.array([float(s.get('sparseCutoff')) for s in sparse]),
+                                sparse_x=sparse_x.reshape(len(sparse), dimensions)))
+    return e0, coordinates
+
+
+def gp_energy(coordinate, descriptor_out):
+    """Energy of one GP coordinate, accumulated in double precision"""
+    if descriptor_out['data'].size == 0:
+        return 0.0
+    x = np.asarray(descriptor_out['data'], dtype=np.float64)
+    diff = (x[:, None, :] - coordinate['sparse_x'][None, :, :]) / coordinate['theta']
+    k = coordinate['delta'] ** 2 * np.exp(-0.5 * np.sum(diff ** 2, axis=2))
+    k *= coordinate['sparse_cutoff'][None, :] * descriptor_out['covariance_cutoff'][:, None]
+    return float(np.sum(k.dot(coordinate['alpha'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--gap', default=os.path.join(test_dir, 'GAP.xml'))
+    parser.add_argument('--xyz', default=os.path.join(test_dir, 'gap_sample.xyz'))
+    parser.add_argument('--n_frames', type=int, default=20, help='number of rattled copies of each configuration')
+    parser.add_argument('--rattle', type=float, default=0.05)
+    parser.add_argument('--output', help='JSON file for the results, default is stdout')
+    args = parser.parse_args(argv)
+
+    e0, coordinates = read_gap_model(args.gap)
+    frames = []
+    for at in ase.io.read(args.xyz, ':'):
+        for i in range(args.n_frames):
+            frame = at.copy()
+            frame.rattle(args.rattle, seed=i)
+            frames.append(frame)
+
+    pot = quippy.potential.Potential('IP GAP', param_filename=args.gap)
+    e_quip = np.array([pot.get_potential_energy(at) for at in frames])
+    e_atoms = np.array([sum(e0[z] for z in at.numbers) for at in frames])
+    n_atoms = np.array([len(at) for at in frames])
+
+    results = dict(n_frames=len(frames), n_atoms=int(n_atoms.sum()))
+    energies = dict()
+    for dtype in (np.float64, np.float32):
+        descriptors = [quippy.descriptors.Descriptor(c['descriptor'], dtype=dtype) for c in coordinates]
+        energy = e_atoms.copy()
+        nbytes = 0
+        elapsed = 0.0
+        for i, at in enumerate(frames):
+            for coordinate, desc in zip(coordinates, descriptors):
+                t0 = time.perf_counter()
+                descriptor_out = desc.calc(at, grad=True)
+                elapsed += time.perf_counter() - t0
+                nbytes += descriptor_out['data'].nbytes + descriptor_out.get('grad_data', np.empty(0)).nbytes
+                energy[i] += gp_energy(coordinate, descriptor_out)
+        energies[np.dtype(dtype).name] = energy
+        results[np.dtype(dtype).name] = dict(descriptor_bytes=nbytes, descriptor_time=elapsed)
+
+    error_quip = np.abs(energies['float64'] - e_quip) / n_atoms
+    error = np.abs(energies['float32'] - energies['float64']) / n_atoms
+    results['float64']['max_error_per_atom_vs_quip'] = float(error_quip.max())
+    results['float32']['max_error_per_atom'] = float(error.max())
+    results['float32']['rms_error_per_atom'] = float(np.sqrt(np.mean(error ** 2)))
+    results['memory_ratio'] = results['float32']['descriptor_bytes'] / float(results['float64']['descriptor_bytes'])
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   https://warwick.ac.uk/fac/sci/eng/staff/jrk
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+"""
+Timings of the quippy hot paths, as a function of the system size
+
+The benchmarks are ase_to_quip conversion, Potential.calculate with SW, LJ, Tersoff
+and GAP, Descriptor.calc with and without gradients, neighbour list builds and
+Dynamics.step. Everything needed is in the repository (the parameters are from
+../tests and ../share/Parameters) and the structures are built with fixed seeds, so
+the runs are reproducible offline. Each benchmark is timed `--repeat` times for every
+size, after an untimed warm-up call, and the JSON output holds the times, the time
+per atom and the exponent of a power law fit of the scaling for each benchmark.
+
+    python quippy_benchmarks.py [--sizes 64 512 4096 32768 100000] [--repeat 3]
+                                [--only potential_SW descriptor] [--threads 1 2 4]
+                                [--phases] [--output results.json]
+
+OpenMP threads cannot be changed within a process, so with --threads the suite is run
+once per thread count, in a subprocess with OMP_NUM_THREADS set.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import ase
+import ase.build
+from ase.calculators.calculator import all_changes
+from ase.md.velocitydistribution import MaxwellBoltzmannDistribution
+from ase.units import fs
+
+import quippy
+import quippy.profiling
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+test_dir = os.path.join(bench_dir, os.pardir, 'tests')
+param_dir = os.path.join(bench_dir, os.pardir, 'share', 'Parameters')
+
+DEFAULT_SIZES = [64, 512, 4096, 32768, 100000]
+
+# argon, with the usual cutoff of 2.5 sigma
+LJ_STR = """<LJ_params n_types="1" label="default">
+<per_type_data type="1" atomic_num="18" />
+<per_pair_data type1="1" type2="1" sigma="3.405" eps6="0.0416" eps12="0.0416" cutoff="8.5" energy_shift="T" linear_force_shift="F" />
+</LJ_params>
+"""
+
+SOAP_STR = 'soap cutoff=5.0 l_max=4 n_max=4 atom_sigma=0.5 n_Z=1 Z={14}'
+
+
+def read_file(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+def cubic_supercell(unit_cell, n_atoms):
+    """Cubic supercell of `unit_cell` with the number of atoms closest to `n_atoms`"""
+    n = max(1, int(round((n_atoms / float(len(unit_cell))) ** (1.0 / 3.0))))
+    return unit_cell.repeat((n, n, n))
+
+
+def silicon(n_atoms, seed=0):
+    at = cubic_supercell(ase.build.bulk('Si', 'diamond', a=5.43, cubic=True), n_atoms)
+    at.rattle(0.05, seed=seed)
+    return at
+
+
+def argon(n_atoms, seed=0):
+    at = cubic_supercell(ase.build.bulk('Ar', 'fcc', a=5.26, cubic=True), n_atoms)
+    at.rattle(0.05, seed=seed)
+    return at
+
+
+def water(n_atoms, seed=0):
+    """Randomly oriented molecules on a simple cubic lattice, at about the density of water"""
+    rng = np.random.RandomState(seed)
+    molecule = ase.build.molecule('H2O')
+    spacing = 3.1
+    n = max(1, int(round((n_atoms / 3.0) ** (1.0 / 3.0))))
+    positions = []
+    for index in np.ndindex(n, n, n):
+        mol = molecule.copy()
+        mol.rotate(rng.uniform(0.0, 360.0), rng.normal(size=3))
+        positions.append(mol.positions + spacing * np.array(index))
+    return ase.Atoms('H2O' * n ** 3, positions=np.concatenate(positions),
+                     cell=[n * spacing] * 3, pbc=True)
+
+
+# param file (or string), init args and structure of each Potential benchmark
+POTENTIALS = {'SW': dict(param_filename=os.path.join(test_dir, 'SW_pot.xml'), args_str='IP SW',
+                         structure=silicon),
+              'LJ': dict(param_str=LJ_STR, args_str='IP LJ', structure=argon),
+              'Tersoff': dict(param_filename=os.path.join(param_dir, 'ip.parms.Tersoff.xml'),
+                              args_str='IP Tersoff', structure=silicon),
+              'GAP': dict(param_filename=os.path.join(test_dir, 'GAP.xml'), args_str='IP GAP',
+                          structure=water)}
+
+
+def make_potential(name):
+    options = dict(POTENTIALS[name])
+    options.pop('structure')
+    if 'param_filename' in options:
+        options['param_str'] = read_file(options.pop('param_filename'))
+    return quippy.potential.Potential(**options)
+
+
+def time_calls(function, repeat, phases=False):
+    """Wall times of `repeat` calls of `function`, after a warm-up call, and the quippy phases if asked"""
+    function()
+    times = []
+    profile = quippy.profiling.Profile(fortran=False)
+    for i in range(repeat):
+        if phases:
+            with profile:
+                t0 = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - t0)
+        else:
+            t0 = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - t0)
+    result = dict(times=times, min=min(times), median=float(np.median(times)))
+    if phases:
+        result['phases'] = profile.report()['phases']
+    return result
+
+
+def bench_ase_to_quip(n_atoms, repeat, phases):
+    at = silicon(n_atoms)
+    return at, time_calls(lambda: quippy.convert.ase_to_quip(at), repeat)
+
+
+def bench_potential(name):
+    def bench(n_atoms, repeat, phases):
+        at = POTENTIALS[name]['structure'](n_atoms)
+        pot = make_potential(name)
+
+        def calculate():
+            pot.calculate(at, properties=['energy', 'forces'], system_changes=all_changes)
+
+        return at, time_calls(calculate, repeat, phases)
+
+    return bench
+
+
+def bench_descriptor(grad):
+    def bench(n_atoms, repeat, phases):
+        at = silicon(n_atoms)
+        desc = quippy.descriptors.Descriptor(SOAP_STR)
+        return at, time_calls(lambda: desc.calc(at, grad=grad), repeat)
+
+    return bench
+
+
+def bench_neighbour_list(n_atoms, repeat, phases):
+    at = silicon(n_atoms)
+    quip_atoms = quippy.convert.ase_to_quip(at)
+    quip_atoms.set_cutoff(5.0)
+    return at, time_calls(quip_atoms.calc_connect, repeat)
+
+
+def bench_dynamics_step(n_atoms, repeat, phases):
+    at = silicon(n_atoms)
+    MaxwellBoltzmannDistribution(at, temperature_K=300.0, rng=np.random.RandomState(0))
+    at.calc = make_potential('SW')
+    dynamics = quippy.dynamicalsystem.Dynamics(at, 1.0 * fs, trajectory=None, logfile=None)
+    state = dict(forces=at.get_forces())
+
+    def step():
+        state['forces'] = dynamics.step(state['forces'])
+
+    return at, time_calls(step, repeat, phases)
+
+
+BENCHMARKS = {'ase_to_quip': bench_ase_to_quip,
+              'potential_SW': bench_potential('SW'),
+              'potential_LJ': bench_potential('LJ'),
+              'potential_Tersoff': bench_potential('Tersoff'),
+              'potential_GAP': bench_potential('GAP'),
+              'descriptor': bench_descriptor(grad=False),
+              'descriptor_grad': bench_descriptor(grad=True),
+              'neighbour_list': bench_neighbour_list,
+              'dynamics_step': bench_dynamics_step}
+
+
+def scaling_exponent(n_atoms, times):
+    """Exponent of the power law fitted to the times, 1 for linear scaling"""
+    if len(set(n_atoms)) < 2:
+        return None
+    return float(np.polyfit(np.log(n_atoms), np.log(times), 1)[0])
+
+
+def run_benchmarks(names, sizes, repeat, phases):
+    results = dict()
+    for name in names:
+        curve = []
+        for size in sizes:
+            at, timing = BENCHMARKS[name](size, repeat, phases)
+            timing['n_atoms'] = len(at)
+            timing['time_per_atom'] = timing['median'] / len(at)
+            curve.append(timing)
+            sys.stderr.write('{0} {1} atoms: {2:.4g} s\n'.format(name, len(at), timing['median']))
+        results[name] = dict(scaling=curve,
+                             exponent=scaling_exponent([point['n_atoms'] for point in curve],
+                                                       [point['median'] for point in curve]))
+    return results
+
+
+def environment():
+    return dict(python=platform.python_version(),
+                numpy=np.__version__,
+                ase=ase.__version__,
+                quippy=os.path.dirname(quippy.__file__),
+                platform=platform.platform(),
+                processor=platform.processor(),
+                cpu_count=os.cpu_count(),
+                omp_num_threads=os.environ.get('OMP_NUM_THREADS'))
+
+
+def run_threads(argv, threads):
+    """Runs the suite in a subprocess for each thread count, and returns the results of each run"""
+    runs = []
+    for n_threads in threads:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'results.json')
+            env = dict(os.environ, OMP_NUM_THREADS=str(n_threads))
+            subprocess.check_call([sys.executable, os.path.abspath(__file__)] + argv + ['--output', output], env=env)
+            with open(output) as f:
+                runs.extend(json.load(f)['runs'])
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='approximate numbers of atoms, the structures are cubic supercells')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed calls for each size')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run, default is all')
+    parser.add_argument('--threads', type=int, nargs='+', help='OMP_NUM_THREADS of each run, default is unchanged')
+    parser.add_argument('--phases', action='store_true',
+                        help='include the times of the quippy.profiling phases of the calculations')
+    parser.add_argument('--output', help='JSON file for the results, default is stdout')
+    args = parser.parse_args(argv)
+
+    names = args.only if args.only is not None else list(BENCHMARKS)
+    settings = dict(sizes=args.sizes, repeat=args.repeat, benchmarks=names, phases=args.phases)
+
+    if args.threads is not None:
+        child_argv = ['--sizes'] + [str(size) for size in args.sizes] + ['--repeat', str(args.repeat),
+                                                                            '--only'] + names
+        if args.phases:
+            child_argv.append('--phases')
+        runs = run_threads(child_argv, args.threads)
+    else:
+        runs = [dict(omp_num_threads=os.environ.get('OMP_NUM_THREADS'),
+                     benchmarks=run_benchmarks(names, args.sizes, args.repeat, args.phases))]
+
+    results = dict(environment=environment(), settings=settings, runs=runs)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -37,12 +37,25 @@ __all__ = ['ase_to_quip', 'descriptor_data_mono_to_dict', 'velocities_ase_to_qui
 # conversion between ase and quip mass, taken from Fortran source
 MASSCONVERT = 103.6426957074462
 
+# properties of a reused quip atoms object which are kept by ase_to_quip(): those every object
+# has, and the ones added by calc_connect()
+_KEEP_PROPERTIES = {'Z', 'pos', 'species', 'map_shift', 'n_neighb'}
 
-def ase_to_quip(ase_atoms: ase.Atoms, quip_atoms=None, add_arrays=None, add_info=None):
+
+def ase_to_quip(ase_atoms: ase.Atoms, quip_atoms=None, add_arrays=None, add_info=None, system_changes=None):
     """
     Converter to put the info from an ase atoms object into a quip atoms object.
     Copies everything to make sure there is not linking back.
 
+    If `quip_atoms` is given and has the same number of atoms it is updated in place,
+    otherwise a new object is allocated. When updating in place, `system_changes` can
+    be used to restrict the update to what has changed since the last conversion, as
+    in ase.calculators.calculator.all_changes: only 'positions', 'cell', 'pbc' and
+    'numbers' are checked. `None` means everything is written. Properties and params
+    of the object that are not written by this conversion, such as velocities of
+    momenta since removed, keys no longer in `add_arrays` or `add_info`, or results of
+    a calculation, are removed, apart from the ones calc_connect() adds.
+
     Notes on add_arrays and add_info:
         - overwriting a parameter is not possible yet
         - only float arrays can be added, integers are converted to floats by fortran, fails for strings
@@ -78,10 +91,12 @@ def ase_to_quip(ase_atoms: ase.Atoms, quip_atoms=None, add_arrays=None, add_info
     :param quip_atoms:
     :param add_arrays: keys to take from ase.Atoms.arrays
     :param add_info:  keys to take from ase.Atoms.info
+    :param system_changes: list of what changed since `quip_atoms` was last updated, only used if it is reused
     :return:
     """
 
     lattice = ase_atoms.get_cell().T.copy()
+    reused = False
     if quip_atoms is not None:
         if isinstance(quip_atoms, quippy.atoms_types_module.Atoms):
             # check if the length matches, otherwise make a new one in place of that
@@ -89,8 +104,7 @@ def ase_to_quip(ase_atoms: ase.Atoms, quip_atoms=None, add_arrays=None, add_info
                 # need to regenerate the quip atoms object
                 quip_atoms = quippy.atoms_types_module.Atoms(len(ase_atoms), lattice)
             else:
-                # but the cell needs to be set anyways
-                quip_atoms.set_lattice(lattice, scale_positions=False)
+                reused = True
         else:
             # raise an error for the wrong object given
             raise TypeError('quip_atoms argument is not of valid type, cannot work with it')
@@ -99,16 +113,29 @@ def ase_to_quip(ase_atoms: ase.Atoms, quip_atoms=None, add_arrays=None, add_info
         # need to regenerate the quip atoms object
         quip_atoms = quippy.atoms_types_module.Atoms(len(ase_atoms), lattice)
 
-    quip_atoms.pos[:] = ase_atoms.get_positions().T.copy()
-    quip_atoms.is_periodic[:] = ase_atoms.get_pbc()
-    quip_atoms.z[:] = ase_atoms.numbers
-    quip_atoms.set_atoms(quip_atoms.z)  # set species and mass
+    def changed(key):
+        # everything is written unless we are updating a reused object with known changes
+        return not reused or system_changes is None or key in system_changes
+
+    if reused and changed('cell'):
+        quip_atoms.set_lattice(lattice, scale_positions=False)
+    if changed('positions'):
+        quip_atoms.pos[:] = ase_atoms.get_positions().T
+    if changed('pbc'):
+        quip_atoms.is_periodic[:] = ase_atoms.get_pbc()
+    if changed('numbers'):
+        quip_atoms.z[:] = ase_atoms.numbers
+        quip_atoms.set_atoms(quip_atoms.z)  # set species and mass
+
+    written_properties = set()
+    written_params = set()
 
     if ase_atoms.has('momenta'):
         # if ase atoms has momenta then add velocities to the quip object
         # workaround for the interfaces not behaving properly in the wrapped code, see f90wrap issue #86
         _quippy.f90wrap_atoms_add_property_real_2da(this=quip_atoms._handle, name='velo',
                                                     value=velocities_ase_to_quip(ase_atoms.get_velocities()))
+        written_properties.add('velo')
 
     def key_spec_to_list(keyspec, default, exclude=()):
         if keyspec is True:
@@ -137,6 +164,7 @@ def ase_to_quip(ase_atoms: ase.Atoms, quip_atoms=None, add_arrays=None, add_info
                 # fixme: give some warning here if needed
                 continue
             add_property_array(quip_atoms, info_name, value)
+            written_properties.add(info_name)
 
     if add_info is not None:
         add_info = key_spec_to_list(add_info, ase_atoms.info, exclude=[])
@@ -147,6 +175,14 @@ def ase_to_quip(ase_atoms: ase.Atoms, quip_atoms=None, add_arrays=None, add_info
                 # fixme: give some warning here if needed
                 continue
             add_param_value(quip_atoms, info_name, value)
+            written_params.add(info_name)
+
+    if reused:
+        # nothing of earlier conversions or calculations is left for the Fortran code to read
+        for key in set(get_dict_keys(quip_atoms.properties)) - _KEEP_PROPERTIES - written_properties:
+            quip_atoms.remove_property(key)
+        for key in set(get_dict_keys(quip_atoms.params)) - written_params:
+            quip_atoms.params.remove_value(key)
 
     return quip_atoms
 
@@ -337,8 +373,22 @@ def descriptor_data_mono_to_dict(desc_data_mono):
     return out_data_dict
 
 
-def get_dict_arrays(fdict):
-    """Takes the arrays from a quippy dictionary. Copies.
+def get_dict_keys(fdict):
+    """Returns the list of keys in a quippy dictionary"""
+
+    if not isinstance(fdict, quippy.dictionary_module.Dictionary):
+        raise TypeError('fdict argument is not a quippy.dictionary_module.Dictionary')
+
+    return [fdict.get_key(i).strip().decode('ascii') for i in range(1, fdict.n + 1)]
+
+
+def get_dict_arrays(fdict, copy=True, keys=None):
+    """Takes the arrays from a quippy dictionary. Copies by default.
+
+    With `copy=False` the arrays are read-only views of the Fortran memory, which are
+    only valid until the dictionary is modified or deallocated, so they need to be
+    copied by the caller if they are kept. `keys` restricts the result to the given keys,
+    missing ones are ignored.
 
     Probably fails if there are non-array elements in the dictionary"""
 
@@ -349,11 +399,17 @@ def get_dict_arrays(fdict):
     for i in range(1, fdict.n + 1):
         key = fdict.get_key(i)
         key = key.strip().decode('ascii')
+        if keys is not None and key not in keys:
+            continue
         # fixme: fails for non_array elements. Make universal: compatible with array or scalar content in dictionary
         try:  # this is an unsufficient temporary fix
             value = f90wrap.runtime.get_array(f90wrap.runtime.sizeof_fortran_t,
                                               fdict._handle, _quippy.f90wrap_dictionary__array__, key)
-            arrays[key] = value.copy()
+            if copy:
+                arrays[key] = value.copy()
+            else:
+                value.flags.writeable = False
+                arrays[key] = value
         except ValueError:
             value = fdict.get_value(key)
             try:
@@ -0,0 +1,253 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Portions of this code were written by
+# HQ X     Tamas K. Stenczel, James Kermode
+# HQ X
+# HQ X   Copyright 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   https://warwick.ac.uk/fac/sci/eng/staff/jrk
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+
+"""
+Disk-backed storage of descriptors and their gradients for large training sets
+"""
+
+import json
+import os
+
+import numpy as np
+
+__all__ = ['DescriptorStore']
+
+
+class DescriptorStore:
+    """
+    Store of the output of Descriptor.calc() for many frames, written frame-by-frame and
+    read back lazily as memory-mapped arrays.
+
+    A store is a directory holding one flat binary file per array, which frames are
+    appended to, a `meta.json` header with the dtypes and the number of columns, and
+    `offsets.npy` with the offsets of each frame in the arrays:
+
+    ======================= ========================= ================================================
+    array                   shape                     Note
+    ======================= ========================= ================================================
+    data                    (n_desc, n_dim)
+    covariance_cutoff       (n_desc,)
+    grad_data               (n_grad, 3, n_dim)        only if written with gradients
+    grad_covariance_cutoff  (n_grad, 3)
+    grad_index              (n_grad, 2)               (row of the descriptor in the frame, atom), 0-based
+    ======================= ========================= ================================================
+
+    Usage::
+
+        with DescriptorStore('soap_store', mode='w') as store:
+            desc.calc(frames, grad=True, store=store)
+
+        store = DescriptorStore('soap_store')
+        frame_data = store.frame(10)
+        atom_grad = store.atom_grad(10, 3)
+
+    :param path: directory of the store
+    :param mode: 'r' to read, 'w' to create a new store, 'a' to append to an existing one
+    """
+
+    _arrays = ['data', 'covariance_cutoff', 'grad_data', 'grad_covariance_cutoff', 'grad_index']
+
+    def __init__(self, path, mode='r'):
+        if mode not in ('r', 'w', 'a'):
+            raise ValueError('mode should be one of r, w or a, not {}'.format(mode))
+
+        self.path = path
+        self.mode = mode
+        self._files = {}
+        self._memmaps = {}
+
+        if mode == 'w':
+            os.makedirs(path, exist_ok=True)
+            for name in self._arrays:
+                if os.path.exists(self._filename(name)):
+                    os.remove(self._filename(name))
+            self.meta = None
+            # offsets of frames into data and grad arrays, and number of atoms
+            self._desc_offsets = [0]
+            self._grad_offsets = [0]
+            self._n_atoms = []
+        else:
+            with open(os.path.join(path, 'meta.json')) as f:
+                self.meta = json.load(f)
+            offsets = np.load(os.path.join(path, 'offsets.npy'))
+            self._desc_offsets = list(offsets[0])
+            self._grad_offsets = list(offsets[1])
+            self._n_atoms = list(offsets[2][:-1])
+
+    def _filename(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._desc_offsets) - 1
+
+    @property
+    def n_frames(self):
+        return len(self)
+
+    def append(self, descriptor_out, n_atoms, grad=None):
+        """
+        Appends the output of Descriptor.calc() for a single frame.
+
+        :param descriptor_out: dictionary returned by Descriptor.calc()
+        :param n_atoms: number of atoms of the frame
+        :param grad: whether descriptor_out was calculated with gradients. A frame calculated
+            with gradients but without any, e.g. of isolated atoms, is stored with an empty
+            block of gradients. Guessed from the keys of descriptor_out if not given.
+        """
+        if self.mode == 'r':
+            raise IOError('DescriptorStore opened read-only')
+
+        data = descriptor_out['data']
+        n_desc = len(data) if np.size(data) > 0 else 0
+        has_grad = 'grad_data' in descriptor_out if grad is None else bool(grad)
+
+        if self.meta is None:
+            if n_desc == 0:
+                # nothing to learn the layout from yet
+                self._desc_offsets.append(self._desc_offsets[-1])
+                self._grad_offsets.append(self._grad_offsets[-1])
+                self._n_atoms.append(n_atoms)
+                return
+            self.meta = {'n_dim': int(data.shape[1]),
+                         'dtype': np.dtype(data.dtype).str,
+                         'grad': has_grad}
+
+        if has_grad != self.meta['grad']:
+            raise ValueError('frames of a DescriptorStore need to be all with or all without gradients')
+
+        arrays = {}
+        if n_desc > 0:
+            arrays['data'] = data
+            arrays['covariance_cutoff'] = descriptor_out['covariance_cutoff']
+            if has_grad and 'grad_data' in descriptor_out:
+                arrays['grad_data'] = descriptor_out['grad_data']
+                arrays['grad_covariance_cutoff'] = descriptor_out['grad_covariance_cutoff']
+                # rows of the descriptors relative to the frame, so frames can be read independently
+                arrays['grad_index'] = np.column_stack(
+                    [np.repeat(np.arange(n_desc), descriptor_out['n_grad']),
+                     descriptor_out['grad_index_0based'][:, 1]])
+
+        for name, value in arrays.items():
+            dtype = self.meta['dtype'] if name in ('data', 'grad_data') else ('<i8' if name == 'grad_index' else '<f8')
+            if name not in self._files:
+                self._files[name] = open(self._filename(name), 'ab')
+            self._files[name].write(np.ascontiguousarray(value, dtype=dtype).tobytes())
+
+        n_grad = len(arrays['grad_index']) if 'grad_index' in arrays else 0
+        self._desc_offsets.append(self._desc_offsets[-1] + n_desc)
+        self._grad_offsets.append(self._grad_offsets[-1] + n_grad)
+        self._n_atoms.append(n_atoms)
+        self._memmaps = {}
+
+    def flush(self):
+        """Writes the header and index, so that the frames appended so far can be read"""
+        if self.mode == 'r':
+            return
+        for f in self._files.values():
+            f.flush()
+        # null until the first non-empty frame is appended
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+        np.save(os.path.join(self.path, 'offsets.npy'),
+                np.array([self._desc_offsets, self._grad_offsets, self._n_atoms + [0]], dtype=np.int64))
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def _memmap(self, name):
+        """Lazily opened memmap of a whole array"""
+        if name not in self._memmaps:
+            self.flush()
+            meta = self.meta if self.meta is not None else {'n_dim': 0, 'dtype': '<f8'}
+            n_dim = meta['n_dim']
+            if name in ('data', 'grad_data'):
+                dtype = np.dtype(meta['dtype'])
+            elif name == 'grad_index':
+                dtype = np.dtype('<i8')
+            else:
+                dtype = np.dtype('<f8')
+            length = self._desc_offsets[-1] if name in ('data', 'covariance_cutoff') else self._grad_offsets[-1]
+            row_shape = {'data': (n_dim,), 'covariance_cutoff': (), 'grad_data': (3, n_dim),
+                         'grad_covariance_cutoff': (3,), 'grad_index': (2,)}[name]
+            if length == 0:
+                self._memmaps[name] = np.zeros((0,) + row_shape, dtype=dtype)
+            else:
+                self._memmaps[name] = np.memmap(self._filename(name), dtype=dtype, mode='r',
+                                                shape=(length,) + row_shape)
+        return self._memmaps[name]
+
+    @property
+    def data(self):
+        """All descriptors, memory-mapped"""
+        return self._memmap('data')
+
+    @property
+    def grad_data(self):
+        """All gradients, memory-mapped"""
+        return self._memmap('grad_data')
+
+    @property
+    def frame_offsets(self):
+        """Offsets of the frames in `data`"""
+        return np.array(self._desc_offsets)
+
+    @property
+    def frame_grad_offsets(self):
+        """Offsets of the frames in `grad_data`"""
+        return np.array(self._grad_offsets)
+
+    def frame(self, i):
+        """Returns a dictionary of views of the arrays of frame `i`"""
+        d0, d1 = self._desc_offsets[i], self._desc_offsets[i + 1]
+        out = {'data': self._memmap('data')[d0:d1],
+               'covariance_cutoff': self._memmap('covariance_cutoff')[d0:d1],
+               'n_atoms': self._n_atoms[i]}
+        if self.meta is not None and self.meta['grad']:
+            g0, g1 = self._grad_offsets[i], self._grad_offsets[i + 1]
+            for name in ('grad_data', 'grad_covariance_cutoff', 'grad_index'):
+                out[name] = self._memmap(name)[g0:g1]
+        return out
+
+    def atom_grad(self, i, atom):
+        """
+        Returns the gradients of the descriptors of frame `i` with respect to the
+        position of `atom` (0-based), and the rows of these descriptors in frame(i)['data'].
+        """
+        g0, g1 = self._grad_offsets[i], self._grad_offsets[i + 1]
+        grad_index = np.asarray(self._memmap('grad_index')[g0:g1])
+        rows = np.nonzero(grad_index[:, 1] == atom)[0]
+        return self._memmap('grad_data')[g0 + rows], grad_index[rows, 0]
+
+    def iter_blocks(self, block_size):
+        """Iterates over the descriptors in blocks of up to `block_size` rows, e.g. for building covariances"""
+        data = self._memmap('data')
+        for start in range(0, len(data), block_size):
+            yield data[start:start + block_size]
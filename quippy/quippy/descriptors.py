@@ -20,12 +20,16 @@
 # HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 
 
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import quippy
 from ase import Atoms
 import numpy as np
 from ase.io.extxyz import key_val_dict_to_str
 
-__all__ = ['Descriptor']
+__all__ = ['Descriptor', 'DescriptorSet']
 
 
 def convert_atoms_types_iterable_method(method):
@@ -40,7 +44,7 @@ def convert_atoms_types_iterable_method(method):
         if isinstance(at, quippy.atoms_types_module.Atoms):
             return method(self, at, *args, **kw)
         elif isinstance(at, Atoms):
-            _quip_at = quippy.convert.ase_to_quip(at)
+            _quip_at = self._ase_to_quip(at)
             return method(self, _quip_at, *args, **kw)
         else:
             return [wrapper(self, atelement, *args, **kw) for atelement in at]
@@ -48,9 +52,20 @@ def convert_atoms_types_iterable_method(method):
     return wrapper
 
 
+class _ConnectCache:
+    """
+    The Atoms object last connected and the state it was connected in. Can be shared
+    between descriptors evaluated on the same neighbour list.
+    """
+
+    def __init__(self):
+        self.atoms = None
+        self.key = None
+
+
 class Descriptor:
 
-    def __init__(self, args_str=None, **init_kwargs):
+    def __init__(self, args_str=None, neighbour_skin=None, dtype=np.float64, **init_kwargs):
         """
         Initialises Descriptor object and calculate number of dimensions and
         permutations.
@@ -62,6 +77,16 @@ class Descriptor:
         calculateable:
         - sizes: `n_desc, n_cross, n_index = desc.sizes(_quip_atoms)`
 
+        ASE Atoms are converted into the same Fortran Atoms object on every call,
+        and the connectivity is only recalculated if the Atoms object, its positions,
+        cell or cutoff changed since the last calculation. With `neighbour_skin` set,
+        this is used as a Verlet skin, so successive frames of a trajectory only need
+        a full neighbour list rebuild when an atom moved more than half of the skin.
+
+        `dtype` is the floating point type of the descriptor values and gradients returned,
+        e.g. np.float32 halves the memory needed. They are computed in double precision
+        and converted once when copied out of the Fortran arrays.
+
         """
 
         if args_str is None:
@@ -71,6 +96,15 @@ class Descriptor:
 
         # intialise the wrapped object and hide it from the user
         self._quip_descriptor = quippy.descriptors_module.descriptor(args_str)
+        # needed to make the same descriptor in worker processes
+        self._args_str = args_str
+
+        self.neighbour_skin = neighbour_skin
+        self.dtype = np.dtype(dtype)
+        # Fortran Atoms object reused for the conversion of ASE Atoms
+        self._quip_atoms = None
+        # the Atoms object last connected, and the state it was connected in
+        self._connect_cache = _ConnectCache()
 
         # kept for compatibility with older version
         # super convoluted though :D should just rethink it at some point
@@ -119,12 +153,28 @@ class Descriptor:
         # fixme: is the decorator needed now?
         return self.sizes(at)[0]
 
+    def _ase_to_quip(self, at):
+        """
+        Converts an ASE Atoms object into the Fortran Atoms object of the previous conversion
+        if possible, so that its connectivity can be reused. Properties and params of the
+        previous frame, such as its velocities, are removed from it by ase_to_quip()
+        """
+
+        if (self.neighbour_skin is not None and self._quip_atoms is not None and
+                np.any(np.asarray(self._quip_atoms.is_periodic, dtype=bool) != at.get_pbc())):
+            # calc_connect() does not check for changes of pbc when reusing the neighbour list
+            self._quip_atoms = None
+        self._quip_atoms = quippy.convert.ase_to_quip(at, quip_atoms=self._quip_atoms)
+        return self._quip_atoms
+
     @convert_atoms_types_iterable_method
     def _calc_connect(self, at, cutoff=None):
         """
         Internal method for calculating connectivity on a quip_atoms object
 
-        Ideally called only on quip_atoms object, but put in decorator to make sure
+        Ideally called only on quip_atoms object, but put in decorator to make sure.
+        Skipped if the connectivity of the same object was calculated with the same
+        positions, cell and cutoff already.
         :param at:
         :return:
         """
@@ -135,9 +185,17 @@ class Descriptor:
             # setting to +1 is arbitrary here, the point is to set to something a bit higher than the descriptor's
             if at.cutoff < self.cutoff() + 1:
                 at.set_cutoff(self.cutoff() + 1)
+        if self.neighbour_skin is not None:
+            at.set_cutoff(at.cutoff, cutoff_skin=self.neighbour_skin)
+
+        connect_key = (at.cutoff, at.cutoff_skin, at.lattice.tobytes(), at.is_periodic.tobytes(), hash(at.pos.tobytes()))
+        if at is self._connect_cache.atoms and connect_key == self._connect_cache.key:
+            return
 
-        # TODO: add logic to skip this if it has been calculated already for speedup
         at.calc_connect()
+        # keeping a reference, so that the object cannot be deallocated and its handle reused while cached
+        self._connect_cache.atoms = at
+        self._connect_cache.key = connect_key
 
     @convert_atoms_types_iterable_method
     def calc_descriptor(self, at, args_str=None, cutoff=None, **calc_kwargs):
@@ -153,16 +211,21 @@ class Descriptor:
             return []
 
     @convert_atoms_types_iterable_method
-    def calc(self, at, grad=False, args_str=None, cutoff=None, **calc_kwargs):
+    def calc(self, at, grad=False, args_str=None, cutoff=None, store=None, **calc_kwargs):
         """
         Calculates all descriptors of this type in the Atoms object, and
         gradients if grad=True. Results can be accessed dictionary- or
         attribute-style; 'descriptor' contains descriptor values,
         'descriptor_index_0based' contains the 0-based indices of the central
         atom(s) in each descriptor, 'grad' contains gradients,
-        'grad_index_0based' contains indices to gradients (descriptor, atom).
+        'grad_index_0based' contains indices to gradients (descriptor, atom),
+        and 'n_grad' the number of gradients of each descriptor.
         Cutoffs and gradients of cutoffs are also returned.
 
+        If a quippy.descriptor_store.DescriptorStore is given as `store`, the results are
+        appended to it instead of being returned, so that a list of frames can be written
+        frame-by-frame without keeping all of them in memory.
+
         """
 
         # arg string and calc_args
@@ -172,52 +235,289 @@ class Descriptor:
             # new, for compatibility: merged if both given
             args_str += ' ' + key_val_dict_to_str(calc_kwargs)
 
-        # calc connectivity on the atoms object with the internal one
-        self._calc_connect(at, cutoff)
+        # calc connectivity on the atoms object with the internal one, sizes are needed for the output arrays
+        count, n_cross = self.sizes(at, cutoff)
 
         # descriptor calculation
         descriptor_out_raw = self._quip_descriptor.calc(at, do_descriptor=True, do_grad_descriptor=grad,
                                                         args_str=args_str)
 
-        # unpack to a list of dicts
-        count = self.count(at)
-        descriptor_out = dict()
-        for i in range(count):
-            # unpack to dict with the specific converter function
-            mono_dict = quippy.convert.descriptor_data_mono_to_dict(descriptor_out_raw.x[i])
-
-            # add to the result
-            for key, val in mono_dict.items():
-                if key in descriptor_out.keys():
-                    descriptor_out[key].append(val)
-                else:
-                    descriptor_out[key] = [val]
-
-        # make numpy arrays out of them
-        for key, val in descriptor_out.items():
-            # merge the arrays according to shape
-            if key in ['data', 'ci']:
-                descriptor_out[key] = np.concatenate(val, axis=0)
-            elif key in ['covariance_cutoff', 'has_data']:
-                descriptor_out[key] = np.array(val)
-            elif key in ["pos", "grad_covariance_cutoff"]:
-                # corresponds to the gradients
-                descriptor_out[key] = np.concatenate([x.T for x in val])
-            elif key == "grad_data":
-                descriptor_out[key] = np.transpose(np.concatenate(val, axis=2), axes=(2, 1, 0))
-
-        if "ii" in descriptor_out.keys():
-            grad_index_0based = []
-            for idx, ii_perdesc in enumerate(descriptor_out["ii"]):
-                for ii_item in ii_perdesc:
-                    grad_index_0based.append([descriptor_out["ci"][idx], ii_item])
-            # same as in py2, makes iteration of gradient easier
-            descriptor_out["grad_index_0based"] = np.array(grad_index_0based) - 1
-
-        if count > 0:
-            descriptor_out['data'] = descriptor_out['data'].reshape((count, -1))
-        else:
-            descriptor_out['data'] = np.array([[]])
+        descriptor_out = _unpack_descriptor_data(descriptor_out_raw, count, n_cross, self.n_dim, grad, self.dtype)
+
+        if store is not None:
+            store.append(descriptor_out, at.n, grad=grad)
+            return None
 
         # This is a dictionary now and hence needs to be indexed as one, unlike the old version
         return descriptor_out
+
+    def calc_many(self, frames, n_jobs=1, chunk_size=None, filename=None, args_str=None, cutoff=None,
+                  out=None, **calc_kwargs):
+        """
+        Calculates the descriptors of a list of frames into a single array, optionally
+        using a pool of `n_jobs` processes, each with its own copy of the descriptor.
+
+        Each frame is evaluated once, by iter_calc() in chunks of `chunk_size` frames, and
+        its descriptors are written to the output as they arrive: into the array `out` of
+        the caller if given, which needs at least as many rows as there are descriptors,
+        or appended to the .npy file `filename`, which is then opened as a memmap.
+        Otherwise the arrays of the frames are concatenated at the end, which needs twice
+        the memory of the result.
+
+        Returns `(data, offsets)` where the descriptors of frame `i` are
+        `data[offsets[i]:offsets[i + 1]]`. `data` is a view of `out`, or a memmap if
+        `filename` is given.
+        """
+
+        if out is not None and filename is not None:
+            raise ValueError('calc_many: only one of out and filename can be given')
+
+        frames = list(frames)
+        if chunk_size is None:
+            chunk_size = max(1, len(frames) // (4 * n_jobs))
+        offsets = np.zeros(len(frames) + 1, dtype=int)
+        frames_data = self.iter_calc(frames, n_jobs, chunk_size, args_str, cutoff, **calc_kwargs)
+
+        try:
+            if out is not None:
+                for i, frame_data in enumerate(frames_data):
+                    offsets[i + 1] = offsets[i] + _count_rows(frame_data)
+                    if offsets[i + 1] > len(out):
+                        raise ValueError('calc_many: out has only {} rows, not enough for the descriptors '
+                                         'of the first {} frames'.format(len(out), i + 1))
+                    if offsets[i + 1] > offsets[i]:
+                        out[offsets[i]:offsets[i + 1]] = frame_data
+                return out[:offsets[-1]], offsets
+
+            if filename is not None:
+                with open(filename, 'wb') as fileobj:
+                    header_size = _write_npy_header(fileobj, (0, self.n_dim), self.dtype)
+                    for i, frame_data in enumerate(frames_data):
+                        offsets[i + 1] = offsets[i] + _count_rows(frame_data)
+                        if offsets[i + 1] > offsets[i]:
+                            fileobj.write(np.ascontiguousarray(frame_data, dtype=self.dtype).tobytes())
+                    fileobj.seek(0)
+                    if _write_npy_header(fileobj, (int(offsets[-1]), self.n_dim), self.dtype) != header_size:
+                        # numpy < 1.23 does not leave room in the header for the shape to grow
+                        raise RuntimeError('calc_many: the header of {} cannot be updated in place, '
+                                           'numpy >= 1.23 is needed'.format(filename))
+                return np.load(filename, mmap_mode='r+'), offsets
+
+            data = []
+            for i, frame_data in enumerate(frames_data):
+                offsets[i + 1] = offsets[i] + _count_rows(frame_data)
+                if offsets[i + 1] > offsets[i]:
+                    data.append(frame_data)
+        finally:
+            # shuts down the workers if the output failed
+            frames_data.close()
+
+        if len(data) == 0:
+            return np.zeros((0, self.n_dim), dtype=self.dtype), offsets
+        return np.concatenate(data, axis=0), offsets
+
+    def iter_calc(self, frames, n_jobs=1, chunk_size=1, args_str=None, cutoff=None, **calc_kwargs):
+        """
+        Generator variant of calc_many() for datasets which do not fit in memory, `frames` can
+        be any iterable, e.g. `ase.io.iread()`. Yields the array of descriptors of each frame
+        in order. Frames are read only `2 * n_jobs` chunks ahead of the one being yielded.
+        """
+
+        frames = iter(frames)
+        chunks = iter(lambda: list(itertools.islice(frames, chunk_size)), [])
+
+        if n_jobs <= 1:
+            for chunk in chunks:
+                for at in chunk:
+                    yield self.calc_descriptor(at, args_str, cutoff, **calc_kwargs)
+            return
+
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker_descriptor,
+                                 initargs=(self._args_str, self.neighbour_skin, self.dtype)) as executor:
+            futures = deque()
+            for chunk in chunks:
+                futures.append(executor.submit(_worker_calc_descriptor, chunk, (args_str, cutoff, calc_kwargs)))
+                if len(futures) >= 2 * n_jobs:
+                    yield from futures.popleft().result()
+            while futures:
+                yield from futures.popleft().result()
+
+
+# descriptor of a worker process of Descriptor.calc_many() and Descriptor.iter_calc()
+_worker_descriptor = None
+
+
+def _init_worker_descriptor(args_str, neighbour_skin, dtype):
+    global _worker_descriptor
+    _worker_descriptor = Descriptor(args_str, neighbour_skin=neighbour_skin, dtype=dtype)
+
+
+def _worker_calc_descriptor(frames, args):
+    args_str, cutoff, calc_kwargs = args
+    return [_worker_descriptor.calc_descriptor(at, args_str, cutoff, **calc_kwargs) for at in frames]
+
+
+def _count_rows(frame_data):
+    """Number of descriptors in the output of calc_descriptor(), which is [] if there are none"""
+    return len(frame_data) if np.size(frame_data) > 0 else 0
+
+
+def _write_npy_header(fileobj, shape, dtype):
+    """Writes the header of a C ordered .npy file at the position of fileobj, returns its end"""
+    np.lib.format.write_array_header_1_0(fileobj, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                   'fortran_order': False, 'shape': shape})
+    return fileobj.tell()
+
+
+class DescriptorSet:
+
+    def __init__(self, descriptors, neighbour_skin=None, dtype=np.float64):
+        """
+        Set of descriptors evaluated together on the same Atoms object.
+
+        The Atoms object is converted once, and a single neighbour list is built with
+        the largest cutoff of the set, which is then used by all of the descriptors.
+
+        descriptors: list of descriptor strings, or dict of names and descriptor strings.
+            The results are returned in dicts with these names as keys, which are the
+            descriptor strings themselves if a list is given.
+        neighbour_skin: Verlet skin of the neighbour list, see Descriptor
+        dtype: floating point type of the descriptor values, see Descriptor
+        """
+
+        if not isinstance(descriptors, dict):
+            descriptors = dict([(desc_str, desc_str) for desc_str in descriptors])
+
+        self.neighbour_skin = neighbour_skin
+        self.descriptors = dict([(name, Descriptor(desc_str, neighbour_skin=neighbour_skin, dtype=dtype))
+                                 for name, desc_str in descriptors.items()])
+
+        # all the descriptors share the state of the connectivity
+        self._connect_cache = _ConnectCache()
+        for desc in self.descriptors.values():
+            desc._connect_cache = self._connect_cache
+
+        self._quip_atoms = None
+
+    def __len__(self):
+        return len(self.descriptors)
+
+    def cutoff(self):
+        return max([desc.cutoff() for desc in self.descriptors.values()])
+
+    def _ase_to_quip(self, at):
+        if (self.neighbour_skin is not None and self._quip_atoms is not None and
+                np.any(np.asarray(self._quip_atoms.is_periodic, dtype=bool) != at.get_pbc())):
+            self._quip_atoms = None
+        self._quip_atoms = quippy.convert.ase_to_quip(at, quip_atoms=self._quip_atoms)
+        return self._quip_atoms
+
+    @convert_atoms_types_iterable_method
+    def _calc_connect(self, at, cutoff=None):
+        """
+        Connectivity for all of the descriptors, with the largest cutoff (+1 as in Descriptor)
+        """
+        if cutoff is None:
+            cutoff = max(at.cutoff, self.cutoff() + 1)
+        # the first descriptor does it for all, the cache is shared
+        next(iter(self.descriptors.values()))._calc_connect(at, cutoff)
+
+    @convert_atoms_types_iterable_method
+    def calc_descriptor(self, at, args_str=None, cutoff=None, **calc_kwargs):
+        """
+        Calculates all descriptors of the set, returns a dictionary of the arrays of descriptor
+        values, see Descriptor.calc_descriptor()
+        """
+        self._calc_connect(at, cutoff)
+        return dict([(name, desc.calc_descriptor(at, args_str, at.cutoff, **calc_kwargs))
+                     for name, desc in self.descriptors.items()])
+
+    @convert_atoms_types_iterable_method
+    def calc(self, at, grad=False, args_str=None, cutoff=None, store=None, **calc_kwargs):
+        """
+        Calculates all descriptors of the set, returns a dictionary of the results of
+        Descriptor.calc() for each of them
+        """
+        self._calc_connect(at, cutoff)
+        return dict([(name, desc.calc(at, grad, args_str, at.cutoff, **calc_kwargs))
+                     for name, desc in self.descriptors.items()])
+
+
+def _get_mono_value(desc_data_mono, key):
+    """Returns an attribute of a descriptor_data_mono object, None if it is not allocated"""
+    try:
+        return getattr(desc_data_mono, key)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _unpack_descriptor_data(descriptor_out_raw, count, n_cross, n_dim, grad, dtype=np.float64):
+    """
+    Unpacks the descriptor_data object returned by the Fortran calc() into numpy arrays.
+
+    The output arrays are allocated from the sizes of the descriptor, and the values of
+    each descriptor_data_mono object are copied into their slices, the gradient ones
+    only if `grad` is True. The gradient arrays, including has_grad_data, are flat over
+    the gradients of all descriptors, in the order of grad_index_0based. Descriptor
+    values and gradients are converted to `dtype` as they are copied.
+    """
+
+    descriptor_out = dict()
+    if count == 0:
+        descriptor_out['data'] = np.array([[]], dtype=dtype)
+        return descriptor_out
+
+    data = np.empty((count, n_dim), dtype=dtype)
+    covariance_cutoff = np.empty(count)
+    has_data = np.empty(count, dtype=bool)
+    ci = []
+    if grad:
+        has_grad_data = np.empty(n_cross, dtype=bool)
+        ii = []
+        n_grad = np.empty(count, dtype=int)
+        grad_data = np.empty((n_cross, 3, n_dim), dtype=dtype)
+        pos = np.empty((n_cross, 3))
+        grad_covariance_cutoff = np.empty((n_cross, 3))
+        offset = 0
+
+    for i in range(count):
+        desc_data_mono = descriptor_out_raw.x[i]
+        data[i, :] = desc_data_mono.data
+        covariance_cutoff[i] = desc_data_mono.covariance_cutoff
+        has_data[i] = desc_data_mono.has_data
+        ci.append(desc_data_mono.ci)
+
+        if grad:
+            ii_mono = _get_mono_value(desc_data_mono, 'ii')
+            if ii_mono is None:
+                n_grad[i] = 0
+                continue
+            n = len(ii_mono)
+            if offset + n > n_cross:
+                raise RuntimeError('Descriptor.calc: more gradients than n_cross={} given by sizes()'.format(n_cross))
+            n_grad[i] = n
+            ii.append(ii_mono)
+            has_grad_data[offset:offset + n] = desc_data_mono.has_grad_data
+            # Fortran shapes are (n_dim, 3, n) and (3, n)
+            grad_data[offset:offset + n] = np.transpose(desc_data_mono.grad_data, axes=(2, 1, 0))
+            pos[offset:offset + n] = desc_data_mono.pos.T
+            grad_covariance_cutoff[offset:offset + n] = desc_data_mono.grad_covariance_cutoff.T
+            offset += n
+
+    descriptor_out['data'] = data
+    descriptor_out['covariance_cutoff'] = covariance_cutoff
+    descriptor_out['has_data'] = has_data
+    descriptor_out['ci'] = np.concatenate(ci, axis=0)
+
+    if grad and len(ii) > 0:
+        descriptor_out['has_grad_data'] = has_grad_data[:offset]
+        descriptor_out['ii'] = ii
+        descriptor_out['n_grad'] = n_grad
+        descriptor_out['grad_data'] = grad_data[:offset]
+        descriptor_out['pos'] = pos[:offset]
+        descriptor_out['grad_covariance_cutoff'] = grad_covariance_cutoff[:offset]
+        # same as in py2, pairs of (descriptor, atom) makes iteration of gradient easier
+        descriptor_out['grad_index_0based'] = np.column_stack(
+            [np.repeat(descriptor_out['ci'][:count], n_grad), np.concatenate(ii)]) - 1
+
+    return descriptor_out
@@ -19,6 +19,10 @@
 # HQ X
 # HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 
+import functools
+import math
+import queue
+import threading
 import warnings
 from math import sqrt
 
@@ -27,6 +31,7 @@ import numpy as np
 from quippy import dynamicalsystem_module
 import quippy.convert
 import quippy.atoms_types_module
+import quippy.potential
 
 import _quippy
 
@@ -87,7 +92,7 @@ _barostat_types = {
     'BAROSTAT_HOOVER_LANGEVIN': 1,
 }
 
-__all__ = ['Dynamics', 'DynamicalSystem']
+__all__ = ['Dynamics', 'DynamicalSystem', 'TrajectoryBuffer', 'TrajectoryWriter']
 
 
 class DynamicalSystem(dynamicalsystem_module.DynamicalSystem):
@@ -106,12 +111,45 @@ class DynamicalSystem(dynamicalsystem_module.DynamicalSystem):
 
     def run(self, pot, dt, n_steps, summary_interval=None, hook_interval=None, write_interval=None,
             trajectory=None, args_str=None, hook=None,
-            save_interval=None):
+            save_interval=None, trajectory_writer=None):
+        """
+        Runs `n_steps` of dynamics with the Fortran loop of DynamicalSystem_run(), see
+        Potential.f95. `pot` is a quippy Potential or its Fortran counterpart.
+
+        Without `hook`, the atoms are saved every `save_interval` steps: by default copies
+        are returned as a list, which grows with the run. If `trajectory_writer` is given,
+        they are passed to its write() method instead, and nothing is returned. It can be
+        a :class:`TrajectoryBuffer`, a :class:`TrajectoryWriter` or a filename, for which
+        a TrajectoryWriter is opened and closed at the end of the run.
+        """
 
         if hook is None and hook_interval is not None:
             raise ValueError('hook_interval not permitted when hook is not present')
-
-        if hook is None:
+        if hook is not None and trajectory_writer is not None:
+            raise ValueError('trajectory_writer not permitted when hook is present')
+
+        if isinstance(pot, quippy.potential.Potential):
+            pot = pot._quip_potential
+
+        if hook is None and trajectory_writer is not None:
+            close_writer = isinstance(trajectory_writer, str)
+            if close_writer:
+                trajectory_writer = TrajectoryWriter(trajectory_writer)
+            at = self.atoms
+            try:
+                dynamicalsystem_module.DynamicalSystem.run(self, pot, dt, n_steps,
+                                                           lambda: trajectory_writer.write(at),
+                                                           hook_interval=save_interval,
+                                                           summary_interval=summary_interval,
+                                                           write_interval=write_interval,
+                                                           trajectory=trajectory,
+                                                           args_str=args_str)
+            finally:
+                if close_writer:
+                    trajectory_writer.close()
+                else:
+                    trajectory_writer.flush()
+        elif hook is None:
             traj = []
             save_hook = lambda: traj.append(self.atoms.copy())
             dynamicalsystem_module.DynamicalSystem.run(self, pot, dt, n_steps,
@@ -129,6 +167,152 @@ class DynamicalSystem(dynamicalsystem_module.DynamicalSystem):
     #run.__doc__ = dynamicalsystem_module.DynamicalSystem.run.__doc__
 
 
+class TrajectoryBuffer(object):
+    """
+    Ring buffer of the per-atom `properties` of the last `n_frames` frames written to it,
+    e.g. by :meth:`DynamicalSystem.run` with `trajectory_writer`. The arrays are allocated
+    on the first write, with shape (n_frames, n_atoms, n_cols), so the number of atoms
+    cannot change. Use :meth:`get_array` to read them back, oldest frame first.
+    """
+
+    def __init__(self, n_frames, properties=('pos', 'velo', 'force')):
+        self.n_frames = n_frames
+        self.properties = list(properties)
+        self.arrays = None
+        self.n_written = 0
+
+    def write(self, at):
+        """Copies the properties of the QUIP Atoms `at` into the buffer, over the oldest frame if it is full"""
+        values = quippy.convert.get_dict_arrays(at.properties, copy=False, keys=self.properties)
+        missing = [name for name in self.properties if name not in values]
+        if missing:
+            raise KeyError('properties {0} not found in Atoms'.format(missing))
+        if self.arrays is None:
+            self.arrays = dict((name, np.empty((self.n_frames,) + values[name].T.shape, dtype=values[name].dtype))
+                               for name in self.properties)
+        i = self.n_written % self.n_frames
+        for name in self.properties:
+            self.arrays[name][i] = values[name].T
+        self.n_written += 1
+
+    def __len__(self):
+        return min(self.n_written, self.n_frames)
+
+    def get_array(self, name):
+        """The frames of property `name` held in the buffer, oldest first"""
+        if self.arrays is None:
+            raise ValueError('nothing written to the buffer yet')
+        if self.n_written <= self.n_frames:
+            return self.arrays[name][:self.n_written]
+        return np.roll(self.arrays[name], -(self.n_written % self.n_frames), axis=0)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TrajectoryWriter(object):
+    """
+    Writes frames of QUIP Atoms to `filename` with :func:`ase.io.write`, as extended XYZ by
+    default, with the cell, pbc, atomic numbers and the per-atom `properties` under their
+    QUIP names, so 'velo' is in QUIP units.
+
+    With `threaded=True`, write() only copies the arrays, and the frames are converted and
+    written by a background thread, overlapping the I/O with the dynamics. At most
+    `max_queue` frames are kept waiting, after which write() blocks until the thread
+    catches up. Errors of the thread are raised by the next write(), flush() or close().
+    A requested property missing from the Atoms raises KeyError from write() itself.
+    """
+
+    def __init__(self, filename, properties=('pos', 'velo', 'force'), format='extxyz', threaded=False,
+                 max_queue=16):
+        self.properties = list(properties)
+        self.format = format
+        self.n_written = 0
+        self._file = open(filename, 'w')
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if threaded:
+            self._queue = queue.Queue(maxsize=max_queue)
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+
+    def write(self, at):
+        """Writes a frame of the QUIP Atoms `at`, or queues a copy of it if threaded"""
+        self._raise_error()
+        frame = self._snapshot(at)
+        if self._queue is None:
+            self._write_frame(frame)
+        else:
+            self._queue.put(frame)
+        self.n_written += 1
+
+    def _snapshot(self, at):
+        values = quippy.convert.get_dict_arrays(at.properties, copy=True, keys=self.properties + ['Z'])
+        missing = [name for name in self.properties if name not in values]
+        if missing:
+            raise KeyError('properties {0} not found in Atoms'.format(missing))
+        return dict(cell=np.array(at.lattice).T, pbc=np.array(at.is_periodic, dtype=bool),
+                    numbers=values.pop('Z'), arrays=values)
+
+    def _write_frame(self, frame):
+        arrays = frame['arrays']
+        if 'pos' in arrays:
+            positions = arrays['pos'].T
+        else:
+            positions = np.zeros((len(frame['numbers']), 3))
+        atoms = ase.Atoms(numbers=frame['numbers'], positions=positions, cell=frame['cell'], pbc=frame['pbc'])
+        for name, value in arrays.items():
+            if name != 'pos':
+                atoms.arrays[name] = value.T
+        ase.io.write(self._file, atoms, format=self.format)
+
+    def _write_loop(self):
+        while True:
+            frame = self._queue.get()
+            try:
+                if frame is not None and self._error is None:
+                    self._write_frame(frame)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+            if frame is None:
+                break
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('writing of trajectory frame failed') from error
+
+    def flush(self):
+        """Waits for the queued frames to be written, and flushes the file"""
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_error()
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._file.close()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
 class Dynamics(optimize.Dynamics):
     """
     Wrapper around :class:`DynamicalSystem` integrator compatible with
@@ -171,7 +355,7 @@ class Dynamics(optimize.Dynamics):
         self.ase_atoms = atoms
 
         if not atoms.has('momenta'):  # so that there is a velocity initialisation on the quip object
-            atoms.set_momenta(np.zeros(len(atoms), 3))
+            atoms.set_momenta(np.zeros((len(atoms), 3)))
         self._quip_atoms = quippy.convert.ase_to_quip(self.ase_atoms)
 
         # add the mass separately, because converter is not doing it
@@ -180,7 +364,7 @@ class Dynamics(optimize.Dynamics):
 
         # initialise accelerations as zero, so that we have the objects in QUIP
         _quippy.f90wrap_atoms_add_property_real_2da(this=self._quip_atoms._handle, name='acc',
-                                                    value=np.zeros(len(atoms), 3))
+                                                    value=np.zeros((len(atoms), 3)))
 
         self._ds = DynamicalSystem(self._quip_atoms)
 
@@ -221,6 +405,10 @@ class Dynamics(optimize.Dynamics):
         self._calc_virial = False
         self._virial = np.zeros((3, 3))
 
+        # the positions of the ASE Atoms are a view of the QUIP ones, see step()
+        self.ase_atoms.arrays['positions'] = self._quip_atoms.pos.T
+        self._synced = True
+
     def get_time(self):
         return float(self._ds.t * fs)
 
@@ -261,6 +449,7 @@ class Dynamics(optimize.Dynamics):
     def call_observers(self):
         for function, interval, args, kwargs in self.observers:
             if self._ds.nsteps % interval == 0:
+                self.sync()
                 function(*args, **kwargs)
 
     def step(self, forces):
@@ -268,6 +457,38 @@ class Dynamics(optimize.Dynamics):
         Advance dynamics by one time-step.
 
         Returns forces at the end of the time-step, suitable for passing to next step()
+
+        Without ASE constraints, the positions of the ASE Atoms are a view of the QUIP
+        positions, and its momenta and the ``atoms.params`` entries are only updated by
+        :meth:`sync`, which is called before the observers and at the end of :meth:`run`.
+        Call it after using step() directly to read the momenta of the ASE Atoms.
+        """
+        if self.ase_atoms.constraints:
+            return self._step_constrained(forces)
+
+        # set current accelerations a(t) using incoming f(t), see _step_constrained()
+        if self._ds.nsteps == 0:
+            self._quip_atoms.acc[:] = forces.T / self._quip_atoms.mass
+
+        # r(t+dt), v(t+dt/2), in place in the QUIP arrays
+        self._ds.advance_verlet1(self._dt, virial=self._virial)
+
+        # the view is fetched again in case the QUIP positions were reallocated
+        self.ase_atoms.arrays['positions'] = self._quip_atoms.pos.T
+        self._synced = False
+
+        # f(t+dt) and v(t+dt)
+        forces = self.ase_atoms.get_forces()
+        if self._calc_virial:
+            self._update_virial()
+        self._ds.advance_verlet2(self._dt, forces.T, virial=self._virial)
+
+        return forces
+
+    def _step_constrained(self, forces):
+        """
+        step() with ASE constraints, which need the momenta of the ASE Atoms to be set
+        after each half step
         """
         # assert (self._ds.atoms.is_same_fortran_object(self._quip_atoms))
 
@@ -292,35 +513,33 @@ class Dynamics(optimize.Dynamics):
         self._ds.advance_verlet1(self._dt, virial=self._virial)
         self.ase_atoms.arrays['momenta'] = self.ase_atoms.get_masses()[:, np.newaxis] * \
                                            quippy.convert.velocities_quip_to_ase(self._quip_atoms.velo)
-        self.ase_atoms.arrays['positions'] = self._quip_atoms.pos.T
 
         # now we have r(t+dt), v(t+1/2dt), p(t+1/2dt), a(t) in ds.atoms
 
-        if self.ase_atoms.constraints:
-            # fixme: there are only ASE constraints, right? I assume so here
-            # keep a copy of new positions r(t+dt) so we don't lose them
-            r_of_t_plus_dt = self._quip_atoms.get_positions()
+        # fixme: there are only ASE constraints, right? I assume so here
+        # keep a copy of new positions r(t+dt) so we don't lose them
+        r_of_t_plus_dt = self._quip_atoms.pos.T.copy()
 
-            # manually revert positions of atoms to r(t)
-            # NB: do not call set_positions() as this applies constraints
-            # tks32: set ase_atoms only, for
-            self.ase_atoms.arrays['positions'] = r_of_t
+        # manually revert positions of atoms to r(t)
+        # NB: do not call set_positions() as this applies constraints
+        # tks32: set ase_atoms only, for
+        self.ase_atoms.arrays['positions'] = r_of_t
 
-            # If there are any ASE constraints, we need to call
-            # set_positions(r(t+dt)) and set_momenta(p(t+dt/2)) to invoke
-            # constraints' adjust_positions() and adjust_forces() routines
+        # If there are any ASE constraints, we need to call
+        # set_positions(r(t+dt)) and set_momenta(p(t+dt/2)) to invoke
+        # constraints' adjust_positions() and adjust_forces() routines
 
-            # set_positions() calls adjust_positions(), which
-            # will recieve correct old and new positions
-            self.ase_atoms.set_positions(r_of_t_plus_dt)
-            self._quip_atoms.pos[:] = r_of_t_plus_dt.T.copy()
-            self._quip_atoms.calc_dists()  # uodates dstance tables in quip, call it on mevement of atoms
+        # set_positions() calls adjust_positions(), which
+        # will recieve correct old and new positions
+        self.ase_atoms.set_positions(r_of_t_plus_dt)
+        self._quip_atoms.pos[:] = self.ase_atoms.positions.T
+        self._quip_atoms.calc_dists()  # uodates dstance tables in quip, call it on mevement of atoms
 
-            # set_momenta() calls adjust_forces() with only the new momenta
-            self.ase_atoms.set_momenta(self.ase_atoms.get_momenta())
+        # set_momenta() calls adjust_forces() with only the new momenta
+        self.ase_atoms.set_momenta(self.ase_atoms.get_momenta())
 
-            # Update velocities v(t+dt/2) for changes in momenta made by the constraints
-            self._quip_atoms.velo[:] = quippy.convert.velocities_ase_to_quip(self.ase_atoms.get_velocities())
+        # Update velocities v(t+dt/2) for changes in momenta made by the constraints
+        self._quip_atoms.velo[:] = quippy.convert.velocities_ase_to_quip(self.ase_atoms.get_velocities())
 
         # Now we have r(t+dt), v(t+dt/2), p(t+dt/2)
 
@@ -332,58 +551,114 @@ class Dynamics(optimize.Dynamics):
 
         # compute the virial if necessary, i.e. if we have a barostat or are doing NPT
         if self._calc_virial:
-            stress = self.ase_atoms.get_stress()
-            virial = -stress * self.ase_atoms.get_volume()
-            self._virial = np.zeros((3, 3))
-            if stress.shape == (3, 3):
-                self._virial[:, :] = virial
-            else:
-                self._virial[0, 0] = virial[0]
-                self._virial[1, 1] = virial[1]
-                self._virial[2, 2] = virial[2]
-                self._virial[1, 2] = self._virial[2, 1] = virial[3]
-                self._virial[0, 2] = self._virial[2, 0] = virial[4]
-                self._virial[0, 1] = self._virial[1, 0] = virial[5]
-            # print 'Computed virial:', self._virial
+            self._update_virial()
 
         # Second half of the Velocity Verlet step
         #   p(t+dt) = p(t+dt/2) + F(t+dt)/2    ->    v(t+dt) = v(t+dt/2) + a(t+dt)/2
         self._ds.advance_verlet2(self._dt, forces.T, virial=self._virial)
-        self.ase_atoms.arrays['momenta'] = self.ase_atoms.get_masses()[:, np.newaxis] * \
-                                           quippy.convert.velocities_quip_to_ase(self._quip_atoms.velo)
 
-        if self.ase_atoms.constraints:
-            # Update momenta, honouring constraints
-            self.ase_atoms.set_momenta(self.ase_atoms.get_momenta())
-            self._quip_atoms.velo[:] = quippy.convert.velocities_ase_to_quip(self.ase_atoms.get_velocities())
+        # Update momenta, honouring constraints
+        self.ase_atoms.set_momenta(self.ase_atoms.get_masses()[:, np.newaxis] *
+                                   quippy.convert.velocities_quip_to_ase(self._quip_atoms.velo))
+        self._quip_atoms.velo[:] = quippy.convert.velocities_ase_to_quip(self.ase_atoms.get_velocities())
 
         # Now we have r(t+dt), v(t+dt), p(t+dt), a(t+dt) in atoms
-
-        # Copy status into atoms.params
-        # TODO: this would nee to go to the new observer, rigth?
-        self._quip_atoms.params['time'] = self._ds.t * fs  # from fs to ASE time units
-        self._quip_atoms.params['nsteps'] = self._ds.nsteps
-        self._quip_atoms.params['cur_temp'] = self._ds.cur_temp
-        self._quip_atoms.params['avg_temp'] = self._ds.avg_temp
-        self._quip_atoms.params['dW'] = self._ds.dw
-        self._quip_atoms.params['work'] = self._ds.work
-        self._quip_atoms.params['Epot'] = self._ds.epot
-        self._quip_atoms.params['Ekin'] = self._ds.ekin
-        self._quip_atoms.params['Wkin'] = self._ds.wkin
-        self._quip_atoms.params['thermostat_dW'] = self._ds.thermostat_dw
-        self._quip_atoms.params['thermostat_work'] = self._ds.thermostat_work
+        self._synced = False
+        self.sync()
 
         # return f(t+dt)
         return forces
 
+    def _update_virial(self):
+        stress = self.ase_atoms.get_stress()
+        virial = -stress * self.ase_atoms.get_volume()
+        self._virial = np.zeros((3, 3))
+        if stress.shape == (3, 3):
+            self._virial[:, :] = virial
+        else:
+            self._virial[0, 0] = virial[0]
+            self._virial[1, 1] = virial[1]
+            self._virial[2, 2] = virial[2]
+            self._virial[1, 2] = self._virial[2, 1] = virial[3]
+            self._virial[0, 2] = self._virial[2, 0] = virial[4]
+            self._virial[0, 1] = self._virial[1, 0] = virial[5]
+        # print 'Computed virial:', self._virial
+
+    def sync(self):
+        """
+        Copies the velocities from QUIP to the momenta of the ASE Atoms, and the status
+        of the dynamics to the params of the QUIP Atoms, if they changed since the last call
+        """
+        if self._synced:
+            return
+        self.ase_atoms.arrays['positions'] = self._quip_atoms.pos.T
+        self.ase_atoms.arrays['momenta'] = self.ase_atoms.get_masses()[:, np.newaxis] * \
+                                           quippy.convert.velocities_quip_to_ase(self._quip_atoms.velo)
+
+        # TODO: this would nee to go to the new observer, rigth?
+        params = self._quip_atoms.params
+        params['time'] = self._ds.t * fs  # from fs to ASE time units
+        params['nsteps'] = self._ds.nsteps
+        params['cur_temp'] = self._ds.cur_temp
+        params['avg_temp'] = self._ds.avg_temp
+        params['dW'] = self._ds.dw
+        params['work'] = self._ds.work
+        params['Epot'] = self._ds.epot
+        params['Ekin'] = self._ds.ekin
+        params['Wkin'] = self._ds.wkin
+        params['thermostat_dW'] = self._ds.thermostat_dw
+        params['thermostat_work'] = self._ds.thermostat_work
+        self._synced = True
+
     def run(self, steps=50):
         """
         Run dynamics forwards for `steps` steps.
         """
-        f = self._quip_atoms.get_forces()
+        f = self.ase_atoms.get_forces()
         for step in range(steps):
             f = self.step(f)
             self.call_observers()
+        self.sync()
+
+    def run_native(self, n_steps, observer_interval=None, args_str=None):
+        """
+        Run dynamics forwards for `n_steps` steps with :meth:`DynamicalSystem.run`,
+        i.e. with the loop of Verlet steps and force calls in Fortran.
+
+        The calculator of the ASE Atoms must be a :class:`quippy.potential.Potential`,
+        which is called on the QUIP Atoms with its `calc_args`, followed by `args_str`.
+        The observers are called every `observer_interval` steps, by default the greatest
+        common divisor of their intervals, and never if there are none, and the loop only
+        returns to Python at these steps. ASE constraints are not supported, and neither
+        are barostats or Langevin NPT thermostats, as no virial is calculated in the loop,
+        nor the `add_arrays` and `add_info` of the calculator.
+        """
+        calc = self.ase_atoms.calc
+        if not isinstance(calc, quippy.potential.Potential):
+            raise TypeError('run_native() needs a quippy Potential as calculator, got {0!r}'.format(calc))
+        if self.ase_atoms.constraints:
+            raise RuntimeError('run_native() does not support ASE constraints, use run() instead')
+        if self._calc_virial:
+            raise RuntimeError('run_native() does not calculate the virial needed by the barostat '
+                               'or NPT thermostat, use run() instead')
+        if calc.add_arrays is not None or calc.add_info is not None:
+            raise RuntimeError('run_native() does not pass add_arrays or add_info to the calculator, '
+                               'use run() instead')
+
+        if observer_interval is None:
+            observer_interval = functools.reduce(math.gcd, [obs[1] for obs in self.observers], 0)
+        calc_args = calc.calc_args
+        if args_str is not None:
+            calc_args += ' ' + args_str
+
+        def hook():
+            self._synced = False
+            self.call_observers()
+
+        self._ds.run(calc, self._dt, n_steps, hook=hook, hook_interval=observer_interval,
+                     summary_interval=0, args_str=calc_args)
+        self._synced = False
+        self.sync()
 
     def print_status(self, file=None):
         self._ds.print_status(self.loglabel, file=file)
@@ -0,0 +1,181 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   https://warwick.ac.uk/fac/sci/eng/staff/jrk
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+
+"""
+Driver side of the persistent FilePot protocol
+
+A FilePot with persistent=T starts its command once, and sends it the configurations
+on its standard input, reading the results from its standard output. See FilePot.f95
+for the format of the messages. A driver only needs a function taking the decoded
+request and returning a dict of results, which is then run with serve():
+
+    def calculate(request):
+        ...
+        return dict(energy=energy, force=forces)
+
+    serve(calculate)
+
+Running this module as a script starts the echo driver, which needs no external code:
+its forces are minus the positions, i.e. a harmonic tether of every atom to the origin.
+
+    FilePot command="python -m quippy.filepot_worker" persistent=T
+"""
+
+import struct
+import sys
+import traceback
+
+import numpy as np
+
+__all__ = ['read_message', 'write_message', 'decode_request', 'encode_results', 'serve', 'echo_calculate']
+
+# 4 character tag and size in bytes of the data of each section
+HEADER = struct.Struct('=4sq')
+END = b'END '
+
+# section tags of the results, and the number of values per atom (0 for global ones)
+RESULT_TAGS = {'energy': (b'ENRG', 0),
+               'local_e': (b'LOCE', 1),
+               'force': (b'FORC', 3),
+               'virial': (b'VIRI', 0),
+               'local_virial': (b'LVIR', 9)}
+
+
+def _read_exactly(stream, n):
+    data = stream.read(n)
+    if len(data) != n:
+        raise EOFError('connection closed after {0} of {1} bytes'.format(len(data), n))
+    return data
+
+
+def read_message(stream, header_struct=HEADER):
+    """
+    Reads a message from a binary stream, as a dict of section tags and data bytes.
+    Returns None if the stream is closed before the start of a message.
+    """
+    header = stream.read(header_struct.size)
+    if len(header) == 0:
+        return None
+    sections = dict()
+    while True:
+        if len(header) != header_struct.size:
+            raise EOFError('connection closed in a section header')
+        tag, size = header_struct.unpack(header)
+        if tag == END:
+            return sections
+        sections[tag] = _read_exactly(stream, size)
+        header = stream.read(header_struct.size)
+
+
+def write_message(stream, sections, header_struct=HEADER):
+    """Writes a message of (tag, data bytes) pairs to a binary stream and flushes it"""
+    for tag, data in sections:
+        stream.write(header_struct.pack(tag, len(data)))
+        stream.write(data)
+    stream.write(header_struct.pack(END, 0))
+    stream.flush()
+
+
+def decode_request(sections):
+    """
+    Decodes the sections of a request, into a dict with the keys
+
+    args_str: calc args_str
+    want: list of the quantities needed, out of energy, local_e, force, virial and local_virial
+    cell: (3, 3) array of the lattice vectors, as rows
+    pbc: (3,) bool array
+    numbers: (N,) int array of the atomic numbers
+    positions: (N, 3) array
+    xyz: the configuration as extended XYZ text, if the FilePot has persistent_xyz=T, else None
+    """
+    want = sections.get(b'WANT', b'').decode()
+    numbers = np.frombuffer(sections[b'Z   '], dtype=np.int32).astype(int)
+    xyz = sections.get(b'XYZ ')
+    return dict(args_str=sections.get(b'ARGS', b'').decode(),
+                want=[key for key in want.split(':') if key],
+                cell=np.frombuffer(sections[b'CELL'], dtype=np.float64).reshape(3, 3),
+                pbc=np.frombuffer(sections[b'PBC '], dtype=np.int32) != 0,
+                numbers=numbers,
+                positions=np.frombuffer(sections[b'POS '], dtype=np.float64).reshape(len(numbers), 3),
+                xyz=None if xyz is None else xyz.decode())
+
+
+def encode_results(results, n_atoms, byteorder='='):
+    """
+    Encodes a dict of results as message sections. Per-atom arrays have shapes (N,), (N, 3)
+    and (N, 9) for local_e, force and local_virial, the virial is a (3, 3) array. A 'xyz'
+    key may hold extended XYZ text for the read_extra_property_list and read_extra_param_list
+    of the FilePot. `byteorder` is the numpy byte order of the numbers, native by default.
+    """
+    sections = []
+    for key, (tag, per_atom) in RESULT_TAGS.items():
+        if results.get(key) is None:
+            continue
+        value = np.asarray(results[key], dtype=byteorder + 'f8')
+        if key == 'virial':
+            value = value.reshape(3, 3).T
+        elif per_atom > 0:
+            value = value.reshape(n_atoms, per_atom)
+        sections.append((tag, np.ascontiguousarray(value).tobytes()))
+    if results.get('xyz') is not None:
+        sections.append((b'XYZ ', results['xyz'].encode()))
+    return sections
+
+
+def serve(calculate, stdin=None, stdout=None):
+    """
+    Answers requests until the input is closed. `calculate` is called with each decoded
+    request, see decode_request(), and returns a dict of results, see encode_results().
+    Exceptions are sent back as errors, which are raised by the FilePot.
+
+    Anything printed by `calculate` would corrupt the replies, so sys.stdout is redirected
+    to sys.stderr while serving.
+    """
+    stdin = sys.stdin.buffer if stdin is None else stdin
+    stdout = sys.stdout.buffer if stdout is None else stdout
+
+    saved_stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        while True:
+            sections = read_message(stdin)
+            if sections is None:
+                break
+            try:
+                request = decode_request(sections)
+                reply = encode_results(calculate(request), len(request['numbers']))
+            except Exception:
+                reply = [(b'ERR ', traceback.format_exc().encode())]
+            write_message(stdout, reply)
+    finally:
+        sys.stdout = saved_stdout
+
+
+def echo_calculate(request):
+    """Harmonic tether of every atom to the origin, with unit spring constant"""
+    pos = request['positions']
+    local_e = 0.5 * np.sum(pos ** 2, axis=1)
+    forces = -pos
+    local_virial = np.einsum('ij,ik->ijk', pos, forces).reshape(len(pos), 9)
+    return dict(energy=local_e.sum(), local_e=local_e, force=forces,
+                virial=local_virial.sum(axis=0).reshape(3, 3), local_virial=local_virial)
+
+
+if __name__ == '__main__':
+    serve(echo_calculate)
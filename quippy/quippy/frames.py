@@ -0,0 +1,187 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   https://warwick.ac.uk/fac/sci/eng/staff/jrk
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+
+"""
+Fast reading of many frames of extended XYZ files as numpy arrays
+
+read_frames() reads the selected properties of a set of frames with the memory-mapped
+reader of libAtoms (xyz.c), without creating Atoms objects. The fields of the other
+properties are skipped without being parsed. The per-atom arrays of all the frames are
+concatenated, and frame i is `arrays[name][offsets[i]:offsets[i + 1]]`:
+
+    frames = quippy.frames.read_frames('traj.xyz', index=slice(0, None, 10), properties=['pos', 'force'],
+                                       params=['energy'])
+    pos_10 = frames['arrays']['pos'][frames['offsets'][1]:frames['offsets'][2]]
+
+read_frames_into() reads into arrays given by the caller instead, e.g. (n_frames, n_atoms, 3)
+arrays reused for each chunk of a training set, and iread_frames() reads a file chunk by chunk.
+
+The frames are located with the index of the file (the .idx file), which is kept in
+memory for the most recently used files, and frames with many atoms are parsed with
+OpenMP threads.
+"""
+
+import numpy as np
+
+import quippy
+
+__all__ = ['read_frames', 'read_frames_into', 'iread_frames', 'parse_properties']
+
+# numpy dtype of each extended XYZ property type, species are read as atomic numbers
+PROPERTY_DTYPES = {'R': float, 'I': int, 'L': bool, 'S': int}
+
+
+def parse_properties(properties):
+    """List of (name, type, number of columns) of a Properties string, e.g. 'species:S:1:pos:R:3'"""
+    fields = properties.split(':')
+    if len(fields) % 3 != 0:
+        raise ValueError('bad Properties string {0}'.format(properties))
+    return [(name, ptype, int(ncols)) for name, ptype, ncols in zip(fields[0::3], fields[1::3], fields[2::3])]
+
+
+def _frame_indices(filename, index):
+    n_frame = quippy.xyzframes_module.xyz_frames_count(filename)
+    if index is None:
+        index = slice(None)
+    indices = np.atleast_1d(np.arange(n_frame)[index])
+    if len(indices) == 0:
+        raise ValueError('no frames selected by index {0} out of {1} frames'.format(index, n_frame))
+    return indices.astype(np.int32)
+
+
+def _query_frames(filename, indices):
+    """Numbers of atoms of the frames `indices`, and the properties of the first one as a dict by lower case name"""
+    n_atoms = np.zeros(len(indices), dtype=np.int32)
+    file_properties = quippy.xyzframes_module.query_xyz_frames(filename, indices, n_atoms)
+    if isinstance(file_properties, bytes):
+        file_properties = file_properties.decode()
+    layout = parse_properties(file_properties.strip())
+    return n_atoms, layout
+
+
+def _find_property(layout, name):
+    key = 'species' if name.lower() in ('species', 'numbers') else name.lower()
+    for prop in layout:
+        if prop[0].lower() == key:
+            return prop
+    raise ValueError('property {0} not found in Properties={1}'.format(
+        name, ':'.join('{0}:{1}:{2}'.format(*prop) for prop in layout)))
+
+
+def read_frames_into(filename, out, index=None, params=None):
+    """
+    Reads per-atom properties of the frames `index` of an extended XYZ file straight into
+    the arrays of `out`, without intermediate copies
+
+    :param filename: extended XYZ file, as for read_frames()
+    :param out: dict of property names ('numbers' for the species) and C-contiguous float64
+                arrays, each of (n_frames, n_atoms, ncols) or (n_frames, n_atoms) doubles if
+                all the frames have n_atoms atoms, or (n_total, ncols) or (n_total,) with the
+                frames one after the other, as returned by read_frames(). The property must
+                have ncols columns in every frame.
+    :param index: frame or frames to read, as for read_frames()
+    :param params: names of numeric keys of the comment lines to read, e.g. ['energy']
+    :returns: dict with 'n_atoms', 'offsets', 'cell' and 'params' as for read_frames()
+    """
+    indices = _frame_indices(filename, index)
+    n_atoms, layout = _query_frames(filename, indices)
+    n_total = int(n_atoms.sum())
+
+    names = []
+    ncols = np.zeros(len(out), dtype=np.int32)
+    addresses = np.zeros(len(out), dtype=np.int64)
+    for i, (name, array) in enumerate(out.items()):
+        prop_name, ptype, prop_ncols = _find_property(layout, name)
+        if not isinstance(array, np.ndarray) or array.dtype != np.float64 or not array.flags.c_contiguous \
+                or not array.flags.writeable:
+            raise TypeError('out[{0!r}] must be a writeable C-contiguous float64 array'.format(name))
+        if array.size != n_total * prop_ncols:
+            raise ValueError('out[{0!r}] has {1} values, expecting {2} atoms times {3} columns'.format(
+                name, array.size, n_total, prop_ncols))
+        names.append(prop_name)
+        ncols[i] = prop_ncols
+        addresses[i] = array.ctypes.data
+
+    params = list(params) if params is not None else []
+    lattice = np.zeros((len(indices), 9)).T
+    kwargs = dict()
+    if params:
+        param_data = np.zeros((len(indices), len(params))).T
+        kwargs = dict(params=':'.join(params), param_data=param_data)
+    quippy.xyzframes_module.read_xyz_frames_into(filename, indices, ':'.join(names), addresses, ncols, n_total,
+                                                 lattice, **kwargs)
+
+    return dict(n_atoms=n_atoms.astype(int),
+                offsets=np.concatenate(([0], np.cumsum(n_atoms))),
+                cell=lattice.T.reshape(len(indices), 3, 3),
+                params=dict((name, kwargs['param_data'][i].copy()) for i, name in enumerate(params)))
+
+
+def read_frames(filename, index=None, properties=None, params=None):
+    """
+    Reads the per-atom `properties` of the frames `index` of an extended XYZ file
+
+    :param filename: extended XYZ file, with one number of atoms line and one comment
+                     line per frame and no line prefixes
+    :param index: frame or frames to read, as an int, slice or sequence of ints, counted
+                  from 0 and negative from the end, default is all the frames
+    :param properties: names of the per-atom properties to read, default is all but the
+                       string ones. 'species' is read as atomic numbers, and is returned
+                       as 'numbers'. All frames must have the Properties of the first one.
+    :param params: names of numeric keys of the comment lines to read, e.g. ['energy']
+    :returns: dict with 'arrays', a dict of (n_total, ncols) arrays, or (n_total,) if ncols
+              is 1, 'n_atoms' of each frame, 'offsets' (n_frames + 1,) of the start of each
+              frame in the arrays, 'cell' (n_frames, 3, 3), with the lattice vectors as rows,
+              and 'params', a dict of (n_frames,) arrays, NaN for frames without the key.
+    """
+    indices = _frame_indices(filename, index)
+    n_atoms, layout = _query_frames(filename, indices)
+    if properties is None:
+        selected = [prop for prop in layout if prop[1] != 'S' or prop[0].lower() == 'species']
+    else:
+        selected = [_find_property(layout, name) for name in properties]
+
+    n_total = int(n_atoms.sum())
+    out = dict((name, np.empty((n_total, ncols))) for name, ptype, ncols in selected)
+    frames = read_frames_into(filename, out, indices, params)
+
+    arrays = dict()
+    for name, ptype, ncols in selected:
+        value = out[name]
+        if ptype != 'R':
+            value = value.astype(PROPERTY_DTYPES[ptype])
+        if ncols == 1:
+            value = value[:, 0]
+        arrays['numbers' if ptype == 'S' else name] = value
+    frames['arrays'] = arrays
+    return frames
+
+
+def iread_frames(filename, index=None, properties=None, params=None, chunk_size=1000):
+    """
+    Generator reading the frames `index` `chunk_size` frames at a time, yielding the
+    result of read_frames() for each chunk, with an extra 'indices' of its frames
+    """
+    n_frame = quippy.xyzframes_module.xyz_frames_count(filename)
+    indices = np.atleast_1d(np.arange(n_frame)[slice(None) if index is None else index])
+    for start in range(0, len(indices), chunk_size):
+        chunk = indices[start:start + chunk_size]
+        frames = read_frames(filename, chunk, properties, params)
+        frames['indices'] = chunk
+        yield frames
@@ -24,12 +24,16 @@ ASE-compatible Calculator from a quip-potential object
 
 """
 
+import collections
+import collections.abc
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy as cp
 
 import ase
 import ase.calculators.calculator
 import numpy as np
 import quippy
+import quippy.profiling
 from ase.io.extxyz import key_val_dict_to_str
 from quippy.convert import set_doc
 
@@ -60,6 +64,34 @@ class Potential(ase.calculators.calculator.Calculator):
         mpi_obj=None
         callback=None
         finalise=True
+
+    incremental: bool
+        If True, the Fortran Atoms object is kept between calls of calculate()
+        and only the positions, cell, pbc and numbers which changed are written
+        into it. A new object is only allocated when the number of atoms changes.
+
+    pot1, pot2: Potential
+        Sub-potentials of a sum, with `args_str="Potential Sum"`. With
+        `args_str="Potential Sum concurrent=T"` they are evaluated at the same time on
+        two OpenMP threads, pot2 on a copy of the atoms, see Potential_Sum_Calc.
+
+    neighbour_skin: float
+        Verlet skin (in Angstrom) added to the cutoff of the neighbour list. Implies
+        `incremental=True`, and the neighbour list is kept between calls and only
+        rebuilt when an atom moved by more than half of the skin or the cell changed.
+        The number of calls and rebuilds are reported in
+        `extra_results['config']` as `neighbour_calls` and `neighbour_rebuilds`.
+
+    extra_results_keys: list of str
+        Non-standard results (such as `gap_local_variance`) to keep in `extra_results`,
+        which are copied after each calculation. By default all of them are kept.
+
+    lazy_results: bool
+        If True and `extra_results_keys` is not given, `extra_results['config']` and
+        `extra_results['atoms']` are :class:`LazyResults` mappings instead of dicts, which
+        only copy a result out of the Fortran Atoms object when it is first read. With
+        `incremental=True` the ones which were not read are gone after the next
+        calculation, as the Fortran object is reused.
     """)
     def __init__(self, args_str="",
                  pot1=None, pot2=None,
@@ -67,9 +99,17 @@ class Potential(ase.calculators.calculator.Calculator):
                  param_filename=None,
                  atoms=None,
                  calculation_always_required=False, calc_args=None,
-                 add_arrays=None, add_info=None, **kwargs):
+                 add_arrays=None, add_info=None, incremental=False, neighbour_skin=None,
+                 extra_results_keys=None, lazy_results=False, **kwargs):
         quippy.potential_module.Potential.__init__.__doc__
 
+        # arguments needed to make an identical potential in a worker process, see calculate_many()
+        if pot1 is None and pot2 is None:
+            self._init_args = dict(args_str=args_str, param_str=param_str, param_filename=param_filename,
+                                   calc_args=calc_args, add_arrays=add_arrays, add_info=add_info)
+        else:
+            self._init_args = None
+
         self._default_properties = ['energy', 'forces']
         self.calculation_always_required = calculation_always_required
 
@@ -93,6 +133,12 @@ class Potential(ase.calculators.calculator.Calculator):
 
         # init the quip atoms as None, to have the variable
         self._quip_atoms = None
+        self.incremental = incremental or neighbour_skin is not None
+        self.extra_results_keys = None if extra_results_keys is None else set(extra_results_keys)
+        self.lazy_results = lazy_results
+        self.neighbour_skin = neighbour_skin
+        self._neighbour_calls = 0
+        self._neighbour_rebuilds = 0
         # init the info and array keys that need to be added when converting atoms objects
         self.add_arrays = add_arrays
         self.add_info = add_info
@@ -106,6 +152,9 @@ class Potential(ase.calculators.calculator.Calculator):
         elif calc_args is None:
             calc_args = ""
         self.calc_args = calc_args
+        # args_str of calculate() for each combination of properties and arguments, see _calc_args_str(),
+        # the strings themselves, not their parsed values, least recently used first
+        self._calc_args_cache = collections.OrderedDict()
         
         # storage of non-standard results
         self.extra_results = {'config': {},
@@ -149,7 +198,8 @@ class Potential(ase.calculators.calculator.Calculator):
     Arrays can also be passed directly to the Fortran routine using
     the `forces`, `virial`, `local_energy`, `local_virial`
     arguments. These should be pre-allocated as Fortran-contigous arrays,
-    e.g. `forces = np.zeros((len(atoms), 3), order='F')`.
+    e.g. `forces = np.zeros((3, len(atoms)), order='F')`. The results are
+    then views of these arrays, so they are overwritten by the next call.
 
     If present, `vol_per_atom` is used to convert from local_virial to per-atom
     stresses; this can either be a scalar or the name of an array in
@@ -159,6 +209,9 @@ class Potential(ase.calculators.calculator.Calculator):
     
     Non-standard calculation results (such as `gap_local_variance`) are stored in 
     `self.extra_results`.
+
+    The time spent in each phase of the calculation can be measured with
+    `quippy.profiling.Profile`.
     
     """)
     def calculate(self, atoms=None, properties=None, system_changes=None,
@@ -217,14 +270,171 @@ class Potential(ase.calculators.calculator.Calculator):
         # call the base class method, which updates self.atoms to atoms
         ase.calculators.calculator.Calculator.calculate(self, atoms, properties, system_changes)
 
+        # reset all extra results on each new calculation. When the Fortran object is reused, the
+        # lazy results of the previous calculation which were not read yet can not be read any more
+        if self.incremental:
+            for section in self.extra_results.values():
+                if isinstance(section, LazyResults):
+                    section.invalidate()
         self.extra_results = {'config': {},
-                              'atoms': {}} # reset all extra results on each new calculation       
+                              'atoms': {}}
 
         # construct the quip atoms object which we will use to calculate on
         # if add_arrays/add_info given to this object is not None, then OVERWRITES the value set in __init__
-        self._quip_atoms = quippy.convert.ase_to_quip(self.atoms,
-                                                      add_arrays=add_arrays if add_arrays is not None else self.add_arrays,
-                                                      add_info=add_info if add_info is not None else self.add_info)
+        if self.neighbour_skin is not None and self._quip_atoms is not None:
+            # the neighbour list is only checked against displacements and cell changes, so start over if
+            # pbc changed. Without system_changes, e.g. when called directly, the pbc are compared instead
+            if system_changes is not None:
+                pbc_changed = 'pbc' in system_changes
+            else:
+                pbc_changed = np.any(np.asarray(self._quip_atoms.is_periodic, dtype=bool) != self.atoms.pbc)
+            if pbc_changed:
+                self._quip_atoms = None
+
+        with quippy.profiling.phase('convert'):
+            add_arrays = add_arrays if add_arrays is not None else self.add_arrays
+            add_info = add_info if add_info is not None else self.add_info
+            if self.incremental and self._quip_atoms is not None:
+                # update the previous object in place, which also removes the results of the last calculation
+                self._quip_atoms = quippy.convert.ase_to_quip(self.atoms, quip_atoms=self._quip_atoms,
+                                                              add_arrays=add_arrays, add_info=add_info,
+                                                              system_changes=system_changes)
+            else:
+                self._quip_atoms = quippy.convert.ase_to_quip(self.atoms, add_arrays=add_arrays, add_info=add_info)
+
+        with quippy.profiling.phase('calc_args'):
+            args_str = self._calc_args_str(properties, calc_args, kwargs)
+
+        if self.neighbour_skin is not None and self._quip_potential.cutoff() > 0.0:
+            with quippy.profiling.phase('neighbour_list'):
+                # update the connectivity here, so that we know if it was rebuilt, and not again in Fortran
+                self._quip_atoms.set_cutoff(self._quip_potential.cutoff(), cutoff_skin=self.neighbour_skin)
+                # the optional outputs of calc_connect() are returned in the order of its arguments
+                max_pos_change, did_rebuild = self._quip_atoms.calc_connect()
+                self._neighbour_calls += 1
+                if did_rebuild:
+                    self._neighbour_rebuilds += 1
+            args_str += ' do_calc_connect=F'
+
+        # fixme: workaround to get the calculated energy, because the wrapped dictionary is not handling that float well
+        ener_dummy = np.zeros(1, dtype=float)
+
+        # the calculation itself
+        # print('Calling QUIP Potential.calc() with args_str "{}"'.format(args_str))
+        with quippy.profiling.phase('calc'):
+            self._quip_potential.calc(self._quip_atoms, args_str=args_str, energy=ener_dummy, **_dict_args)
+
+        with quippy.profiling.phase('results'):
+            # retrieve data from _quip_atoms.properties and _quip_atoms.params
+            # these are read-only views of the Fortran arrays, every result kept is copied exactly once below,
+            # with lazy_results only the standard results and the extra_results_keys are taken now
+            _quip_property_keys = quippy.convert.get_dict_keys(self._quip_atoms.properties)
+            _quip_param_keys = quippy.convert.get_dict_keys(self._quip_atoms.params)
+            _lazy = self.lazy_results and self.extra_results_keys is None
+            if self.extra_results_keys is not None or _lazy:
+                _extra_keys = self.extra_results_keys if self.extra_results_keys is not None else set()
+                _quip_properties = quippy.convert.get_dict_arrays(self._quip_atoms.properties, copy=False,
+                                                                  keys=_extra_keys | {'force', 'local_energy',
+                                                                                      'local_virial'})
+                _quip_params = quippy.convert.get_dict_arrays(self._quip_atoms.params, copy=False,
+                                                              keys=_extra_keys | {'virial'})
+            else:
+                _quip_properties = quippy.convert.get_dict_arrays(self._quip_atoms.properties, copy=False)
+                _quip_params = quippy.convert.get_dict_arrays(self._quip_atoms.params, copy=False)
+
+            self.results['energy'] = ener_dummy[0]
+            self.results['free_energy'] = self.results['energy']
+
+            # process potential output to ase.properties
+            # not handling energy here, because that is always returned by the potential above
+            # arrays passed in by the caller have been filled by Fortran already, they are used without a copy
+            if 'virial' in _dict_args:
+                self.extra_results['config']['virial'] = _dict_args['virial']
+            elif 'virial' in _quip_params.keys():
+                self.extra_results['config']['virial'] = np.copy(_quip_params['virial'])
+            if 'virial' in self.extra_results['config']:
+                stress = -self.extra_results['config']['virial'] / self.atoms.get_volume()
+                # convert to 6-element array in Voigt order
+                self.results['stress'] = np.array([stress[0, 0], stress[1, 1], stress[2, 2],
+                                                   stress[1, 2], stress[0, 2], stress[0, 1]])
+
+            if 'force' in _dict_args:
+                self.results['forces'] = _dict_args['force'].T
+            elif 'force' in _quip_properties.keys():
+                self.results['forces'] = np.copy(_quip_properties['force'].T)
+
+            if 'local_energy' in _dict_args:
+                self.results['energies'] = _dict_args['local_energy']
+            elif 'local_energy' in _quip_properties.keys():
+                self.results['energies'] = np.copy(_quip_properties['local_energy'])
+            if 'local_energy' in _dict_args or 'local_energy' in _quip_properties.keys():
+                self.extra_results['atoms']['local_energy'] = self.results['energies']
+
+            if 'local_virial' in _dict_args:
+                self.extra_results['atoms']['local_virial'] = _dict_args['local_virial']
+            elif 'local_virial' in _quip_properties.keys():
+                self.extra_results['atoms']['local_virial'] = np.copy(_quip_properties['local_virial'])
+
+            if 'stresses' in properties:
+                # use the correct atomic volume
+                if vol_per_atom is not None:
+                    if vol_per_atom in self.atoms.arrays.keys():
+                        # case of reference to a column in atoms.arrays
+                        _v_atom = self.atoms.arrays[vol_per_atom]
+                    else:
+                        # try for case of a given volume
+                        try:
+                            _v_atom = float(vol_per_atom)
+                        except ValueError:
+                            # cannot convert to float, so wrong
+                            raise ValueError('volume_per_atom: not found in atoms.arrays.keys() and cannot utilise value '
+                                             'as given atomic volume')
+                else:
+                    # just use average
+                    _v_atom = self.atoms.get_volume() / self._quip_atoms.n
+                self.results['stresses'] = -self.extra_results['atoms']['local_virial'].T.reshape((self._quip_atoms.n, 3, 3),
+                                                                                                  order='F') / _v_atom
+
+            # all non-standard results now go in self.extra_results
+            _skip_keys = set(list(self.results.keys()) + ['Z', 'pos', 'species',
+                                                          'map_shift', 'n_neighb',
+                                                          'force', 'local_energy',
+                                                          'local_virial', 'velo'])
+            if not _lazy:
+                # any other params (per-config properties)
+                for param, val in _quip_params.items():
+                    if param not in _skip_keys:
+                        self.extra_results['config'][param] = _copy_param(val)
+
+                # any other arrays (per-atom properties)
+                for prop, val in _quip_properties.items():
+                    if prop not in _skip_keys:
+                        self.extra_results['atoms'][prop] = _copy_property(val)
+            else:
+                # all of them, but only copied when read
+                self.extra_results['config'] = LazyResults(self._quip_atoms, 'params', _copy_param,
+                                                           [key for key in _quip_param_keys if key not in _skip_keys],
+                                                           self.extra_results['config'])
+                self.extra_results['atoms'] = LazyResults(self._quip_atoms, 'properties', _copy_property,
+                                                          [key for key in _quip_property_keys if key not in _skip_keys],
+                                                          self.extra_results['atoms'])
+
+            if self.neighbour_skin is not None:
+                self.extra_results['config']['neighbour_calls'] = self._neighbour_calls
+                self.extra_results['config']['neighbour_rebuilds'] = self._neighbour_rebuilds
+
+    def _calc_args_str(self, properties, calc_args, kwargs):
+        """
+        Argument string of the Fortran calc() for the properties and arguments of calculate().
+        It is only built once for each combination of them, and then looked up. Only the string
+        is cached here: it is parsed by the Fortran calc(), which skips the parse when it gets
+        the same string as in its previous call.
+        """
+        key = _calc_args_key(self.calc_args, properties, calc_args, kwargs)
+        args_str = self._calc_args_cache.get(key) if key is not None else None
+        if args_str is not None:
+            self._calc_args_cache.move_to_end(key)
+            return args_str
 
         # constructing args_string with automatically aliasing the calculateable non-quippy properties
         # calc_args string to be passed to Fortran code
@@ -248,74 +458,116 @@ class Potential(ase.calculators.calculator.Calculator):
             args_str += ' force'
         # TODO: implement 'elastic_constants', 'unrelaxed_elastic_constants', 'numeric_forces'
 
-        # fixme: workaround to get the calculated energy, because the wrapped dictionary is not handling that float well
-        ener_dummy = np.zeros(1, dtype=float)
+        if key is not None:
+            if len(self._calc_args_cache) >= _CALC_ARGS_CACHE_SIZE:
+                self._calc_args_cache.popitem(last=False)
+            self._calc_args_cache[key] = args_str
+        return args_str
+
+    def calculate_many(self, atoms_list, properties=None, n_workers=None, calc_args=None, **kwargs):
+        """
+        Calculate a list of configurations, returning the results as stacked arrays
+
+        This avoids the per-call overhead of calculate(): the argument string is built once, the
+        Fortran Atoms object is reused between consecutive frames of the same size, and the
+        Fortran routine writes directly into the output arrays.
+
+        atoms_list: list of ase.atoms.Atoms objects
+        properties: list of str
+            Any combination of 'energy', 'free_energy', 'forces', 'virial' and 'stress', default is
+            `self.get_default_properties()`.
+        n_workers: int
+            If larger than one, the frames are split between this many processes,
+            each with its own copy of the potential. Not possible for potentials
+            initialised from pot1 and pot2.
+        calc_args: argument string or dict to pass to Fortran calc() routine, appended to `self.calc_args`.
+
+        Additional keyword arguments are appended to `calc_args`.
+
+        Returns a dictionary of arrays, `energy` with shape (n_frames,), `free_energy` equal to it
+        as in calculate(), `forces` with shape (n_atoms_total, 3), `forces_offsets` with shape
+        (n_frames + 1,) such that the forces of frame `i` are
+        `forces[forces_offsets[i]:forces_offsets[i + 1]]`, `virial` with shape (n_frames, 3, 3)
+        and `stress` with shape (n_frames, 6), as requested.
+        """
 
-        # the calculation itself
-        # print('Calling QUIP Potential.calc() with args_str "{}"'.format(args_str))
-        self._quip_potential.calc(self._quip_atoms, args_str=args_str, energy=ener_dummy, **_dict_args)
-
-        # retrieve data from _quip_atoms.properties and _quip_atoms.params
-        _quip_properties = quippy.convert.get_dict_arrays(self._quip_atoms.properties)
-        _quip_params = quippy.convert.get_dict_arrays(self._quip_atoms.params)
-
-        self.results['energy'] = ener_dummy[0]
-        self.results['free_energy'] = self.results['energy']
-
-        # process potential output to ase.properties
-        # not handling energy here, because that is always returned by the potential above
-        if 'virial' in _quip_params.keys():
-            stress = -_quip_params['virial'].copy() / self.atoms.get_volume()
-            # convert to 6-element array in Voigt order
-            self.results['stress'] = np.array([stress[0, 0], stress[1, 1], stress[2, 2],
-                                               stress[1, 2], stress[0, 2], stress[0, 1]])
-            self.extra_results['config']['virial'] = _quip_params['virial'].copy()
-
-        if 'force' in _quip_properties.keys():
-            self.results['forces'] = np.copy(_quip_properties['force'].T)
-
-        if 'local_energy' in _quip_properties.keys():
-            self.results['energies'] = np.copy(_quip_properties['local_energy'])
-            self.extra_results['atoms']['local_energy'] = np.copy(_quip_properties['local_energy'])
-
-        if 'local_virial' in _quip_properties.keys():
-            self.extra_results['atoms']['local_virial'] = np.copy(_quip_properties['local_virial'])
-
-        if 'stresses' in properties:
-            # use the correct atomic volume
-            if vol_per_atom is not None:
-                if vol_per_atom in self.atoms.arrays.keys():
-                    # case of reference to a column in atoms.arrays
-                    _v_atom = self.atoms.arrays[vol_per_atom]
+        if properties is None:
+            properties = self.get_default_properties()
+        for prop in properties:
+            if prop not in ['energy', 'free_energy', 'forces', 'virial', 'stress']:
+                raise RuntimeError("Don't know how to calculate property '%s' in calculate_many()" % prop)
+
+        if n_workers is not None and n_workers > 1 and len(atoms_list) > 1:
+            if self._init_args is None:
+                raise ValueError('calculate_many() with n_workers > 1 is not possible for a potential '
+                                 'initialised from pot1 and pot2')
+            n_chunks = min(n_workers, len(atoms_list))
+            chunk_size = -(-len(atoms_list) // n_chunks)
+            chunks = [atoms_list[i:i + chunk_size] for i in range(0, len(atoms_list), chunk_size)]
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker_potential,
+                                     initargs=(self._init_args,)) as executor:
+                chunk_results = list(executor.map(_worker_calculate_many, chunks,
+                                                  [(properties, calc_args, kwargs)] * len(chunks)))
+
+            results = {}
+            for key in chunk_results[0].keys():
+                if key == 'forces_offsets':
+                    offsets = [np.zeros(1, dtype=int)]
+                    for chunk_result in chunk_results:
+                        offsets.append(chunk_result[key][1:] + offsets[-1][-1])
+                    results[key] = np.concatenate(offsets)
                 else:
-                    # try for case of a given volume
-                    try:
-                        _v_atom = float(vol_per_atom)
-                    except ValueError:
-                        # cannot convert to float, so wrong
-                        raise ValueError('volume_per_atom: not found in atoms.arrays.keys() and cannot utilise value '
-                                         'as given atomic volume')
-            else:
-                # just use average
-                _v_atom = self.atoms.get_volume() / self._quip_atoms.n
-            self.results['stresses'] = -np.copy(_quip_properties['local_virial']).T.reshape((self._quip_atoms.n, 3, 3),
-                                                                                            order='F') / _v_atom
-
-        # all non-standard results now go in self.extra_results
-        _skip_keys = set(list(self.results.keys()) + ['Z', 'pos', 'species',
-                                                      'map_shift', 'n_neighb',
-                                                      'force', 'local_energy',
-                                                      'local_virial', 'velo'])
-        # any other params (per-config properties)
-        for param, val in _quip_params.items():
-            if param not in _skip_keys:
-                self.extra_results['config'][param] = cp(val)
-
-        # any other arrays (per-atom properties)
-        for prop, val in _quip_properties.items():
-            if prop not in _skip_keys:
-                # transpose before copying because of setting `order=C` here; issue#151
-                self.extra_results['atoms'][prop] = np.copy(val.T, order='C')
+                    results[key] = np.concatenate([chunk_result[key] for chunk_result in chunk_results])
+            return results
+
+        # the argument string is the same for all the frames, outputs are passed as arrays so not in it
+        args_str = self.calc_args
+        if calc_args is not None:
+            if isinstance(calc_args, dict):
+                calc_args = key_val_dict_to_str(calc_args)
+            args_str += ' ' + calc_args
+        if kwargs:
+            args_str += ' ' + key_val_dict_to_str(kwargs)
+
+        do_forces = 'forces' in properties
+        do_virial = 'virial' in properties or 'stress' in properties
+
+        n_frames = len(atoms_list)
+        energy = np.zeros(n_frames)
+        offsets = np.zeros(n_frames + 1, dtype=int)
+        offsets[1:] = np.cumsum([len(at) for at in atoms_list])
+        if do_forces:
+            forces = np.zeros((offsets[-1], 3))
+        if do_virial:
+            virial = np.zeros((n_frames, 3, 3))
+
+        quip_atoms = None
+        for i, at in enumerate(atoms_list):
+            # what the previous frame added, e.g. velocities from its momenta, or results, is removed
+            quip_atoms = quippy.convert.ase_to_quip(at, quip_atoms=quip_atoms,
+                                                    add_arrays=self.add_arrays, add_info=self.add_info)
+            _dict_args = {}
+            # transposed views of C-ordered slices are Fortran-contiguous, so they are written to in place
+            if do_forces:
+                _dict_args['force'] = forces[offsets[i]:offsets[i + 1]].T
+            if do_virial:
+                _dict_args['virial'] = virial[i].T
+            self._quip_potential.calc(quip_atoms, args_str=args_str, energy=energy[i:i + 1], **_dict_args)
+
+        results = {'energy': energy}
+        if 'free_energy' in properties:
+            results['free_energy'] = energy.copy()
+        if do_forces:
+            results['forces'] = forces
+            results['forces_offsets'] = offsets
+        if 'virial' in properties:
+            results['virial'] = virial
+        if 'stress' in properties:
+            volumes = np.array([at.get_volume() for at in atoms_list])
+            stress = -virial / volumes[:, np.newaxis, np.newaxis]
+            # Voigt order
+            results['stress'] = stress[:, [0, 1, 2, 1, 0, 0], [0, 1, 2, 2, 2, 1]]
+        return results
 
     def get_virial(self, atoms=None):
         self.get_stress(atoms)
@@ -343,6 +595,106 @@ class Potential(ase.calculators.calculator.Calculator):
         self._default_properties = properties[:]
 
 
+class LazyResults(collections.abc.MutableMapping):
+    """
+    Section of `Potential.extra_results` with results of the Fortran calculation which are
+    only copied out of the Fortran Atoms object when they are first read. `values` holds
+    the results which are already there.
+
+    The Fortran object is kept alive by this mapping, but once it is modified by another
+    calculation, invalidate() is called and the results which were not read yet raise
+    a RuntimeError.
+    """
+
+    def __init__(self, quip_atoms, dict_name, copy, keys, values=None):
+        self._quip_atoms = quip_atoms
+        self._dict_name = dict_name
+        self._copy = copy
+        self._values = dict(values) if values is not None else {}
+        self._pending = [key for key in keys if key not in self._values]
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key not in self._pending:
+            raise KeyError(key)
+        if self._quip_atoms is None:
+            raise RuntimeError("extra result '{0}' was not read before the next calculation, pass "
+                               "extra_results_keys to the Potential to keep it".format(key))
+        fdict = getattr(self._quip_atoms, self._dict_name)
+        value = quippy.convert.get_dict_arrays(fdict, copy=False, keys=[key])[key]
+        self._values[key] = self._copy(value)
+        self._pending.remove(key)
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        if key in self._pending:
+            self._pending.remove(key)
+
+    def __delitem__(self, key):
+        if key in self._pending:
+            self._pending.remove(key)
+        else:
+            del self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values or key in self._pending
+
+    def __iter__(self):
+        return iter(list(self._values) + self._pending)
+
+    def __len__(self):
+        return len(self._values) + len(self._pending)
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, list(self))
+
+    def invalidate(self):
+        """Drops the Fortran object, the results not read yet can not be read any more"""
+        self._quip_atoms = None
+
+
+def _copy_param(value):
+    return cp(value)
+
+
+def _copy_property(value):
+    # transpose before copying because of setting `order=C` here; issue#151
+    return np.copy(value.T, order='C')
+
+
+# potential of a worker process of Potential.calculate_many()
+_worker_potential = None
+
+
+def _init_worker_potential(init_args):
+    global _worker_potential
+    _worker_potential = Potential(**init_args)
+
+
+def _worker_calculate_many(atoms_list, args):
+    properties, calc_args, kwargs = args
+    return _worker_potential.calculate_many(atoms_list, properties=properties, calc_args=calc_args, **kwargs)
+
+
+# number of different argument strings kept by Potential._calc_args_str()
+_CALC_ARGS_CACHE_SIZE = 64
+
+
+def _calc_args_key(default_calc_args, properties, calc_args, kwargs):
+    """Hashable key of the arguments of calculate() which go in the args_str, or None if they are not hashable"""
+    if isinstance(calc_args, dict):
+        calc_args = tuple(sorted(calc_args.items()))
+    key = (default_calc_args, frozenset(properties), calc_args,
+           tuple(sorted(kwargs.items())) if kwargs is not None else None)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
 def _check_arg(arg):
     """Checks if the argument is True bool or string meaning True"""
 
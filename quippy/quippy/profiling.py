@@ -0,0 +1,141 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   https://warwick.ac.uk/fac/sci/eng/staff/jrk
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+
+"""
+Timing of the phases of quippy calls
+
+Within a Profile, the phases of Potential.calculate() (conversion of the ASE Atoms,
+building of the calc args_str, neighbour list, the Fortran calculation and the
+extraction of the results) are timed, and so are the Fortran system_timer() regions,
+such as calc_connect and IP_Calc:
+
+    with quippy.profiling.Profile() as profile:
+        for i in range(100):
+            at.rattle(0.01)
+            at.get_forces()
+    print(profile.to_json())
+
+Outside of a Profile, phase() returns a shared do-nothing context manager, so the
+instrumentation costs a function call and a list lookup.
+"""
+
+import contextlib
+import json
+import time
+
+import quippy
+
+__all__ = ['Profile', 'phase']
+
+# Profiles which are collecting, innermost last
+_active = []
+_null_phase = contextlib.nullcontext()
+
+
+def phase(name):
+    """Context manager timing a phase, in all the active Profiles"""
+    if not _active:
+        return _null_phase
+    return _Phase(name)
+
+
+class _Phase(object):
+    __slots__ = ['name', 't0']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.t0
+        for profile in _active:
+            profile.add(self.name, elapsed)
+        return False
+
+
+class Profile(object):
+    """
+    Collects the wall times and numbers of calls of the quippy phases and, if `fortran`
+    is true, of the Fortran system_timer() regions, while it is entered. Profiles can
+    be nested, in which case the Fortran timers go to the outermost one, and can be
+    entered several times to add up more calls.
+
+    The Fortran timers are only recorded outside of OpenMP parallel regions, and nested
+    Fortran timers are included in the time of the enclosing ones. The times of the
+    Fortran timers are printed as well if `fortran_print` is true.
+    """
+
+    def __init__(self, fortran=True, fortran_print=False):
+        self.fortran = fortran
+        self.fortran_print = fortran_print
+        self.phases = {}
+        self.fortran_timers = {}
+        self.wall_time = 0.0
+        self._t0 = None
+
+    def add(self, name, elapsed):
+        """Adds a call of `elapsed` seconds to the phase `name`"""
+        wall_time, calls = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (wall_time + elapsed, calls + 1)
+
+    def __enter__(self):
+        if self.fortran and not any(profile.fortran for profile in _active):
+            quippy.system_module.timer_records_start(do_print=self.fortran_print)
+        _active.append(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time += time.perf_counter() - self._t0
+        _active.remove(self)
+        if self.fortran and not any(profile.fortran for profile in _active):
+            self._read_fortran_timers()
+            quippy.system_module.timer_records_stop()
+        return False
+
+    def _read_fortran_timers(self):
+        for i in range(1, quippy.system_module.timer_records_n() + 1):
+            name, wall_time, cpu_time, calls = quippy.system_module.timer_record(i)
+            if isinstance(name, bytes):
+                name = name.decode()
+            name = name.strip()
+            previous = self.fortran_timers.get(name, dict(wall_time=0.0, cpu_time=0.0, calls=0))
+            self.fortran_timers[name] = dict(wall_time=previous['wall_time'] + wall_time,
+                                             cpu_time=previous['cpu_time'] + cpu_time,
+                                             calls=previous['calls'] + int(calls))
+
+    def report(self):
+        """The times as a dict, with the phases sorted by decreasing wall time"""
+        phases = sorted(self.phases.items(), key=lambda item: -item[1][0])
+        fortran_timers = sorted(self.fortran_timers.items(), key=lambda item: -item[1]['wall_time'])
+        return dict(wall_time=self.wall_time,
+                    phases=dict((name, dict(wall_time=wall_time, calls=calls))
+                                for name, (wall_time, calls) in phases),
+                    fortran_timers=dict(fortran_timers))
+
+    def to_json(self, filename=None, **kwargs):
+        """Writes the report to `filename` as JSON, or returns it as a string if not given"""
+        kwargs.setdefault('indent', 2)
+        if filename is None:
+            return json.dumps(self.report(), **kwargs)
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, **kwargs)
@@ -0,0 +1,149 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   https://warwick.ac.uk/fac/sci/eng/staff/jrk
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+
+"""
+Reference server for the binary protocol of SocketPot (protocol=2)
+
+Each client keeps one connection open, and sends the cell, pbc, atomic numbers and
+positions only when they changed, so the server keeps them per connection. The
+messages have the same layout as the ones of the persistent FilePot, with little-endian
+numbers, see SocketPot.f95. The calculation is done by a function taking the request
+and returning a dict of results, as for quippy.filepot_worker.serve():
+
+    server = SocketServer(quippy.filepot_worker.echo_calculate)
+    server.start()
+    pot = Potential('SocketPot server_ip=127.0.0.1 server_port={0} protocol=2'.format(server.port))
+"""
+
+import collections
+import socketserver
+import struct
+import threading
+import traceback
+
+import numpy as np
+
+from quippy.filepot_worker import read_message, write_message, encode_results
+
+__all__ = ['SocketServer']
+
+# little-endian version of the FilePot section header
+HEADER = struct.Struct('<4sq')
+# request code and client_id of a new connection, as in quip_send_data()
+HELLO_SIZE = 8
+
+
+class SocketServer(socketserver.ThreadingTCPServer):
+    """
+    Threaded TCP server answering SocketPot requests with `calculate`, which is called
+    with a dict of the request, with the keys of quippy.filepot_worker.decode_request()
+    and the label and client_id. `port=0` picks a free port, see the `port` attribute.
+
+    The number of connections, requests and of each section received are counted,
+    in n_connections, n_requests and sections_received.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, calculate, ip='127.0.0.1', port=0):
+        socketserver.ThreadingTCPServer.__init__(self, (ip, port), _SocketPotHandler)
+        self.calculate = calculate
+        self.n_connections = 0
+        self.n_requests = 0
+        self.sections_received = collections.Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serves in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _count(self, sections=None):
+        with self._lock:
+            if sections is None:
+                self.n_connections += 1
+            else:
+                self.n_requests += 1
+                self.sections_received.update(sections.keys())
+
+
+class _SocketPotHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        hello = self.rfile.read(HELLO_SIZE)
+        if len(hello) != HELLO_SIZE or hello[:1] != b'B':
+            return
+        self.server._count()
+        state = dict(client_id=int(hello[1:]), cell=None, pbc=None, numbers=None, positions=None)
+
+        while True:
+            try:
+                sections = read_message(self.rfile, HEADER)
+            except (EOFError, ConnectionError):
+                break
+            if sections is None:
+                break
+            self.server._count(sections)
+
+            reply = [(b'LABL', sections.get(b'LABL', b''))]
+            try:
+                request = _update_request(state, sections)
+                reply += encode_results(self.server.calculate(request), len(request['numbers']), byteorder='<')
+            except Exception:
+                reply.append((b'ERR ', traceback.format_exc().encode()))
+            write_message(self.wfile, reply, HEADER)
+
+
+def _update_request(state, sections):
+    """Updates the configuration kept for the connection with the arrays sent, and returns the request"""
+    n_atoms = int(np.frombuffer(sections[b'NATM'], dtype='<i4')[0])
+    if b'CELL' in sections:
+        state['cell'] = np.frombuffer(sections[b'CELL'], dtype='<f8').reshape(3, 3)
+    if b'PBC ' in sections:
+        state['pbc'] = np.frombuffer(sections[b'PBC '], dtype='<i4') != 0
+    if b'Z   ' in sections:
+        state['numbers'] = np.frombuffer(sections[b'Z   '], dtype='<i4').astype(int)
+    if b'POS ' in sections:
+        state['positions'] = np.frombuffer(sections[b'POS '], dtype='<f8').reshape(-1, 3)
+    for key in ['cell', 'pbc', 'numbers', 'positions']:
+        if state[key] is None:
+            raise ValueError('{0} was never sent on this connection'.format(key))
+    if len(state['numbers']) != n_atoms or len(state['positions']) != n_atoms:
+        raise ValueError('number of atoms changed to {0} without sending Z and POS'.format(n_atoms))
+
+    want = sections.get(b'WANT', b'').decode()
+    return dict(label=int(np.frombuffer(sections[b'LABL'], dtype='<i4')[0]),
+                client_id=state['client_id'],
+                args_str=sections.get(b'ARGS', b'').decode(),
+                want=[key for key in want.split(':') if key],
+                cell=state['cell'], pbc=state['pbc'], numbers=state['numbers'],
+                positions=state['positions'], xyz=None)
@@ -0,0 +1,312 @@
+/* H0 XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX */
+/* H0 X                                                                            */
+/* H0 X   libAtoms+QUIP: atomistic simulation library                              */
+/* H0 X                                                                            */
+/* H0 X   Portions of this code were written by                                    */
+/* H0 X     Albert Bartok-Partay, Silvia Cereda, Gabor Csanyi, James Kermode,      */
+/* H0 X     Ivan Solt, Wojciech Szlachta, Csilla Varnai, Steven Winfield.          */
+/* H0 X                                                                            */
+/* H0 X   Copyright 2006-2010.                                                     */
+/* H0 X                                                                            */
+/* H0 X   These portions of the source code are released under the GNU General     */
+/* H0 X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html          */
+/* H0 X                                                                            */
+/* H0 X   If you would like to license the source code under different terms,      */
+/* H0 X   please contact Gabor Csanyi, gabor@csanyi.net                            */
+/* H0 X                                                                            */
+/* H0 X   Portions of this code were written by Noam Bernstein as part of          */
+/* H0 X   his employment for the U.S. Government, and are not subject              */
+/* H0 X   to copyright in the USA.                                                 */
+/* H0 X                                                                            */
+/* H0 X                                                                            */
+/* H0 X   When using this software, please cite the following reference:           */
+/* H0 X                                                                            */
+/* H0 X   http://www.libatoms.org                                                  */
+/* H0 X                                                                            */
+/* H0 X  Additional contributions by                                               */
+/* H0 X    Alessio Comisso, Chiara Gattinoni, and Gianpietro Moras                 */
+/* H0 X                                                                            */
+/* H0 XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX */
+
+
+/* async_writer.c
+ *
+ * Writing of trajectory frames in a background thread, so that MD and relaxation
+ * loops do not wait for the formatting, writing and syncing of their output.
+ *
+ * CInOutput hands each frame to the writer as copies of its params, of its selected
+ * properties and of the selected_properties Dictionary, which the writer owns and
+ * finalises once the frame has been written by write_xyz() or write_qtraj(). The
+ * frames wait in a queue of fixed length; when it is full, async_writer_write()
+ * waits for the writer thread to finish a frame, so a slow disk slows down the
+ * simulation rather than filling the memory with copies.
+ *
+ * If writing a frame fails, the frames after it are discarded and the error is
+ * raised by the next call to async_writer_write() or by async_writer_close(). The
+ * writer thread has its own error stack (see error.f95), from which it keeps the
+ * traceback of the failure, so that it is raised with the error in the main thread.
+ */
+
+#include <stdio.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <pthread.h>
+
+#include "libatoms.h"
+
+#define ASYNC_FILENAME_LENGTH 1024
+#define ASYNC_FORMAT_LENGTH 100
+#define ASYNC_ERROR_LENGTH 600
+
+/* CInOutput formats */
+#define ASYNC_XYZ 1
+#define ASYNC_QTRAJ 3
+
+typedef struct {
+  int format;
+  char filename[ASYNC_FILENAME_LENGTH];
+  fortran_t params[SIZEOF_FORTRAN_T], properties[SIZEOF_FORTRAN_T], selected_properties[SIZEOF_FORTRAN_T];
+  double lattice[3][3];
+  int n_atom, frame, append, update_index;
+  char prefix[ASYNC_FORMAT_LENGTH], int_format[ASYNC_FORMAT_LENGTH], real_format[ASYNC_FORMAT_LENGTH],
+    str_format[ASYNC_FORMAT_LENGTH], logical_format[ASYNC_FORMAT_LENGTH];
+} async_frame_t;
+
+typedef struct {
+  pthread_t thread;
+  pthread_mutex_t lock;
+  pthread_cond_t not_empty, not_full;
+  async_frame_t *queue;
+  int queue_length;
+  int head;      /* frame being written, or next to be written */
+  int n_queued;  /* frames in the queue, including the one being written */
+  int sync;      /* fsync() the file after each frame */
+  int closing;
+  int error;     /* first error of the writer thread */
+  int error_frame;
+  char error_filename[ASYNC_FILENAME_LENGTH];
+  char error_info[ASYNC_ERROR_LENGTH];
+} async_writer_t;
+
+static void async_frame_finalise(async_frame_t *frame) {
+  dictionary_finalise(frame->params);
+  dictionary_finalise(frame->properties);
+  dictionary_finalise(frame->selected_properties);
+}
+
+static void async_frame_write(async_writer_t *writer, async_frame_t *frame, int *error) {
+  fortran_t no_estr[SIZEOF_FORTRAN_T];
+  int fd, sync_failed;
+
+  INIT_ERROR;
+
+  if (frame->format == ASYNC_QTRAJ) {
+    write_qtraj(frame->filename, frame->params, frame->properties, frame->selected_properties,
+		frame->lattice, frame->n_atom, frame->frame, frame->append, error);
+  } else {
+    write_xyz(frame->filename, frame->params, frame->properties, frame->selected_properties,
+	      frame->lattice, frame->n_atom, frame->append, frame->prefix, frame->int_format, frame->real_format,
+	      frame->str_format, frame->logical_format, 0, no_estr, frame->update_index, error);
+  }
+  PASS_ERROR;
+
+  if (writer->sync) {
+    fd = open(frame->filename, O_RDONLY);
+    sync_failed = fd == -1 || fsync(fd) != 0;
+    if (fd != -1) close(fd);
+    if (sync_failed) {
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "async_writer: cannot sync %.200s, errno=%d", frame->filename, errno);
+    }
+  }
+}
+
+static void *async_writer_run(void *arg) {
+  async_writer_t *writer = (async_writer_t *) arg;
+  async_frame_t *frame;
+  int error, n;
+  char info[ASYNC_ERROR_LENGTH];
+
+  pthread_mutex_lock(&writer->lock);
+  while (1) {
+    while (writer->n_queued == 0 && !writer->closing)
+      pthread_cond_wait(&writer->not_empty, &writer->lock);
+    if (writer->n_queued == 0) break;
+
+    // the frame keeps its slot until it has been written
+    frame = &writer->queue[writer->head];
+    error = writer->error;
+    pthread_mutex_unlock(&writer->lock);
+
+    if (error == ERROR_NONE) {
+      async_frame_write(writer, frame, &error);
+      if (error != ERROR_NONE) {
+	// take the traceback off the stack of this thread, it is raised again by the main thread
+	c_error_get_string_and_clear_(info, ASYNC_ERROR_LENGTH-1);
+	for (n=ASYNC_ERROR_LENGTH-1; n > 0 && (info[n-1] == ' ' || info[n-1] == '\0'); n--);
+	info[n] = '\0';
+      }
+    }
+    async_frame_finalise(frame);
+
+    pthread_mutex_lock(&writer->lock);
+    if (error != ERROR_NONE && writer->error == ERROR_NONE) {
+      writer->error = error;
+      writer->error_frame = frame->frame;
+      strcpy(writer->error_filename, frame->filename);
+      strcpy(writer->error_info, info);
+    }
+    writer->head = (writer->head + 1) % writer->queue_length;
+    writer->n_queued--;
+    pthread_cond_signal(&writer->not_full);
+  }
+  pthread_mutex_unlock(&writer->lock);
+
+  return NULL;
+}
+
+/* async_writer_open()
+ *
+ * Starts a writer thread with a queue of queue_length frames and returns it in writer.
+ * If sync is true, each file is synced to disk after a frame is written to it.
+ */
+void async_writer_open(int queue_length, int sync, intptr_t *writer, int *error) {
+  async_writer_t *w;
+
+  INIT_ERROR;
+
+  *writer = 0;
+  if (queue_length < 1) {
+    RAISE_ERROR("async_writer_open: queue_length=%d < 1", queue_length);
+  }
+
+  w = (async_writer_t *) calloc(1, sizeof(async_writer_t));
+  if (w == NULL) {
+    RAISE_ERROR("async_writer_open: cannot allocate writer");
+  }
+  w->queue = (async_frame_t *) malloc(queue_length*sizeof(async_frame_t));
+  if (w->queue == NULL) {
+    free(w);
+    RAISE_ERROR("async_writer_open: cannot allocate queue of %d frames", queue_length);
+  }
+  w->queue_length = queue_length;
+  w->sync = sync;
+  w->error = ERROR_NONE;
+  pthread_mutex_init(&w->lock, NULL);
+  pthread_cond_init(&w->not_empty, NULL);
+  pthread_cond_init(&w->not_full, NULL);
+
+  if (pthread_create(&w->thread, NULL, async_writer_run, w) != 0) {
+    pthread_cond_destroy(&w->not_full);
+    pthread_cond_destroy(&w->not_empty);
+    pthread_mutex_destroy(&w->lock);
+    free(w->queue);
+    free(w);
+    RAISE_ERROR("async_writer_open: cannot start writer thread");
+  }
+
+  *writer = (intptr_t) w;
+}
+
+/* async_writer_write()
+ *
+ * Queues a frame to be written with write_xyz() (format 1) or write_qtraj() (format 3),
+ * waiting while the queue is full. The writer takes over the params, properties and
+ * selected_properties Dictionaries, which must not be used by the caller afterwards,
+ * even if an error is raised.
+ */
+void async_writer_write(intptr_t writer, int format, char *filename, fortran_t *params, fortran_t *properties,
+			fortran_t *selected_properties, double lattice[3][3], int n_atom, int frame, int append,
+			char *prefix, char *int_format, char *real_format, char *str_format, char *logical_format,
+			int update_index, int *error) {
+  async_writer_t *w = (async_writer_t *) writer;
+  async_frame_t *slot, given;
+  int failed;
+
+  INIT_ERROR;
+
+  memcpy(given.params, params, sizeof(given.params));
+  memcpy(given.properties, properties, sizeof(given.properties));
+  memcpy(given.selected_properties, selected_properties, sizeof(given.selected_properties));
+
+  if (format != ASYNC_XYZ && format != ASYNC_QTRAJ) {
+    async_frame_finalise(&given);
+    RAISE_ERROR("async_writer_write: format %d cannot be written asynchronously", format);
+  }
+  if (strlen(filename) >= ASYNC_FILENAME_LENGTH || strlen(prefix) >= ASYNC_FORMAT_LENGTH ||
+      strlen(int_format) >= ASYNC_FORMAT_LENGTH || strlen(real_format) >= ASYNC_FORMAT_LENGTH ||
+      strlen(str_format) >= ASYNC_FORMAT_LENGTH || strlen(logical_format) >= ASYNC_FORMAT_LENGTH) {
+    async_frame_finalise(&given);
+    RAISE_ERROR("async_writer_write: filename or format of %.200s too long", filename);
+  }
+
+  pthread_mutex_lock(&w->lock);
+  while (w->n_queued == w->queue_length && w->error == ERROR_NONE) {
+    debug("async_writer_write: queue full, waiting to write frame %d of %s\n", frame, filename);
+    pthread_cond_wait(&w->not_full, &w->lock);
+  }
+  failed = w->error != ERROR_NONE;
+  if (!failed) {
+    slot = &w->queue[(w->head + w->n_queued) % w->queue_length];
+    *slot = given;
+    slot->format = format;
+    strcpy(slot->filename, filename);
+    memcpy(slot->lattice, lattice, sizeof(slot->lattice));
+    slot->n_atom = n_atom;
+    slot->frame = frame;
+    slot->append = append;
+    slot->update_index = update_index;
+    strcpy(slot->prefix, prefix);
+    strcpy(slot->int_format, int_format);
+    strcpy(slot->real_format, real_format);
+    strcpy(slot->str_format, str_format);
+    strcpy(slot->logical_format, logical_format);
+    w->n_queued++;
+    pthread_cond_signal(&w->not_empty);
+  }
+  pthread_mutex_unlock(&w->lock);
+
+  if (failed) {
+    async_frame_finalise(&given);
+    RAISE_ERROR_WITH_KIND(w->error, "async_writer_write: writing frame %d of %.200s failed in the writer thread:\n%s",
+			  w->error_frame, w->error_filename, w->error_info);
+  }
+}
+
+/* async_writer_close()
+ *
+ * Waits for the queued frames to be written, stops the writer thread and frees it.
+ * Raises the error of the writer thread, if there was one.
+ */
+void async_writer_close(intptr_t writer, int *error) {
+  async_writer_t *w = (async_writer_t *) writer;
+  int writer_error, error_frame;
+  char error_filename[ASYNC_FILENAME_LENGTH], error_info[ASYNC_ERROR_LENGTH];
+
+  INIT_ERROR;
+
+  pthread_mutex_lock(&w->lock);
+  w->closing = 1;
+  pthread_cond_signal(&w->not_empty);
+  pthread_mutex_unlock(&w->lock);
+  pthread_join(w->thread, NULL);
+
+  writer_error = w->error;
+  error_frame = w->error_frame;
+  strcpy(error_filename, w->error_filename);
+  strcpy(error_info, w->error_info);
+
+  pthread_cond_destroy(&w->not_full);
+  pthread_cond_destroy(&w->not_empty);
+  pthread_mutex_destroy(&w->lock);
+  free(w->queue);
+  free(w);
+
+  if (writer_error != ERROR_NONE) {
+    RAISE_ERROR_WITH_KIND(writer_error, "async_writer_close: writing frame %d of %.200s failed in the writer thread:\n%s",
+			  error_frame, error_filename, error_info);
+  }
+}
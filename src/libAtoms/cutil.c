@@ -476,6 +476,6 @@ void call_callbackpot_sub_(int* i, int* at) {
 
 // Temp data for error handling routines
 
-char error_h_info[1000];
-int error_h_line;
-int error_h_kind;
+__thread char error_h_info[1000];
+__thread int error_h_line;
+__thread int error_h_kind;
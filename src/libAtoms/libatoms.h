@@ -56,6 +56,7 @@
 #define c_push_error_ c_push_error
 #define c_error_abort_ c_error_abort
 #define c_error_clear_stack_ c_error_clear_stack
+#define c_error_get_string_and_clear_ c_error_get_string_and_clear
 #define c_system_initialise_ c_system_initialise
 #define c_dictionary_initialise_ c_dictionary_initialise
 #define c_dictionary_finalise_ c_dictionary_finalise
@@ -132,10 +133,12 @@ extern void c_push_error_with_info_(char*, char*, int*, int*, size_t, size_t);
 extern void c_push_error_(char*, int*, int*, size_t);
 extern void c_error_abort_(int *);
 extern void c_error_clear_stack_(void);
+extern void c_error_get_string_and_clear_(char*, size_t);
 
-extern char error_h_info[1000];
-extern int error_h_line;
-extern int error_h_kind;
+/* thread-local, like the error stack with OpenMP, see error.f95 */
+extern __thread char error_h_info[1000];
+extern __thread int error_h_line;
+extern __thread int error_h_kind;
 
 /* quippy abort handler */
 
@@ -189,6 +192,8 @@ void lattice_xyz_to_abc_(double lattice[3][3], double cell_lengths[3], double ce
 
 /* xyz.c */
 
+#include <stdint.h>
+
 void read_xyz (char *filename, fortran_t *params, fortran_t *properties, fortran_t *selected_properties, double lattice[3][3], int *n_atom,
 	       int compute_index, int frame, int *range, int string, int string_length, int n_index, int *indices, int *error);
 
@@ -198,6 +203,18 @@ void write_xyz (char *filename, fortran_t *params, fortran_t *properties, fortra
 
 void query_xyz (char *filename, int compute_index, int frame, int *n_frame, int *n_atom, int *error);
 
+void xyz_index_lookup(char *filename, int n_index, int *indices, long *offsets, int *n_atoms, int *n_frame, int *error);
+
+void xyz_mmap_query(char *filename, int n_index, int *indices, int *n_frame, int *n_atoms, char *properties,
+		    int properties_length, int *error);
+
+void xyz_mmap_read(char *filename, int n_index, int *indices, char *columns, int n_data_col, int n_row,
+		   double *data, char *params, int n_param, double *param_data, double *lattice, int *error);
+
+void xyz_mmap_read_into(char *filename, int n_index, int *indices, char *columns, int n_out, intptr_t *addresses,
+			int *out_ncols, int n_row, char *params, int n_param, double *param_data, double *lattice,
+			int *error);
+
 
 /* netcdf.c */
 
@@ -212,6 +229,25 @@ void write_netcdf (char *filename, fortran_t *params, fortran_t *properties, for
 void query_netcdf (char *filename, int *n_frame, int *n_atom, int *n_label, int *n_string, int *error);
 
 
+/* qtraj.c */
+
+void read_qtraj(char *filename, fortran_t *params, fortran_t *properties, fortran_t *selected_properties,
+		double lattice[3][3], int *n_atom, int frame, int *range, int *error);
+void write_qtraj(char *filename, fortran_t *params, fortran_t *properties, fortran_t *selected_properties,
+		 double lattice[3][3], int n_atom, int frame, int append, int *error);
+void query_qtraj(char *filename, int frame, int *n_frame, int *n_atom, int *error);
+
+
+/* async_writer.c */
+
+void async_writer_open(int queue_length, int sync, intptr_t *writer, int *error);
+void async_writer_write(intptr_t writer, int format, char *filename, fortran_t *params, fortran_t *properties,
+			fortran_t *selected_properties, double lattice[3][3], int n_atom, int frame, int append,
+			char *prefix, char *int_format, char *real_format, char *str_format, char *logical_format,
+			int update_index, int *error);
+void async_writer_close(intptr_t writer, int *error);
+
+
 /* cutil.c */
 
 #define MAX_CALLBACKS 200
@@ -0,0 +1,808 @@
+/* H0 XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX */
+/* H0 X                                                                            */
+/* H0 X   libAtoms+QUIP: atomistic simulation library                              */
+/* H0 X                                                                            */
+/* H0 X   Portions of this code were written by                                    */
+/* H0 X     Albert Bartok-Partay, Silvia Cereda, Gabor Csanyi, James Kermode,      */
+/* H0 X     Ivan Solt, Wojciech Szlachta, Csilla Varnai, Steven Winfield.          */
+/* H0 X                                                                            */
+/* H0 X   Copyright 2006-2010.                                                     */
+/* H0 X                                                                            */
+/* H0 X   These portions of the source code are released under the GNU General     */
+/* H0 X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html          */
+/* H0 X                                                                            */
+/* H0 X   If you would like to license the source code under different terms,      */
+/* H0 X   please contact Gabor Csanyi, gabor@csanyi.net                            */
+/* H0 X                                                                            */
+/* H0 X   Portions of this code were written by Noam Bernstein as part of          */
+/* H0 X   his employment for the U.S. Government, and are not subject              */
+/* H0 X   to copyright in the USA.                                                 */
+/* H0 X                                                                            */
+/* H0 X                                                                            */
+/* H0 X   When using this software, please cite the following reference:           */
+/* H0 X                                                                            */
+/* H0 X   http://www.libatoms.org                                                  */
+/* H0 X                                                                            */
+/* H0 X  Additional contributions by                                               */
+/* H0 X    Alessio Comisso, Chiara Gattinoni, and Gianpietro Moras                 */
+/* H0 X                                                                            */
+/* H0 XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX */
+
+/* Read and write Atoms objects in the QUIP binary trajectory format (.qtraj)
+ *
+ * A file is a header, a sequence of records and a trailer:
+ *
+ *   header   "QUIPTRJ\0", int32 version, int32 byte order mark, 16 reserved bytes
+ *   record   int64 size of the record, int32 kind, int32 count, followed by
+ *     frame  int32 n_entry, int32 reserved, double lattice[9] and n_entry entries of
+ *            int64 size, int32 is_property, int32 type, int32 shape[2], int32 name
+ *            length, int32 reserved, the name and the data. count is the number of atoms.
+ *     index  int64 offset of the previous index record (0 if none) and the int64
+ *            offsets of the count frames between the previous index record and this one
+ *   trailer  "QTRJEND\0", int64 number of frames, int64 offset of the last index record
+ *
+ * Numbers are in the byte order of the machine which wrote the file. The names and
+ * data of the entries are padded to multiples of 8 bytes, so the arrays are aligned
+ * in the memory mapped file. An entry holds a params or properties Dictionary entry
+ * as it is in memory, with the Dictionary type and shape, so nothing is lost.
+ *
+ * A frame is appended in place of the trailer, which is then written again after it,
+ * preceded by an index record every QTRAJ_INDEX_BLOCK frames, so appending takes a
+ * constant time. The frame offsets are found by following the chain of index records
+ * back from the trailer and the record sizes after the last one, and are kept in
+ * memory for the most recently used files. If the trailer is missing, e.g. after a
+ * crash while appending, the complete frames are found from the record sizes alone.
+ */
+
+#include <stdio.h>
+#include <stdint.h>
+#include <sys/stat.h>
+#include <stdlib.h>
+#include <string.h>
+#include <strings.h>
+#include <errno.h>
+#include <unistd.h>
+#include <time.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <pthread.h>
+
+#include "libatoms.h"
+
+#define QTRAJ_VERSION 1
+#define QTRAJ_BYTE_ORDER 0x01020304
+#define QTRAJ_HEADER_SIZE 32
+#define QTRAJ_RECORD_SIZE 16
+#define QTRAJ_FRAME_SIZE (QTRAJ_RECORD_SIZE + 8 + 9*8)
+#define QTRAJ_ENTRY_SIZE 32
+#define QTRAJ_TRAILER_SIZE 24
+#define QTRAJ_FRAME 1
+#define QTRAJ_INDEX 2
+#define QTRAJ_INDEX_BLOCK 4096
+#define QTRAJ_INDEX_CACHE_SIZE 4
+#define QTRAJ_FILENAME_LENGTH 1024
+
+#define QTRAJ_PAD(n) (((n) + 7) & ~((int64_t) 7))
+
+#ifdef __APPLE__
+#define QTRAJ_MTIME_NSEC(st) ((long) (st).st_mtimespec.tv_nsec)
+#else
+#define QTRAJ_MTIME_NSEC(st) ((long) (st).st_mtim.tv_nsec)
+#endif
+
+static const char qtraj_magic[8] = "QUIPTRJ";
+static const char qtraj_end_magic[8] = "QTRJEND";
+
+typedef struct {
+  char magic[8];
+  int32_t version, byte_order;
+  int64_t reserved[2];
+} qtraj_header_t;
+
+typedef struct {
+  int64_t size;
+  int32_t kind, count;
+} qtraj_record_t;
+
+typedef struct {
+  int64_t size;
+  int32_t is_property, type, shape[2], name_length, reserved;
+} qtraj_entry_t;
+
+typedef struct {
+  char magic[8];
+  int64_t n_frame, last_index;
+} qtraj_trailer_t;
+
+/* Dictionary entry of a frame being written */
+typedef struct {
+  char key[C_KEY_LEN];
+  int is_property, type, shape[2];
+  void *data;
+  int64_t n_bytes;
+} qtraj_item_t;
+
+/* Frame offsets of a file, valid while its size and modification time are unchanged */
+typedef struct {
+  char filename[QTRAJ_FILENAME_LENGTH];
+  off_t size;
+  time_t mtime;
+  long mtime_nsec;
+  int64_t *offsets;
+  int n_frame;
+  int64_t capacity;
+  int64_t end;        /* end of the last complete record, where the next one goes */
+  int64_t last_index; /* offset of the last index record, 0 if none */
+  int n_indexed;      /* number of frames before the last index record */
+} qtraj_index_t;
+
+static qtraj_index_t qtraj_index_cache[QTRAJ_INDEX_CACHE_SIZE];
+static int qtraj_index_next = 0;
+static pthread_mutex_t qtraj_index_lock = PTHREAD_MUTEX_INITIALIZER;
+
+/* Number of bytes of the data of a Dictionary entry, -1 for types which cannot be stored */
+static int64_t qtraj_data_bytes(int type, int shape[2]) {
+  switch(type) {
+  case(T_NONE):
+    return 0;
+  case(T_INTEGER):
+  case(T_LOGICAL):
+    return sizeof(int);
+  case(T_REAL):
+    return sizeof(double);
+  case(T_COMPLEX):
+    return 2*sizeof(double);
+  case(T_CHAR):
+    return shape[0];
+  case(T_INTEGER_A):
+  case(T_LOGICAL_A):
+    return (int64_t) shape[0]*sizeof(int);
+  case(T_REAL_A):
+    return (int64_t) shape[0]*sizeof(double);
+  case(T_COMPLEX_A):
+    return (int64_t) shape[0]*2*sizeof(double);
+  case(T_CHAR_A):
+    return (int64_t) shape[0]*shape[1];
+  case(T_INTEGER_A2):
+    return (int64_t) shape[0]*shape[1]*sizeof(int);
+  case(T_REAL_A2):
+    return (int64_t) shape[0]*shape[1]*sizeof(double);
+  default:
+    return -1;
+  }
+}
+
+/* Index of the dimension of a property which runs over the atoms */
+static int qtraj_atom_dim(int type) {
+  return (type == T_CHAR_A || type == T_INTEGER_A2 || type == T_REAL_A2) ? 1 : 0;
+}
+
+/* Makes room for n_frame + n offsets, returns 0 if out of memory */
+static int qtraj_reserve(qtraj_index_t *index, int64_t n) {
+  int64_t *offsets, capacity;
+
+  if (index->n_frame + n <= index->capacity) return 1;
+  capacity = 2*(index->n_frame + n) + 1024;
+  offsets = (int64_t *) realloc(index->offsets, capacity*sizeof(int64_t));
+  if (offsets == NULL) return 0;
+  index->offsets = offsets;
+  index->capacity = capacity;
+  return 1;
+}
+
+static int qtraj_append_offset(qtraj_index_t *index, int64_t offset) {
+  if (!qtraj_reserve(index, 1)) return 0;
+  index->offsets[index->n_frame++] = offset;
+  return 1;
+}
+
+static void qtraj_index_clear(qtraj_index_t *index) {
+  free(index->offsets);
+  memset(index, 0, sizeof(qtraj_index_t));
+}
+
+/* Follows the record sizes from pos to end, adding the offsets of the frames to the index.
+ * Returns the end of the last complete record. */
+static int64_t qtraj_walk(char *map, int64_t pos, int64_t end, qtraj_index_t *index, int *ok) {
+  qtraj_record_t record;
+
+  *ok = 1;
+  while (pos + QTRAJ_RECORD_SIZE <= end) {
+    memcpy(&record, map + pos, sizeof(record));
+    if (record.size < QTRAJ_RECORD_SIZE || record.size % 8 != 0 || record.size > end - pos) break;
+    if (record.kind == QTRAJ_FRAME) {
+      if (record.size < QTRAJ_FRAME_SIZE) break;
+      if (!qtraj_append_offset(index, pos)) {
+	*ok = 0;
+	break;
+      }
+    } else if (record.kind != QTRAJ_INDEX)
+      break;
+    pos += record.size;
+  }
+  return pos;
+}
+
+/* Finds the frames of the memory mapped file, from the index records if the trailer is valid */
+static void qtraj_scan(char *filename, char *map, int64_t size, qtraj_index_t *index, int *error) {
+  qtraj_header_t header;
+  qtraj_trailer_t trailer;
+  qtraj_record_t record;
+  int64_t pos, prev, *chain, n_chain, chain_size, *tmp;
+  int64_t trailer_pos, end;
+  int i, ok, trusted;
+
+  INIT_ERROR;
+
+  if (size >= QTRAJ_HEADER_SIZE) memcpy(&header, map, sizeof(header));
+  if (size < QTRAJ_HEADER_SIZE || memcmp(header.magic, qtraj_magic, 8) != 0) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "qtraj_scan: %s is not a QUIP binary trajectory", filename);
+  }
+  if (header.byte_order != QTRAJ_BYTE_ORDER) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "qtraj_scan: %s was written on a machine with a different byte order", filename);
+  }
+  if (header.version > QTRAJ_VERSION) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "qtraj_scan: %s has version %d, newer than %d", filename, header.version, QTRAJ_VERSION);
+  }
+
+  index->n_frame = 0;
+  index->last_index = 0;
+  index->n_indexed = 0;
+
+  // Offsets of the index records, last first
+  trusted = 0;
+  n_chain = 0;
+  chain_size = 0;
+  chain = NULL;
+  trailer_pos = size - QTRAJ_TRAILER_SIZE;
+  if (trailer_pos >= QTRAJ_HEADER_SIZE) {
+    memcpy(&trailer, map + trailer_pos, sizeof(trailer));
+    trusted = memcmp(trailer.magic, qtraj_end_magic, 8) == 0 && trailer.n_frame >= 0;
+  }
+  if (trusted) {
+    prev = trailer.last_index;
+    while (prev != 0) {
+      if (prev < QTRAJ_HEADER_SIZE || prev + QTRAJ_RECORD_SIZE + 8 > trailer_pos) {
+	trusted = 0;
+	break;
+      }
+      memcpy(&record, map + prev, sizeof(record));
+      if (record.kind != QTRAJ_INDEX || record.count < 0 ||
+	  record.size != QTRAJ_RECORD_SIZE + 8 + 8*(int64_t) record.count || prev + record.size > trailer_pos) {
+	trusted = 0;
+	break;
+      }
+      if (n_chain == chain_size) {
+	chain_size = 2*chain_size + 16;
+	tmp = (int64_t *) realloc(chain, chain_size*sizeof(int64_t));
+	if (tmp == NULL) {
+	  free(chain);
+	  RAISE_ERROR("qtraj_scan: cannot allocate memory for the index of %s", filename);
+	}
+	chain = tmp;
+      }
+      chain[n_chain++] = prev;
+      memcpy(&prev, map + prev + QTRAJ_RECORD_SIZE, sizeof(int64_t));
+    }
+  }
+
+  if (trusted) {
+    for (i=n_chain-1; i>=0; i--) {
+      memcpy(&record, map + chain[i], sizeof(record));
+      if (!qtraj_reserve(index, record.count)) {
+	free(chain);
+	RAISE_ERROR("qtraj_scan: cannot allocate memory for the index of %s", filename);
+      }
+      memcpy(index->offsets + index->n_frame, map + chain[i] + QTRAJ_RECORD_SIZE + 8, 8*(size_t) record.count);
+      index->n_frame += record.count;
+    }
+    if (n_chain > 0) {
+      index->last_index = chain[0];
+      index->n_indexed = index->n_frame;
+      memcpy(&record, map + chain[0], sizeof(record));
+      pos = chain[0] + record.size;
+    } else
+      pos = QTRAJ_HEADER_SIZE;
+
+    end = qtraj_walk(map, pos, trailer_pos, index, &ok);
+    if (!ok) {
+      free(chain);
+      RAISE_ERROR("qtraj_scan: cannot allocate memory for the index of %s", filename);
+    }
+    trusted = end == trailer_pos && index->n_frame == trailer.n_frame;
+    index->end = trailer_pos;
+  }
+  free(chain);
+
+  if (!trusted) {
+    // Recover the complete frames, without trusting the index records
+    debug("qtraj_scan: no valid trailer in %s, following the record sizes\n", filename);
+    index->n_frame = 0;
+    index->last_index = 0;
+    index->n_indexed = 0;
+    index->end = qtraj_walk(map, QTRAJ_HEADER_SIZE, size, index, &ok);
+    if (!ok) {
+      RAISE_ERROR("qtraj_scan: cannot allocate memory for the index of %s", filename);
+    }
+  }
+}
+
+/* Index of the file mapped at map, from the cache if it is still valid */
+static void qtraj_index_lookup(char *filename, char *map, struct stat *st, qtraj_index_t **index, int *error) {
+  qtraj_index_t *entry;
+  int i;
+
+  INIT_ERROR;
+
+  *index = NULL;
+  entry = NULL;
+  for (i=0; i<QTRAJ_INDEX_CACHE_SIZE; i++) {
+    if (strcmp(qtraj_index_cache[i].filename, filename) == 0) {
+      entry = &qtraj_index_cache[i];
+      break;
+    }
+  }
+  if (entry != NULL && entry->size == st->st_size && entry->mtime == st->st_mtime &&
+      entry->mtime_nsec == QTRAJ_MTIME_NSEC(*st)) {
+    *index = entry;
+    return;
+  }
+
+  if (entry == NULL) {
+    entry = &qtraj_index_cache[qtraj_index_next];
+    qtraj_index_next = (qtraj_index_next + 1) % QTRAJ_INDEX_CACHE_SIZE;
+  }
+  qtraj_index_clear(entry);
+  if (strlen(filename) >= QTRAJ_FILENAME_LENGTH) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "qtraj_index_lookup: filename %.200s... too long", filename);
+  }
+
+  qtraj_scan(filename, map, st->st_size, entry, error);
+  if (error != NULL && *error != ERROR_NONE) {
+    qtraj_index_clear(entry);
+    PASS_ERROR;
+  }
+  strcpy(entry->filename, filename);
+  entry->size = st->st_size;
+  entry->mtime = st->st_mtime;
+  entry->mtime_nsec = QTRAJ_MTIME_NSEC(*st);
+  *index = entry;
+}
+
+/* Drops the cached index of filename, e.g. when the file is replaced */
+static void qtraj_index_forget(char *filename) {
+  int i;
+
+  for (i=0; i<QTRAJ_INDEX_CACHE_SIZE; i++)
+    if (strcmp(qtraj_index_cache[i].filename, filename) == 0) qtraj_index_clear(&qtraj_index_cache[i]);
+}
+
+/* Maps filename read-only and looks up its index */
+static void qtraj_open(char *filename, char **map, struct stat *st, qtraj_index_t **index, int *error) {
+  int fd;
+
+  INIT_ERROR;
+
+  fd = open(filename, O_RDONLY);
+  if (fd < 0 || fstat(fd, st) != 0) {
+    if (fd >= 0) close(fd);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "qtraj_open: cannot open file %s for reading", filename);
+  }
+  if (st->st_size < QTRAJ_HEADER_SIZE) {
+    close(fd);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "qtraj_open: %s is not a QUIP binary trajectory", filename);
+  }
+  *map = mmap(NULL, st->st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+  if (*map == MAP_FAILED) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "qtraj_open: cannot map file %s, errno=%d", filename, errno);
+  }
+
+  qtraj_index_lookup(filename, *map, st, index, error);
+  if (error != NULL && *error != ERROR_NONE) {
+    munmap(*map, st->st_size);
+    PASS_ERROR;
+  }
+}
+
+static int qtraj_pwrite(int fd, void *buf, size_t n, off_t offset) {
+  ssize_t written;
+
+  while (n > 0) {
+    written = pwrite(fd, buf, n, offset);
+    if (written < 0) {
+      if (errno == EINTR) continue;
+      return 0;
+    }
+    buf = (char *) buf + written;
+    n -= written;
+    offset += written;
+  }
+  return 1;
+}
+
+/* Collects the params and selected properties to be written into items, which are freed on error */
+static void qtraj_collect(fortran_t *params, fortran_t *properties, fortran_t *selected_properties, int n_atom,
+			  qtraj_item_t **items, int *n_item, int *error) {
+  fortran_t *dictionaries[2];
+  int d, i, n, n_selected, tmp_type, tmp_shape[2], tmp_error;
+  void *tmp_data;
+  char *blank;
+  qtraj_item_t *item;
+
+  INIT_ERROR;
+  dictionaries[0] = params;
+  dictionaries[1] = properties;
+
+  *n_item = 0;
+  for (d=0; d<2; d++) {
+    if (dictionaries[d] == NULL) continue;
+    dictionary_get_n(dictionaries[d], &n);
+    *n_item += n;
+  }
+  *items = (qtraj_item_t *) malloc((*n_item > 0 ? *n_item : 1)*sizeof(qtraj_item_t));
+  if (*items == NULL) {
+    RAISE_ERROR("qtraj_collect: cannot allocate memory for %d entries", *n_item);
+  }
+
+#define QTRAJ_COLLECT_FAIL(info, ...) { free(*items); *items = NULL; *n_item = 0; RAISE_ERROR_WITH_KIND(ERROR_IO, info, ## __VA_ARGS__); }
+
+  n_selected = 0;
+  if (selected_properties != NULL) dictionary_get_n(selected_properties, &n_selected);
+
+  *n_item = 0;
+  for (d=0; d<2; d++) {
+    if (dictionaries[d] == NULL) continue;
+    dictionary_get_n(dictionaries[d], &n);
+    for (i=1; i<=n; i++) {
+      item = &(*items)[*n_item];
+      dictionary_query_index(dictionaries[d], &i, item->key, &item->type, item->shape, &item->data, error, C_KEY_LEN);
+      if (error != NULL && *error != ERROR_NONE) {
+	free(*items);
+	*items = NULL;
+	*n_item = 0;
+	PASS_ERROR;
+      }
+
+      // null-terminate the Fortran string
+      item->key[C_KEY_LEN-1] = '\0';
+      blank = strchr(item->key, ' ');
+      if (blank == NULL) {
+	QTRAJ_COLLECT_FAIL("qtraj_collect: key %s not terminated with blank", item->key);
+      }
+      *blank = '\0';
+
+      if (d == 0 && (strcasecmp(item->key, "Lattice") == 0 || strcasecmp(item->key, "Properties") == 0)) continue;
+      if (d == 1 && n_selected != 0) {
+	dictionary_query_key(selected_properties, item->key, &tmp_type, tmp_shape, &tmp_data, &tmp_error, strlen(item->key));
+	CLEAR_ERROR;
+	if (tmp_error != ERROR_NONE) continue;
+      }
+      if (item->type == T_DATA) {
+	debug("qtraj_collect: skipping T_DATA entry %s\n", item->key);
+	continue;
+      }
+
+      item->is_property = d;
+      item->n_bytes = qtraj_data_bytes(item->type, item->shape);
+      if (item->n_bytes < 0) {
+	QTRAJ_COLLECT_FAIL("qtraj_collect: entry %s has unsupported type %d", item->key, item->type);
+      }
+      if (item->n_bytes > 0 && item->data == NULL) {
+	QTRAJ_COLLECT_FAIL("qtraj_collect: NULL pointer for entry %s", item->key);
+      }
+      if (d == 1) {
+	if (item->type != T_INTEGER_A && item->type != T_REAL_A && item->type != T_LOGICAL_A &&
+	    item->type != T_COMPLEX_A && item->type != T_CHAR_A && item->type != T_INTEGER_A2 && item->type != T_REAL_A2) {
+	  QTRAJ_COLLECT_FAIL("qtraj_collect: property %s has type %d which is not an array", item->key, item->type);
+	}
+	if (item->shape[qtraj_atom_dim(item->type)] != n_atom) {
+	  QTRAJ_COLLECT_FAIL("qtraj_collect: property %s has shape [%d %d], not %d atoms", item->key,
+			     item->shape[0], item->shape[1], n_atom);
+	}
+      }
+      (*n_item)++;
+    }
+  }
+
+#undef QTRAJ_COLLECT_FAIL
+}
+
+/* read_qtraj()
+ *
+ * Reads frame (counted from 0) of a binary trajectory into the params and properties
+ * Dictionaries, with only the selected_properties if there are any. range is as for
+ * read_netcdf(): [0 0] for all the atoms, [-1 -1] for none, else the first and last
+ * atoms to read, counted from 1.
+ */
+static void read_qtraj_unlocked(char *filename, fortran_t *params, fortran_t *properties, fortran_t *selected_properties,
+			       double lattice[3][3], int *n_atom, int frame, int *range, int *error) {
+  struct stat st;
+  char *map, *p, key[C_KEY_LEN];
+  qtraj_index_t *index;
+  qtraj_record_t record;
+  qtraj_entry_t entry;
+  int64_t pos, n_bytes, atom_bytes;
+  int i, n_entry, n_file_atom, at_start, n_selected, type, shape[2], tmp_type, tmp_shape[2], tmp_error;
+  void *data, *tmp_data;
+
+  INIT_ERROR;
+
+  qtraj_open(filename, &map, &st, &index, error);
+  PASS_ERROR;
+
+#define QTRAJ_READ_FAIL(info, ...) { munmap(map, st.st_size); RAISE_ERROR_WITH_KIND(ERROR_IO, info, ## __VA_ARGS__); }
+
+  if (frame < 0 || frame >= index->n_frame) {
+    QTRAJ_READ_FAIL("read_qtraj: frame %d out of range 0 <= frame < %d", frame, index->n_frame);
+  }
+
+  pos = index->offsets[frame];
+  memcpy(&record, map + pos, sizeof(record));
+  memcpy(&n_entry, map + pos + QTRAJ_RECORD_SIZE, sizeof(int));
+  memcpy(&(lattice[0][0]), map + pos + QTRAJ_RECORD_SIZE + 8, 9*sizeof(double));
+  n_file_atom = record.count;
+
+  if (range[0] != 0 && range[1] != 0) {
+    if (range[0] == -1 && range[1] == -1) {
+      // special range of [-1, -1] means don't read any atoms, only params and lattice
+      at_start = 0;
+      *n_atom = 0;
+    } else {
+      if (range[0] < 1) {
+	QTRAJ_READ_FAIL("read_qtraj: lower limit of range (%d) must be >= 1", range[0]);
+      }
+      if (range[1] > n_file_atom) {
+	QTRAJ_READ_FAIL("read_qtraj: upper limit of range (%d) must be <= %d", range[1], n_file_atom);
+      }
+      if (range[1] <= range[0]) {
+	QTRAJ_READ_FAIL("read_qtraj: upper limit of range (%d) must be > lower limit (%d)", range[1], range[0]);
+      }
+      at_start = range[0]-1;
+      *n_atom = range[1] - range[0] + 1;
+    }
+  } else {
+    at_start = 0;
+    *n_atom = n_file_atom;
+  }
+
+  n_selected = 0;
+  if (selected_properties != NULL) dictionary_get_n(selected_properties, &n_selected);
+
+  p = map + pos + QTRAJ_FRAME_SIZE;
+  for (i=0; i<n_entry; i++) {
+    if (p + QTRAJ_ENTRY_SIZE > map + pos + record.size) {
+      QTRAJ_READ_FAIL("read_qtraj: frame %d of %s is truncated", frame, filename);
+    }
+    memcpy(&entry, p, sizeof(entry));
+    if (entry.size < QTRAJ_ENTRY_SIZE || p + entry.size > map + pos + record.size ||
+	entry.name_length <= 0 || entry.name_length >= C_KEY_LEN) {
+      QTRAJ_READ_FAIL("read_qtraj: bad entry %d in frame %d of %s", i, frame, filename);
+    }
+    memcpy(key, p + QTRAJ_ENTRY_SIZE, entry.name_length);
+    key[entry.name_length] = '\0';
+    data = p + QTRAJ_ENTRY_SIZE + QTRAJ_PAD(entry.name_length);
+    p += entry.size;
+
+    type = entry.type;
+    shape[0] = entry.shape[0];
+    shape[1] = entry.shape[1];
+    n_bytes = qtraj_data_bytes(type, shape);
+    if (n_bytes < 0 || QTRAJ_ENTRY_SIZE + QTRAJ_PAD(entry.name_length) + n_bytes > entry.size) {
+      QTRAJ_READ_FAIL("read_qtraj: bad entry %s in frame %d of %s", key, frame, filename);
+    }
+
+    if (!entry.is_property) {
+      if (params == NULL) continue;
+      dictionary_add_key(params, key, &type, shape, &tmp_data, error, strlen(key));
+      if (error != NULL && *error != ERROR_NONE) {
+	munmap(map, st.st_size);
+	PASS_ERROR;
+      }
+      if (n_bytes > 0) memcpy(tmp_data, data, n_bytes);
+      continue;
+    }
+
+    if (properties == NULL) continue;
+    if (n_selected != 0) {
+      dictionary_query_key(selected_properties, key, &tmp_type, tmp_shape, &tmp_data, &tmp_error, strlen(key));
+      CLEAR_ERROR;
+      if (tmp_error != ERROR_NONE) continue;
+    }
+
+    // rows at_start to at_start + n_atom - 1 are contiguous in Fortran order
+    atom_bytes = n_file_atom > 0 ? n_bytes/n_file_atom : 0;
+    shape[qtraj_atom_dim(type)] = *n_atom;
+    dictionary_add_key(properties, key, &type, shape, &tmp_data, error, strlen(key));
+    if (error != NULL && *error != ERROR_NONE) {
+      munmap(map, st.st_size);
+      PASS_ERROR;
+    }
+    if (*n_atom > 0) memcpy(tmp_data, (char *) data + at_start*atom_bytes, (*n_atom)*atom_bytes);
+  }
+
+#undef QTRAJ_READ_FAIL
+
+  munmap(map, st.st_size);
+}
+
+/* write_qtraj()
+ *
+ * Writes the params and the selected properties of a configuration as a frame of a
+ * binary trajectory, replacing the file unless append is true, in which case frame
+ * must be the number of frames already in the file.
+ */
+static void write_qtraj_unlocked(char *filename, fortran_t *params, fortran_t *properties, fortran_t *selected_properties,
+				double lattice[3][3], int n_atom, int frame, int append, int *error) {
+  struct stat st;
+  char *map, *buf, *p;
+  qtraj_index_t *index;
+  qtraj_item_t *items;
+  qtraj_header_t header;
+  qtraj_record_t record;
+  qtraj_entry_t entry;
+  qtraj_trailer_t trailer;
+  int64_t size, pos, n_block;
+  int i, fd, n_item, n_entry, new_file;
+
+  INIT_ERROR;
+
+  items = NULL;
+  qtraj_collect(params, properties, selected_properties, n_atom, &items, &n_item, error);
+  PASS_ERROR;
+
+  // Lay out the frame record in memory
+  size = QTRAJ_FRAME_SIZE;
+  for (i=0; i<n_item; i++)
+    size += QTRAJ_ENTRY_SIZE + QTRAJ_PAD((int64_t) strlen(items[i].key)) + QTRAJ_PAD(items[i].n_bytes);
+  buf = (char *) calloc(size, 1);
+  if (buf == NULL) {
+    free(items);
+    RAISE_ERROR("write_qtraj: cannot allocate %ld bytes for frame %d", (long) size, frame);
+  }
+  record.size = size;
+  record.kind = QTRAJ_FRAME;
+  record.count = n_atom;
+  memcpy(buf, &record, sizeof(record));
+  n_entry = n_item;
+  memcpy(buf + QTRAJ_RECORD_SIZE, &n_entry, sizeof(int));
+  memcpy(buf + QTRAJ_RECORD_SIZE + 8, &(lattice[0][0]), 9*sizeof(double));
+  p = buf + QTRAJ_FRAME_SIZE;
+  for (i=0; i<n_item; i++) {
+    memset(&entry, 0, sizeof(entry));
+    entry.name_length = strlen(items[i].key);
+    entry.size = QTRAJ_ENTRY_SIZE + QTRAJ_PAD(entry.name_length) + QTRAJ_PAD(items[i].n_bytes);
+    entry.is_property = items[i].is_property;
+    entry.type = items[i].type;
+    entry.shape[0] = items[i].shape[0];
+    entry.shape[1] = items[i].shape[1];
+    memcpy(p, &entry, sizeof(entry));
+    memcpy(p + QTRAJ_ENTRY_SIZE, items[i].key, entry.name_length);
+    if (items[i].n_bytes > 0)
+      memcpy(p + QTRAJ_ENTRY_SIZE + QTRAJ_PAD(entry.name_length), items[i].data, items[i].n_bytes);
+    p += entry.size;
+  }
+  free(items);
+
+  new_file = !append || stat(filename, &st) != 0 || st.st_size == 0;
+  fd = open(filename, new_file ? O_RDWR | O_CREAT | O_TRUNC : O_RDWR, 0666);
+  if (fd < 0) {
+    free(buf);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "write_qtraj: cannot open %s for writing", filename);
+  }
+
+  if (new_file) {
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, qtraj_magic, 8);
+    header.version = QTRAJ_VERSION;
+    header.byte_order = QTRAJ_BYTE_ORDER;
+    if (!qtraj_pwrite(fd, &header, sizeof(header), 0) || fstat(fd, &st) != 0) {
+      close(fd);
+      free(buf);
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "write_qtraj: error writing to %s, errno=%d", filename, errno);
+    }
+    qtraj_index_forget(filename);
+    qtraj_index_lookup(filename, (char *) &header, &st, &index, error);
+  } else {
+    qtraj_open(filename, &map, &st, &index, error);
+    if (error == NULL || *error == ERROR_NONE) munmap(map, st.st_size);
+  }
+  if (error != NULL && *error != ERROR_NONE) {
+    close(fd);
+    free(buf);
+    PASS_ERROR;
+  }
+  if (!new_file && frame != index->n_frame) {
+    close(fd);
+    free(buf);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "write_qtraj: can only append frame %d to %s, not frame %d", index->n_frame, filename, frame);
+  }
+
+#define QTRAJ_WRITE_FAIL { close(fd); free(buf); qtraj_index_clear(index); RAISE_ERROR_WITH_KIND(ERROR_IO, "write_qtraj: error writing to %s, errno=%d", filename, errno); }
+
+  // The frame goes where the trailer was
+  pos = index->end;
+  if (!qtraj_pwrite(fd, buf, size, pos)) QTRAJ_WRITE_FAIL;
+  free(buf);
+  buf = NULL;
+  if (!qtraj_append_offset(index, pos)) QTRAJ_WRITE_FAIL;
+  pos += size;
+
+  if (index->n_frame - index->n_indexed >= QTRAJ_INDEX_BLOCK) {
+    n_block = index->n_frame - index->n_indexed;
+    record.size = QTRAJ_RECORD_SIZE + 8 + 8*n_block;
+    record.kind = QTRAJ_INDEX;
+    record.count = n_block;
+    if (!qtraj_pwrite(fd, &record, sizeof(record), pos) ||
+	!qtraj_pwrite(fd, &index->last_index, sizeof(int64_t), pos + QTRAJ_RECORD_SIZE) ||
+	!qtraj_pwrite(fd, index->offsets + index->n_indexed, 8*n_block, pos + QTRAJ_RECORD_SIZE + 8))
+      QTRAJ_WRITE_FAIL;
+    index->last_index = pos;
+    index->n_indexed = index->n_frame;
+    pos += record.size;
+  }
+
+  memset(&trailer, 0, sizeof(trailer));
+  memcpy(trailer.magic, qtraj_end_magic, 8);
+  trailer.n_frame = index->n_frame;
+  trailer.last_index = index->last_index;
+  if (!qtraj_pwrite(fd, &trailer, sizeof(trailer), pos)) QTRAJ_WRITE_FAIL;
+  index->end = pos;
+  pos += QTRAJ_TRAILER_SIZE;
+  if (ftruncate(fd, pos) != 0 || fstat(fd, &st) != 0) QTRAJ_WRITE_FAIL;
+
+#undef QTRAJ_WRITE_FAIL
+
+  close(fd);
+  index->size = st.st_size;
+  index->mtime = st.st_mtime;
+  index->mtime_nsec = QTRAJ_MTIME_NSEC(st);
+}
+
+/* query_qtraj()
+ *
+ * Number of frames of a binary trajectory, and the number of atoms of frame, or of
+ * the first frame if frame is out of range.
+ */
+static void query_qtraj_unlocked(char *filename, int frame, int *n_frame, int *n_atom, int *error) {
+  struct stat st;
+  char *map;
+  qtraj_index_t *index;
+  qtraj_record_t record;
+
+  INIT_ERROR;
+
+  qtraj_open(filename, &map, &st, &index, error);
+  PASS_ERROR;
+
+  *n_frame = index->n_frame;
+  *n_atom = 0;
+  if (index->n_frame > 0) {
+    if (frame < 0 || frame >= index->n_frame) frame = 0;
+    memcpy(&record, map + index->offsets[frame], sizeof(record));
+    *n_atom = record.count;
+  }
+  munmap(map, st.st_size);
+}
+
+/* The index cache is shared by all threads, including the writer threads of async_writer.c */
+
+void read_qtraj(char *filename, fortran_t *params, fortran_t *properties, fortran_t *selected_properties,
+		double lattice[3][3], int *n_atom, int frame, int *range, int *error) {
+  pthread_mutex_lock(&qtraj_index_lock);
+  read_qtraj_unlocked(filename, params, properties, selected_properties, lattice, n_atom, frame, range, error);
+  pthread_mutex_unlock(&qtraj_index_lock);
+}
+
+void write_qtraj(char *filename, fortran_t *params, fortran_t *properties, fortran_t *selected_properties,
+		 double lattice[3][3], int n_atom, int frame, int append, int *error) {
+  pthread_mutex_lock(&qtraj_index_lock);
+  write_qtraj_unlocked(filename, params, properties, selected_properties, lattice, n_atom, frame, append, error);
+  pthread_mutex_unlock(&qtraj_index_lock);
+}
+
+void query_qtraj(char *filename, int frame, int *n_frame, int *n_atom, int *error) {
+  pthread_mutex_lock(&qtraj_index_lock);
+  query_qtraj_unlocked(filename, frame, n_frame, n_atom, error);
+  pthread_mutex_unlock(&qtraj_index_lock);
+}
@@ -8,11 +8,17 @@
 #include <unistd.h>
 #include <errno.h>
 #include <arpa/inet.h> 
+#include <signal.h>
+#include <sys/wait.h>
+#include <netinet/tcp.h>
 
 #define MSG_LEN_SIZE 8
 #define MSG_END_MARKER "done."
 #define MSG_END_MARKER_SIZE strlen(MSG_END_MARKER)
 
+int quip_fd_write(int fd, char *data, long data_len);
+int quip_fd_read(int fd, char *data, long data_len);
+
 int quip_recv_data(char *ip, int port, int client_id, char *request_code, char *data, int *data_len)
 {
     int sockfd = 0, n = 0;
@@ -195,3 +201,163 @@ int quip_send_data(char *ip, int port, int client_id, char *request_code, char *
     close(sockfd);
     return 0;
 }
+
+/* Persistent connections, used by SocketPot with protocol=2.
+
+   quip_socket_connect() connects to the server and identifies the client with the
+   same 8-byte hello as quip_send_data(), after which the connection stays open and
+   framed messages are exchanged with quip_fd_write() and quip_fd_read() until
+   quip_socket_close(). Small messages are sent straight away (TCP_NODELAY), as
+   every request waits for its reply. */
+
+int quip_socket_connect(char *ip, int port, int client_id, char *request_code, int *fd)
+{
+    int sockfd, status, flag = 1;
+    char id_str[MSG_LEN_SIZE+1];
+    struct sockaddr_in serv_addr;
+
+    if((sockfd = socket(AF_INET, SOCK_STREAM, 0)) < 0)
+    {
+        printf("Could not create socket \n");
+        return 1;
+    }
+
+    memset(&serv_addr, 0, sizeof(serv_addr));
+    serv_addr.sin_family = AF_INET;
+    serv_addr.sin_port = htons(port);
+
+    if(inet_pton(AF_INET, ip, &serv_addr.sin_addr)<=0)
+    {
+        printf("\n inet_pton error occured\n");
+        close(sockfd);
+        return 1;
+    }
+
+    if((status = connect(sockfd, (struct sockaddr *)&serv_addr, sizeof(serv_addr))) < 0)
+    {
+       printf("Connect Failed status=%d, errno=%d \n", status, errno);
+       close(sockfd);
+       return 1;
+    }
+
+    setsockopt(sockfd, IPPROTO_TCP, TCP_NODELAY, (char *) &flag, sizeof(int));
+    /* a server closing the connection must give an error in quip_fd_write(), not kill us */
+    signal(SIGPIPE, SIG_IGN);
+
+    sprintf(id_str, "%c%7d", *request_code, client_id);
+    if (quip_fd_write(sockfd, id_str, MSG_LEN_SIZE) != 0) {
+      close(sockfd);
+      return 1;
+    }
+
+    *fd = sockfd;
+    return 0;
+}
+
+int quip_socket_close(int fd)
+{
+    return close(fd);
+}
+
+/* 1 if this machine is little-endian, which the binary socket protocol assumes */
+int quip_little_endian(void)
+{
+    int one = 1;
+    return *((char *) &one) == 1;
+}
+
+/* Persistent worker processes, used by FilePot in persistent mode.
+
+   quip_worker_start() runs command with /bin/sh in a child process, with its
+   stdin and stdout connected to pipes. Messages are then exchanged with
+   quip_fd_write() and quip_fd_read(), which loop until all the bytes have been
+   transferred. quip_worker_stop() closes the pipes, so the worker sees the end
+   of its input, and waits for it to exit. */
+
+int quip_worker_start(char *command, int *pid, int *fd_write, int *fd_read)
+{
+    int to_child[2], from_child[2];
+    pid_t child;
+
+    if (pipe(to_child) < 0) {
+      printf("quip_worker_start: could not create pipe, errno=%d\n", errno);
+      return 1;
+    }
+    if (pipe(from_child) < 0) {
+      printf("quip_worker_start: could not create pipe, errno=%d\n", errno);
+      close(to_child[0]); close(to_child[1]);
+      return 1;
+    }
+
+    fflush(stdout);
+    if ((child = fork()) < 0) {
+      printf("quip_worker_start: fork failed, errno=%d\n", errno);
+      close(to_child[0]); close(to_child[1]);
+      close(from_child[0]); close(from_child[1]);
+      return 1;
+    }
+
+    if (child == 0) {
+      dup2(to_child[0], STDIN_FILENO);
+      dup2(from_child[1], STDOUT_FILENO);
+      close(to_child[0]); close(to_child[1]);
+      close(from_child[0]); close(from_child[1]);
+      execl("/bin/sh", "sh", "-c", command, (char *) NULL);
+      _exit(127);
+    }
+
+    close(to_child[0]);
+    close(from_child[1]);
+    /* a worker exiting early must give an error in quip_fd_write(), not kill us */
+    signal(SIGPIPE, SIG_IGN);
+
+    *pid = (int) child;
+    *fd_write = to_child[1];
+    *fd_read = from_child[0];
+    return 0;
+}
+
+int quip_fd_write(int fd, char *data, long data_len)
+{
+    long totalsent = 0;
+    ssize_t sent;
+
+    while (totalsent < data_len) {
+      sent = write(fd, data+totalsent, data_len - totalsent);
+      if (sent < 0 && errno == EINTR) continue;
+      if (sent <= 0) {
+	printf("quip_fd_write: connection to worker broken, errno=%d\n", errno);
+	return 1;
+      }
+      totalsent += sent;
+    }
+    return 0;
+}
+
+int quip_fd_read(int fd, char *data, long data_len)
+{
+    long totalreceived = 0;
+    ssize_t received;
+
+    while (totalreceived < data_len) {
+      received = read(fd, data+totalreceived, data_len - totalreceived);
+      if (received < 0 && errno == EINTR) continue;
+      if (received <= 0) {
+	printf("quip_fd_read: connection to worker broken, errno=%d\n", errno);
+	return 1;
+      }
+      totalreceived += received;
+    }
+    return 0;
+}
+
+int quip_worker_stop(int pid, int fd_write, int fd_read)
+{
+    int status = 0;
+
+    close(fd_write);
+    close(fd_read);
+    if (waitpid((pid_t) pid, &status, 0) < 0) return 1;
+    if (WIFEXITED(status)) return WEXITSTATUS(status);
+    return 1;
+}
@@ -46,6 +46,12 @@
 #include <float.h>
 #include <libgen.h>
 #include <limits.h>
+#include <time.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #include "libatoms.h"
 
@@ -54,6 +60,16 @@
 #define MAX_FIELD_COUNT 200
 #define PROPERTY_STRING_LENGTH 10
 #define PARAM_STRING_LENGTH 1024
+#define XYZ_INDEX_PARALLEL_BYTES (64L*1024L*1024L)
+
+#define min(a,b) ((a) < (b) ? (a) : (b))
+#define max(a,b) ((a) > (b) ? (a) : (b))
+
+#ifdef __APPLE__
+#define XYZ_MTIME_NSEC(st) ((long) (st).st_mtimespec.tv_nsec)
+#else
+#define XYZ_MTIME_NSEC(st) ((long) (st).st_mtim.tv_nsec)
+#endif
 
 /*
 ** Designation:  StriStr
@@ -112,9 +128,16 @@ char *stristr(const char *String, const char *Pattern)
  * file hasn't been modified. Returns number of frames.
  *
  * File format: text
- * First line:  number of frames (int)
+ * First line:  number of frames (int), and the size (long) and modification
+ *              time (long seconds, long nanoseconds) of the xyz file indexed
  * Subsequent nframes+1 lines: offset (long), natoms (int)
  * Last offset is end of final frame scanned.
+ *
+ * An index is up to date if the size and modification time of the file are the
+ * ones in its first line. Otherwise, it is extended from the end of the final
+ * frame, after checking that the final frame is still there, so trajectories
+ * which are being appended to are not rescanned. Large unindexed parts of a
+ * file are scanned in parallel, see xyz_index_range().
  */
 void realloc_frames(long **frames, int **atoms, int *frames_array_size, int new_frames_array_size) {
   long *t_frames = NULL;
@@ -169,7 +192,9 @@ void realloc_frames(long **frames, int **atoms, int *frames_array_size, int new_
 int xyz_find_index(char *fname, char *indexname, int *do_update, int *error) {
   char buf1[LINESIZE], buf2[LINESIZE], *bname;
   struct stat xyz_stat, idx_stat;
-  int idx_exists;
+  int idx_exists, nframes;
+  long size, mtime, mtime_nsec;
+  FILE *index;
 
   INIT_ERROR;
 
@@ -206,6 +231,16 @@ int xyz_find_index(char *fname, char *indexname, int *do_update, int *error) {
       RAISE_ERROR_WITH_KIND(ERROR_IO, "Cannot stat xyz.idx file %s\n", fname);
     }
     *do_update = xyz_stat.st_mtime > idx_stat.st_mtime;
+
+    index = fopen(indexname, "r");
+    if (index != NULL) {
+      if (fgets(buf1, LINESIZE, index) &&
+	  sscanf(buf1, "%d %ld %ld %ld", &nframes, &size, &mtime, &mtime_nsec) == 4) {
+	// index records which version of the file it is for
+	*do_update = size != xyz_stat.st_size || mtime != xyz_stat.st_mtime || mtime_nsec != XYZ_MTIME_NSEC(xyz_stat);
+      }
+      fclose(index);
+    }
   }
 
   return idx_exists;
@@ -240,75 +275,256 @@ int xyz_read_index(char *indexname, long **frames, int **atoms, int *frames_arra
   return nframes;
 }
 
+/* Number of atoms at the start of the line p, or -1 if there is no number. If strict,
+   the line must hold nothing else. */
+static long xyz_line_natoms(char *p, char *end, int strict) {
+  char buf[32], *q;
+  long natoms;
+  int n;
+
+  for (n=0; n < 31 && p+n < end && p[n] != '\n'; n++) buf[n] = p[n];
+  if (strict && n == 31) return -1;
+  buf[n] = '\0';
+
+  natoms = strtol(buf, &q, 10);
+  if (q == buf || natoms < 0) return -1;
+  if (strict)
+    while (*q != '\0')
+      if (!isspace((unsigned char) *q++)) return -1;
+  return natoms;
+}
+
+/* Start of the frame after the one at p, or NULL if the frame is incomplete. The
+   last line of a file does not need a newline. */
+static char *xyz_skip_frame(char *p, char *end, long natoms) {
+  char *q;
+  long i;
+
+  p = memchr(p, '\n', end - p);
+  if (p == NULL) return NULL;
+  p++;
+  for (i=0; i<natoms+1; i++) {
+    if (p >= end) return NULL;
+    q = memchr(p, '\n', end - p);
+    p = q == NULL ? end : q+1;
+  }
+  return p;
+}
+
+typedef struct {
+  long *frames;
+  int *atoms;
+  int n_frame;
+  int frames_array_size;
+  long next;      // offset of the frame after the last one
+  int malformed;  // the frame at next does not start with a number of atoms
+  int stopped;    // stopped before the end of the range, at an incomplete or malformed frame
+} xyz_frame_list_t;
+
+/* Appends the frames starting before stop, from the frame at offset start */
+static void xyz_walk_frames(char *map, long size, long start, long stop, xyz_frame_list_t *list) {
+  char *p, *q;
+  long natoms;
+
+  p = map + start;
+  list->malformed = 0;
+  list->stopped = 0;
+  while (p < map + stop) {
+    if ((natoms = xyz_line_natoms(p, map + size, 0)) < 0) {
+      list->malformed = 1;
+      list->stopped = 1;
+      break;
+    }
+    if ((q = xyz_skip_frame(p, map + size, natoms)) == NULL) {
+      list->stopped = 1;
+      break;
+    }
+    realloc_frames(&list->frames, &list->atoms, &list->frames_array_size, list->n_frame+2);
+    list->frames[list->n_frame] = p - map;
+    list->atoms[list->n_frame] = natoms;
+    list->n_frame++;
+    p = q;
+  }
+  list->next = p - map;
+}
+
+/* Offset of the first frame which looks like it starts in [start, stop), i.e. of a line
+   holding only a number of atoms N, with the line N+2 lines later holding only a number
+   too, or being the end of the file. Returns -1 if there is none. */
+static long xyz_sync_frame(char *map, long size, long start, long stop) {
+  char *p, *q;
+  long natoms;
+
+  p = map + start;
+  if (start > 0 && map[start-1] != '\n') {
+    if ((p = memchr(p, '\n', size - start)) == NULL) return -1;
+    p++;
+  }
+  while (p < map + stop) {
+    if ((natoms = xyz_line_natoms(p, map + size, 1)) >= 0 &&
+	(q = xyz_skip_frame(p, map + size, natoms)) != NULL &&
+	(q == map + size || xyz_line_natoms(q, map + size, 1) >= 0))
+      return p - map;
+    if ((p = memchr(p, '\n', map + size - p)) == NULL) return -1;
+    p++;
+  }
+  return -1;
+}
+
+/* xyz_index_range()
+ *
+ * Indexes the frames of the mapped file from the frame starting at start, appending
+ * them to list. Large ranges are split into one chunk per thread, and each chunk is
+ * indexed from the first line that looks like the start of a frame. The chunks are
+ * then joined serially, from the known start: the frames of a chunk are used from the
+ * one where the previous chunk ends, and a chunk is indexed again serially if there
+ * is no such frame, so the result is the same as the serial one.
+ */
+static void xyz_index_range(char *map, long size, long start, xyz_frame_list_t *list) {
+  xyz_frame_list_t *chunks;
+  long chunk_size, chunk_start, pos, lo, hi, mid;
+  int n_chunk = 1, c, j;
+
+#ifdef _OPENMP
+  n_chunk = omp_get_max_threads();
+#endif
+  if (n_chunk == 1 || size - start < XYZ_INDEX_PARALLEL_BYTES) {
+    xyz_walk_frames(map, size, start, size, list);
+    return;
+  }
+
+  chunks = (xyz_frame_list_t *) calloc(n_chunk, sizeof(xyz_frame_list_t));
+  chunk_size = (size - start) / n_chunk + 1;
+  debug("xyz_index_range: indexing %ld bytes in %d chunks\n", size - start, n_chunk);
+
+#ifdef _OPENMP
+#pragma omp parallel for schedule(static, 1) private(chunk_start)
+#endif
+  for (c=0; c<n_chunk; c++) {
+    chunk_start = c == 0 ? start : xyz_sync_frame(map, size, start + c*chunk_size, min(start + (c+1)*chunk_size, size));
+    chunks[c].next = -1;
+    if (chunk_start >= 0)
+      xyz_walk_frames(map, size, chunk_start, min(start + (c+1)*chunk_size, size), &chunks[c]);
+  }
+
+  pos = start;
+  for (c=0; c<n_chunk && !list->stopped; c++) {
+    if (pos >= min(start + (c+1)*chunk_size, size)) continue;
+
+    // find the frame starting at pos in this chunk
+    lo = 0;
+    hi = chunks[c].n_frame;
+    while (lo < hi) {
+      mid = (lo + hi)/2;
+      if (chunks[c].frames[mid] < pos) lo = mid+1; else hi = mid;
+    }
+
+    if (lo < chunks[c].n_frame && chunks[c].frames[lo] == pos) {
+      realloc_frames(&list->frames, &list->atoms, &list->frames_array_size, list->n_frame + chunks[c].n_frame - lo + 2);
+      for (j=lo; j<chunks[c].n_frame; j++) {
+	list->frames[list->n_frame] = chunks[c].frames[j];
+	list->atoms[list->n_frame] = chunks[c].atoms[j];
+	list->n_frame++;
+      }
+      list->next = chunks[c].next;
+      list->malformed = chunks[c].malformed;
+      list->stopped = chunks[c].stopped;
+    } else {
+      debug("xyz_index_range: chunk %d out of step, indexing it serially\n", c);
+      xyz_walk_frames(map, size, pos, min(start + (c+1)*chunk_size, size), list);
+    }
+    pos = list->next;
+  }
+  if (!list->stopped && pos < size) xyz_walk_frames(map, size, pos, size, list);
+
+  for (c=0; c<n_chunk; c++) {
+    if (chunks[c].frames_array_size > 0) {
+      free(chunks[c].frames);
+      free(chunks[c].atoms);
+    }
+  }
+  free(chunks);
+}
+
 int xyz_update_index(char *fname, char *indexname, long **frames, int **atoms, int *frames_array_size, int nframes, int *error) {
-  char linebuffer[LINESIZE];
-  int natoms, i;
-  FILE *in;
+  struct stat xyz_stat;
+  xyz_frame_list_t list;
+  char *map;
+  long size;
+  int fd;
 
-  in = fopen(fname, "r");
-  if (in == NULL) {
+  INIT_ERROR;
+
+  fd = open(fname, O_RDONLY);
+  if (fd < 0 || fstat(fd, &xyz_stat) != 0) {
+    if (fd >= 0) close(fd);
     RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_update_index: cannot open %s for reading", fname);
   }
+  size = xyz_stat.st_size;
+  if (size == 0) {
+    close(fd);
+    return 0;
+  }
+  map = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+  if (map == MAP_FAILED) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_update_index: cannot map %s, errno=%d", fname, errno);
+  }
 
   if (nframes != 0) {
     debug("xyz_update_index: trying to update XYZ index... \n");
 
-    // Try to seek past last frame, and check this looks
-    // like the start of a new frame
-    if (fseek(in,(*frames)[nframes],SEEK_SET) != 0 ||
-	!fgets(linebuffer,LINESIZE,in) ||
-	sscanf(linebuffer, "%d", &natoms) != 1 ||
-	natoms != (*atoms)[nframes]) {
-      // Seek failed, we'll have to rebuild index from start
-      fseek(in,0,SEEK_SET);
+    // Check that the last frame indexed is still there, and that the end of it is
+    // the end of the file or the start of a new frame, otherwise the file has been
+    // rewritten
+    if ((*frames)[nframes] > size || (*frames)[nframes-1] >= size ||
+	(*frames)[nframes] == 0 || map[(*frames)[nframes]-1] != '\n' ||
+	xyz_line_natoms(map + (*frames)[nframes-1], map + size, 0) != (*atoms)[nframes-1] ||
+	((*frames)[nframes] < size && xyz_line_natoms(map + (*frames)[nframes], map + size, 1) < 0)) {
       nframes = 0;
       debug(" failed, rebuilding from scratch.\n");
     }
-    else {
-      // Rewind to start of frame
-      fseek(in,(*frames)[nframes],SEEK_SET);
-    }
-
-    // TODO - improve check - fails if number of atoms has changed
   }
 
-  debug("xyz_update_index: starting to build index from file pos %ld nframes=%d\n", ftell(in), nframes);
-
-  while (fgets(linebuffer,LINESIZE,in)) {
-    realloc_frames(frames, atoms, frames_array_size, nframes+2);
-    (*frames)[nframes] = ftell(in)-strlen(linebuffer);
-    if (sscanf(linebuffer, "%d", &natoms) != 1) {
-      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_find_frames: malformed XYZ file %s at frame %d\n",fname,nframes);
-    }
-
-    (*atoms)[nframes] = natoms;
-    debug("update %ld %d\n", (*frames)[nframes], (*atoms)[nframes]);
-    nframes++;
-
-    // Skip the whole frame, as quickly as possible
-    for (i=0; i<natoms+1; i++)
-      if (!fgets(linebuffer,LINESIZE,in)) {
-	fseek(in, (*frames)[nframes], SEEK_SET); // return file pointer to beginning of frame
-	nframes--; // incomplete last frame
-	goto XYZ_END;
-      }
+  list.frames = *frames;
+  list.atoms = *atoms;
+  list.frames_array_size = *frames_array_size;
+  list.n_frame = nframes;
+  list.stopped = 0;
+  list.malformed = 0;
+  list.next = nframes == 0 ? 0 : (*frames)[nframes];
+
+  debug("xyz_update_index: starting to build index from file pos %ld nframes=%d\n", list.next, nframes);
+  if (list.next < size) xyz_index_range(map, size, list.next, &list);
+  munmap(map, size);
+
+  *frames = list.frames;
+  *atoms = list.atoms;
+  *frames_array_size = list.frames_array_size;
+  nframes = list.n_frame;
+
+  if (list.malformed) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_find_frames: malformed XYZ file %s at frame %d\n", fname, nframes);
   }
- XYZ_END:
   if (nframes == 0) return 0;
 
-  (*frames)[nframes] = ftell(in); // end of last frame in file
-  (*atoms)[nframes] = natoms;
-   fclose(in);
+  (*frames)[nframes] = list.next; // end of last frame in file
+  (*atoms)[nframes] = (*atoms)[nframes-1];
   return nframes;
 }
 
-void xyz_write_index(char *indexname, long **frames, int **atoms, int *frames_array_size, int nframes, int *error) {
+void xyz_write_index(char *fname, char *indexname, long **frames, int **atoms, int *frames_array_size, int nframes, int *error) {
   FILE *index;
   char buf1[LINESIZE], buf2[LINESIZE], *bname;
+  struct stat xyz_stat;
   int i;
 
   INIT_ERROR;
 
+  if (stat(fname, &xyz_stat) != 0) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "Cannot stat xyz file %s\n", fname);
+  }
+
   index = fopen(indexname, "w");
   if (index == NULL) {
     // Try to write in current dir instead
@@ -326,7 +542,7 @@ void xyz_write_index(char *indexname, long **frames, int **atoms, int *frames_ar
   } else
     debug("xyz_write_index: writing index to %s\n", indexname);
 
-  fprintf(index, "%d\n", nframes);
+  fprintf(index, "%d %ld %ld %ld\n", nframes, (long) xyz_stat.st_size, (long) xyz_stat.st_mtime, XYZ_MTIME_NSEC(xyz_stat));
   for (i=0; i<=nframes; i++) {
     fprintf(index, "%ld %d\n", (*frames)[i], (*atoms)[i]);
     debug("write index %ld %d\n", (*frames)[i], (*atoms)[i]);
@@ -334,10 +550,10 @@ void xyz_write_index(char *indexname, long **frames, int **atoms, int *frames_ar
   fclose(index);
 }
 
-int xyz_find_frames(char *fname, long **frames, int **atoms, int *frames_array_size, int *error) {
-  FILE *in;
+/* Finds the frames of fname, extending the nframes frames already in frames and atoms
+   if nframes > 0, or from its index file otherwise. */
+int xyz_find_frames(char *fname, long **frames, int **atoms, int *frames_array_size, int nframes, int *error) {
   char indexname[LINESIZE];
-  int natoms, i, nframes;
   int got_index, do_update;
 
   INIT_ERROR;
@@ -345,8 +561,10 @@ int xyz_find_frames(char *fname, long **frames, int **atoms, int *frames_array_s
   got_index = xyz_find_index(fname, indexname, &do_update, error);
   PASS_ERROR;
 
-  nframes = 0;
-  if (got_index) {
+  if (nframes > 0) {
+    // extend the index we have
+    do_update = 1;
+  } else if (got_index) {
     nframes = xyz_read_index(indexname, frames, atoms, frames_array_size, error);
     PASS_ERROR;
   }
@@ -359,7 +577,7 @@ int xyz_find_frames(char *fname, long **frames, int **atoms, int *frames_array_s
       RAISE_ERROR("xyz_find_frames: empty file!");
     }
 
-    xyz_write_index(indexname, frames, atoms, frames_array_size, nframes, error);
+    xyz_write_index(fname, indexname, frames, atoms, frames_array_size, nframes, error);
     PASS_ERROR;
   }
 
@@ -368,11 +586,121 @@ int xyz_find_frames(char *fname, long **frames, int **atoms, int *frames_array_s
 }
 
 
-void query_xyz (char *filename, int compute_index, int frame, int *n_frame, int *n_atom, int *error)
-{
+/* Cache of the frame indices of the most recently used files, most recent first.
+
+   An index is reused for as long as the size and modification time of its file do not
+   change, so alternating between files does not rebuild or reread their .idx files,
+   and it is extended from its last frame when they do.
+   Lookups copy what they need from the cache in a critical section, as entries can be
+   evicted by other threads.
+ */
+
+#define XYZ_INDEX_CACHE_SIZE 8
+
+typedef struct {
+  char *filename;
+  time_t mtime;
+  long mtime_nsec;
+  off_t size;
   long *frames;
   int *atoms;
+  int n_frame;
   int frames_array_size;
+} xyz_index_t;
+
+static xyz_index_t xyz_index_cache[XYZ_INDEX_CACHE_SIZE];
+static int xyz_index_cache_n = 0;
+
+static void xyz_index_free(xyz_index_t *entry) {
+  free(entry->filename);
+  if (entry->frames_array_size > 0) {
+    free(entry->frames);
+    free(entry->atoms);
+  }
+}
+
+static void xyz_index_lookup_unlocked(char *filename, int n_index, int *indices, long *offsets, int *n_atoms,
+				      int *n_frame, int *error) {
+  struct stat xyz_stat;
+  xyz_index_t entry;
+  int i, hit;
+
+  INIT_ERROR;
+
+  if (stat(filename, &xyz_stat) != 0) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_index_lookup: cannot stat xyz file %s", filename);
+  }
+
+  for (hit=0; hit < xyz_index_cache_n; hit++)
+    if (strcmp(xyz_index_cache[hit].filename, filename) == 0) break;
+
+  if (hit < xyz_index_cache_n &&
+      (xyz_index_cache[hit].mtime != xyz_stat.st_mtime || xyz_index_cache[hit].mtime_nsec != XYZ_MTIME_NSEC(xyz_stat) ||
+       xyz_index_cache[hit].size != xyz_stat.st_size)) {
+    // file has changed since it was indexed, take the index out to extend it
+    debug("xyz_index_lookup: updating index of %s\n", filename);
+    entry = xyz_index_cache[hit];
+    memmove(&xyz_index_cache[hit], &xyz_index_cache[hit+1], (xyz_index_cache_n-hit-1)*sizeof(xyz_index_t));
+    xyz_index_cache_n--;
+    hit = xyz_index_cache_n;
+  } else if (hit == xyz_index_cache_n) {
+    entry.filename = NULL;
+    entry.frames_array_size = 0;
+    entry.n_frame = 0;
+  }
+
+  if (hit == xyz_index_cache_n) {
+    entry.n_frame = xyz_find_frames(filename, &entry.frames, &entry.atoms, &entry.frames_array_size, entry.n_frame, error);
+    if (error != NULL && *error != ERROR_NONE) {
+      xyz_index_free(&entry);
+      PASS_ERROR;
+    }
+    if (entry.filename == NULL) entry.filename = strdup(filename);
+    entry.mtime = xyz_stat.st_mtime;
+    entry.mtime_nsec = XYZ_MTIME_NSEC(xyz_stat);
+    entry.size = xyz_stat.st_size;
+
+    if (xyz_index_cache_n == XYZ_INDEX_CACHE_SIZE) {
+      // evict the least recently used index
+      xyz_index_free(&xyz_index_cache[XYZ_INDEX_CACHE_SIZE-1]);
+      xyz_index_cache_n--;
+    }
+    hit = xyz_index_cache_n++;
+    xyz_index_cache[hit] = entry;
+  }
+
+  if (hit > 0) {
+    // move to front
+    entry = xyz_index_cache[hit];
+    memmove(&xyz_index_cache[1], &xyz_index_cache[0], hit*sizeof(xyz_index_t));
+    xyz_index_cache[0] = entry;
+  }
+
+  *n_frame = xyz_index_cache[0].n_frame;
+  for (i=0; i < n_index; i++) {
+    if (indices[i] < 0 || indices[i] >= *n_frame) {
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_index_lookup: frame %d out of range 0 <= frame < %d", indices[i], *n_frame);
+    }
+    offsets[i] = xyz_index_cache[0].frames[indices[i]];
+    n_atoms[i] = xyz_index_cache[0].atoms[indices[i]];
+  }
+}
+
+/* xyz_index_lookup()
+ *
+ * Returns the number of frames of an xyz file in n_frame, and the offsets
+ * and numbers of atoms of the n_index frames indices[] (counted from 0).
+ */
+void xyz_index_lookup(char *filename, int n_index, int *indices, long *offsets, int *n_atoms, int *n_frame, int *error) {
+#ifdef _OPENMP
+#pragma omp critical (xyz_index_cache)
+#endif
+  xyz_index_lookup_unlocked(filename, n_index, indices, offsets, n_atoms, n_frame, error);
+}
+
+void query_xyz (char *filename, int compute_index, int frame, int *n_frame, int *n_atom, int *error)
+{
+  long offset;
 
   INIT_ERROR;
 
@@ -385,23 +713,11 @@ void query_xyz (char *filename, int compute_index, int frame, int *n_frame, int
 
   if (!compute_index) return;
 
-  frames_array_size = 0;
-  *n_frame = xyz_find_frames(filename, &frames, &atoms, &frames_array_size, error);
+  xyz_index_lookup(filename, 1, &frame, &offset, n_atom, n_frame, error);
   PASS_ERROR;
-
-  if (frame < 0 || frame >= *n_frame) {
-    RAISE_ERROR_WITH_KIND(ERROR_IO, "query_xyz: frame %d out of range 0 <= frame < %d", frame, *n_frame);
-  }
-  *n_atom = atoms[frame];
-
-  free(frames);
-  free(atoms);
 }
 
 
-#define min(a,b) ((a) < (b) ? (a) : (b))
-
-
 char* get_line(char *linebuffer, int string, int string_length, char *orig_stringp, char *stringp, char **prev_stringp,
 	       FILE *in, char *info, int strip_prefix, int *line_offset, int *error)
 {
@@ -458,25 +774,16 @@ void read_xyz (char *filename, fortran_t *params, fortran_t *properties, fortran
   char *p, *p1, tmp_logical, *orig_stringp, *prev_stringp, *stringp;
   int nxyz, nfields=0, offset, error_occured;
   double tmpd;
-  int n_frame, n_selected;
-  long *frames;
-  int *atoms, type, shape[2], tmp_error, tmp_type, tmp_shape[2];
-  int frames_array_size, got_index, n_buffer, line_offset;
+  int n_frame, n_selected, frame_n_atom;
+  long frame_offset;
+  int type, shape[2], tmp_error, tmp_type, tmp_shape[2];
+  int got_index, n_buffer, line_offset;
   void *data, *tmp_data;
   int property_type[MAX_ENTRY_COUNT], property_shape[MAX_ENTRY_COUNT][2], property_ncols[MAX_ENTRY_COUNT], n_property;
   void *property_data[MAX_ENTRY_COUNT];
   int *mask;
   int strip_prefix;
 
-  static int have_cached_index;
-  char indexname[LINESIZE];
-  int do_update;
-  static char *last_filename;
-  static long *last_frames;
-  static int *last_atoms;
-  static int last_n_frame;
-  static int last_frames_array_size;
-
   debug("entered read_xyz()\n");
 
   INIT_ERROR;
@@ -499,48 +806,9 @@ void read_xyz (char *filename, fortran_t *params, fortran_t *properties, fortran
     // Not reading from stdin or from a string, so we can compute an index
     debug("read_xyz: computing index for file %s\n", filename);
 
-    got_index = xyz_find_index(filename, indexname, &do_update, error);
-
-    if (have_cached_index && got_index && !do_update && (strcmp(filename, last_filename) == 0)) {
-      // use cached copy
-      frames = last_frames;
-      atoms = last_atoms;
-      n_frame = last_n_frame;
-      frames_array_size = last_frames_array_size;
-    } else {
-      // read index
-      if (have_cached_index) {
-        free(last_filename);
-        free(last_frames);
-        free(last_atoms);
-        have_cached_index = 0;
-      }
-
-      frames_array_size = 0;
-
-      n_frame = xyz_find_frames(filename, &frames, &atoms, &frames_array_size, error);
-      PASS_ERROR;
-
-      last_filename = strdup(filename);
-      if (last_filename == NULL) {
-        RAISE_ERROR("read_xyz: insufficient memory for strdup");
-      }
-
-      if (n_frame > 1000) {
-        // cache big index files in memory
-
-        last_frames = frames;
-        last_atoms = atoms;
-        last_n_frame = n_frame;
-        last_frames_array_size = frames_array_size;
-
-        have_cached_index = 1;
-      }
-    }
+    xyz_index_lookup(filename, 1, &frame, &frame_offset, &frame_n_atom, &n_frame, error);
+    PASS_ERROR;
 
-    if (frame < 0 || frame >= n_frame) {
-      RAISE_ERROR_WITH_KIND(ERROR_IO, "read_xyz: frame %d out of range 0 <= frame < %d", frame, n_frame-1);
-    }
     got_index = 1;
     in = fopen(filename, "r");
     if (in == NULL) {
@@ -548,14 +816,10 @@ void read_xyz (char *filename, fortran_t *params, fortran_t *properties, fortran
     }
 
     n_buffer = *n_atom;
-    *n_atom = atoms[frame];
-    if (fseek(in, frames[frame], SEEK_SET) == -1) {
+    *n_atom = frame_n_atom;
+    if (fseek(in, frame_offset, SEEK_SET) == -1) {
       RAISE_ERROR_WITH_KIND(ERROR_IO, "cannot seek XYZ input file %s", filename);
     }
-    if (!have_cached_index) {
-      free(frames);
-      free(atoms);
-    }
   } else {
     // compute_index = 0, so we just open the file and start at the beginning
     in = fopen(filename, "r");
@@ -1279,6 +1543,8 @@ void write_xyz (char *filename, fortran_t *params, fortran_t *properties, fortra
       param_value[0]='\0';
       for (j=0; j<shape[0]; j++) {
 	sprintf(tmpbuf, int_format, INTEGER_A(data,j));
+	if (j > 0 && param_value[strlen(param_value)-1] != ' ' && tmpbuf[0] != ' ')
+	  strncat(param_value, " ", PARAM_STRING_LENGTH-strlen(param_value)-1);
 	strncat(param_value, tmpbuf, PARAM_STRING_LENGTH-strlen(param_value)-1);
       }
     } else if (type == T_REAL_A) {
@@ -1288,6 +1554,8 @@ void write_xyz (char *filename, fortran_t *params, fortran_t *properties, fortra
       param_value[0]='\0';
       for (j=0; j<shape[0]; j++) {
 	sprintf(tmpbuf, real_format, REAL_A(data,j));
+	if (j > 0 && param_value[strlen(param_value)-1] != ' ' && tmpbuf[0] != ' ')
+	  strncat(param_value, " ", PARAM_STRING_LENGTH-strlen(param_value)-1);
 	strncat(param_value, tmpbuf, PARAM_STRING_LENGTH-strlen(param_value)-1);
       }
     } else if (type == T_LOGICAL_A) {
@@ -1425,7 +1693,7 @@ void write_xyz (char *filename, fortran_t *params, fortran_t *properties, fortra
 	  frames[nframes-1] = start_idx;  atoms[nframes-1] = n_atom;
 	  frames[nframes] = end_idx;	  atoms[nframes] = n_atom;
 
-	  xyz_write_index(indexname, &frames, &atoms, &frames_array_size, nframes, error);
+	  xyz_write_index(filename, indexname, &frames, &atoms, &frames_array_size, nframes, error);
 	  PASS_ERROR;
 
 	  if (access(indexname, R_OK) != 0) {
@@ -1436,7 +1704,7 @@ void write_xyz (char *filename, fortran_t *params, fortran_t *properties, fortra
 	  }
 	  if (idx_stat.st_size == 0) { // try again
 	     sleep(1);
-	     xyz_write_index(indexname, &frames, &atoms, &frames_array_size, nframes, error);
+	     xyz_write_index(filename, indexname, &frames, &atoms, &frames_array_size, nframes, error);
 	     PASS_ERROR;
 	  }
 
@@ -1455,3 +1723,445 @@ void write_xyz (char *filename, fortran_t *params, fortran_t *properties, fortra
   }
 }
 
+
+
+
+/* Memory-mapped reader of selected columns of a set of frames.
+
+   The whole file is mapped once and the frames are located with the index. The line
+   starts of each frame are found with memchr(), and the lines are then parsed in
+   parallel with OpenMP if there are enough of them. Only the properties named in
+   columns are converted, the other fields are skipped, and species are converted to
+   atomic numbers. Lines with a prefix string are not supported.
+ */
+
+#define XYZ_MMAP_MIN_PARALLEL_ATOMS 4096
+#define XYZ_MMAP_MAX_FIELDS 1024
+#define XYZ_MMAP_TOKEN_LENGTH 128
+
+static const char *xyz_element_symbols[] = {
+  "H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar",
+  "K", "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga", "Ge", "As", "Se", "Br", "Kr",
+  "Rb", "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd", "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe",
+  "Cs", "Ba", "La", "Ce", "Pr", "Nd", "Pm", "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb", "Lu",
+  "Hf", "Ta", "W", "Re", "Os", "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi", "Po", "At", "Rn",
+  "Fr", "Ra", "Ac", "Th", "Pa", "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr",
+  "Rf", "Db", "Sg", "Bh", "Hs", "Mt", "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og"};
+
+static int xyz_species_to_z(char *species) {
+  int z;
+
+  for (z=0; z < sizeof(xyz_element_symbols)/sizeof(xyz_element_symbols[0]); z++)
+    if (strcasecmp(species, xyz_element_symbols[z]) == 0) return z+1;
+  return 0;
+}
+
+/* Copies the value of key in an extended XYZ comment line to value, without the
+   quotes or braces. Returns 0 if the key is not there. */
+static int xyz_comment_value(char *line, char *key, char *value, int value_length) {
+  char *p, *key_start, *value_start, close;
+  int key_length, n;
+
+  p = line;
+  while (*p != '\0') {
+    while (isblank(*p)) p++;
+    key_start = p;
+    while (*p != '\0' && *p != '=' && !isblank(*p)) p++;
+    key_length = p - key_start;
+    if (*p != '=') continue;
+    p++;
+
+    close = '\0';
+    if (*p == '"' || *p == '\'') close = *p++;
+    else if (*p == '{') { close = '}'; p++; }
+    value_start = p;
+    while (*p != '\0' && (close ? *p != close : !isblank(*p))) p++;
+
+    if (key_length == strlen(key) && strncasecmp(key_start, key, key_length) == 0) {
+      n = min(p - value_start, value_length-1);
+      strncpy(value, value_start, n);
+      value[n] = '\0';
+      return 1;
+    }
+    if (close && *p != '\0') p++;
+  }
+  return 0;
+}
+
+/* Converts the fields of the line from p to end of atom i which have a destination,
+   to field_data[f][i*field_stride[f]]. Returns 0 on failure. Unselected fields are
+   only scanned over, and each selected one is copied before it is converted, as the
+   mapped file is not NUL-terminated. */
+static int xyz_mmap_line(char *p, char *end, long i, int n_fields, double **field_data, long *field_stride,
+			 char *field_type) {
+  char token[XYZ_MMAP_TOKEN_LENGTH], *start, *q;
+  double *value;
+  int f, n, z;
+  long l;
+
+  for (f=0; f<n_fields; f++) {
+    while (p < end && (*p == ' ' || *p == '\t' || *p == '\r')) p++;
+    start = p;
+    while (p < end && !isspace((unsigned char) *p)) p++;
+    n = p - start;
+    if (n == 0) return 0;
+    if (field_data[f] == NULL) continue;
+    if (n >= XYZ_MMAP_TOKEN_LENGTH) return 0;
+    memcpy(token, start, n);
+    token[n] = '\0';
+    value = field_data[f] + i*field_stride[f];
+
+    switch (field_type[f]) {
+    case 'R':
+      *value = strtod(token, &q);
+      if (*q != '\0') return 0;
+      break;
+    case 'I':
+      l = strtol(token, &q, 10);
+      if (*q != '\0') return 0;
+      *value = (double) l;
+      break;
+    case 'L':
+      if (strcasecmp(token, "T") == 0 || strcasecmp(token, "True") == 0) *value = 1.0;
+      else if (strcasecmp(token, "F") == 0 || strcasecmp(token, "False") == 0) *value = 0.0;
+      else return 0;
+      break;
+    case 'S':
+      if ((z = xyz_species_to_z(token)) == 0) return 0;
+      *value = (double) z;
+      break;
+    default:
+      return 0;
+    }
+  }
+  return 1;
+}
+
+/* Reads the properties `columns` of the frame starting at p, which are rows row to
+   row+n_atom-1 of the output, the scalar keys `params` of its comment line into
+   param_data[n_param] (NaN if missing) and its lattice into lattice[9].
+
+   The output is either data[n_row][n_data_col], with the properties one after the other
+   in each row, or, if data is NULL, one out[q][n_row][out_ncols[q]] array per property. */
+static void xyz_mmap_frame(char *p, char *end, int n_atom, long row, char *columns, double *data, int n_data_col,
+			   double **out, int *out_ncols, int n_out_max, char *params, int n_param, double *param_data,
+			   double *lattice, int *error) {
+  char comment[LINESIZE], properties[LINESIZE], value[LINESIZE], name_list[LINESIZE];
+  char *name, *type, *ncols, *q, *stringp, **lines;
+  char *prop_name[MAX_ENTRY_COUNT], prop_type[MAX_ENTRY_COUNT], field_type[XYZ_MMAP_MAX_FIELDS];
+  int prop_ncols[MAX_ENTRY_COUNT], prop_start[MAX_ENTRY_COUNT];
+  double *field_data[XYZ_MMAP_MAX_FIELDS];
+  long field_stride[XYZ_MMAP_MAX_FIELDS];
+  int n_prop, n_fields, n_fields_read, col, i, k, n_out, bad_atom;
+
+  INIT_ERROR;
+
+  // skip the number of atoms, and copy the comment line
+  if ((p = memchr(p, '\n', end - p)) == NULL) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: premature end - expecting comment line");
+  }
+  p++;
+  q = memchr(p, '\n', end - p);
+  if (q == NULL) q = end;
+  if (q - p >= LINESIZE) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: comment line longer than %d characters", LINESIZE-1);
+  }
+  strncpy(comment, p, q - p);
+  comment[q - p] = '\0';
+  if ((stringp = strchr(comment, '\r')) != NULL) *stringp = '\0';
+  p = q < end ? q+1 : end;
+
+  for (i=0; i<9; i++) lattice[i] = 0.0;
+  if (xyz_comment_value(comment, "Lattice", value, LINESIZE)) {
+    stringp = value;
+    for (i=0; i<9; i++) {
+      lattice[i] = strtod(stringp, &q);
+      if (q == stringp) {
+	RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: cannot parse Lattice=\"%s\"", value);
+      }
+      stringp = q;
+    }
+  }
+
+  if (n_param > 0) {
+    strncpy(name_list, params, LINESIZE-1);
+    name_list[LINESIZE-1] = '\0';
+    stringp = name_list;
+    for (k=0; k<n_param; k++) {
+      if ((name = strsep(&stringp, ":")) == NULL) {
+	RAISE_ERROR("xyz_mmap_read: fewer than n_param=%d keys in params=%s", n_param, params);
+      }
+      param_data[k] = NAN;
+      if (xyz_comment_value(comment, name, value, LINESIZE)) {
+	param_data[k] = strtod(value, &q);
+	if (q == value) {
+	  RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: %s=%s is not a number", name, value);
+	}
+      }
+    }
+  }
+
+  if (!xyz_comment_value(comment, "Properties", properties, LINESIZE))
+    strcpy(properties, "species:S:1:pos:R:3");
+
+  // split Properties into (name, type, number of columns) entries
+  n_prop = 0;
+  n_fields = 0;
+  stringp = properties;
+  while ((name = strsep(&stringp, ":")) != NULL) {
+    type = strsep(&stringp, ":");
+    ncols = strsep(&stringp, ":");
+    if (type == NULL || ncols == NULL || strlen(type) != 1 || atoi(ncols) < 1) {
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: bad Properties entry %s", name);
+    }
+    if (n_prop == MAX_ENTRY_COUNT) {
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: more than %d Properties entries", MAX_ENTRY_COUNT);
+    }
+    prop_name[n_prop] = name;
+    prop_type[n_prop] = *type;
+    prop_ncols[n_prop] = atoi(ncols);
+    prop_start[n_prop] = n_fields;
+    n_fields += prop_ncols[n_prop];
+    n_prop++;
+  }
+  if (n_fields > XYZ_MMAP_MAX_FIELDS) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: more than %d fields per line", XYZ_MMAP_MAX_FIELDS);
+  }
+
+  // destinations of the fields of the selected properties, NULL for the others
+  for (i=0; i<n_fields; i++) field_data[i] = NULL;
+  n_fields_read = 0;
+  n_out = 0;
+  col = 0;
+  strncpy(name_list, columns, LINESIZE-1);
+  name_list[LINESIZE-1] = '\0';
+  stringp = name_list;
+  while ((name = strsep(&stringp, ":")) != NULL) {
+    if (*name == '\0') continue;
+    for (k=0; k<n_prop; k++)
+      if (strcasecmp(name, prop_name[k]) == 0) break;
+    if (k == n_prop) {
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: property %s not found in Properties", name);
+    }
+    if (prop_type[k] == 'S' && (strcasecmp(name, "species") != 0 || prop_ncols[k] != 1)) {
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: cannot read string property %s, only species", name);
+    }
+    if (data != NULL) {
+      if (col + prop_ncols[k] > n_data_col) {
+	RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: properties %s need more than n_data_col=%d columns", columns, n_data_col);
+      }
+      for (i=0; i<prop_ncols[k]; i++) {
+	field_data[prop_start[k]+i] = data + row*n_data_col + col++;
+	field_stride[prop_start[k]+i] = n_data_col;
+      }
+    } else {
+      if (n_out == n_out_max) {
+	RAISE_ERROR("xyz_mmap_read: more than n_out=%d properties in %s", n_out_max, columns);
+      }
+      if (prop_ncols[k] != out_ncols[n_out]) {
+	RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: property %s has %d columns, expecting %d", name, prop_ncols[k], out_ncols[n_out]);
+      }
+      for (i=0; i<prop_ncols[k]; i++) {
+	field_data[prop_start[k]+i] = out[n_out] + row*prop_ncols[k] + i;
+	field_stride[prop_start[k]+i] = prop_ncols[k];
+      }
+    }
+    for (i=0; i<prop_ncols[k]; i++) field_type[prop_start[k]+i] = prop_type[k];
+    n_fields_read = max(n_fields_read, prop_start[k]+prop_ncols[k]);
+    n_out++;
+  }
+  if (data != NULL && col != n_data_col) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: properties %s have %d columns, not n_data_col=%d", columns, col, n_data_col);
+  }
+
+  lines = (char **) malloc((n_atom+1)*sizeof(char *));
+  if (lines == NULL) {
+    RAISE_ERROR("xyz_mmap_read: cannot allocate memory for %d lines", n_atom);
+  }
+  for (i=0; i<n_atom; i++) {
+    if (p >= end) {
+      free(lines);
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: premature end - expecting %d atoms but got %d", n_atom, i);
+    }
+    lines[i] = p;
+    q = memchr(p, '\n', end - p);
+    p = q == NULL ? end : q+1;
+  }
+  lines[n_atom] = p;
+
+  bad_atom = n_atom;
+#ifdef _OPENMP
+#pragma omp parallel for if (n_atom >= XYZ_MMAP_MIN_PARALLEL_ATOMS) schedule(static) reduction(min:bad_atom)
+#endif
+  for (i=0; i<n_atom; i++) {
+    if (!xyz_mmap_line(lines[i], lines[i+1], i, n_fields_read, field_data, field_stride, field_type))
+      if (i < bad_atom) bad_atom = i;
+  }
+  free(lines);
+
+  if (bad_atom < n_atom) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: cannot parse the line of atom %d, expecting Properties=%s", bad_atom+1, columns);
+  }
+}
+
+/* xyz_mmap_query()
+ *
+ * Returns the number of frames in n_frame, the numbers of atoms of the n_index frames
+ * indices[] (counted from 0) and the Properties of the first one, or of frame 0 if
+ * n_index is 0, as a NUL-terminated string.
+ */
+void xyz_mmap_query(char *filename, int n_index, int *indices, int *n_frame, int *n_atoms, char *properties,
+		    int properties_length, int *error) {
+  FILE *in;
+  char line[LINESIZE];
+  long *offsets, offset;
+  int first = 0, first_n_atom;
+
+  INIT_ERROR;
+
+  offsets = (long *) malloc(max(n_index, 1)*sizeof(long));
+  if (offsets == NULL) {
+    RAISE_ERROR("xyz_mmap_query: cannot allocate memory for %d frames", n_index);
+  }
+  xyz_index_lookup(filename, n_index, indices, offsets, n_atoms, n_frame, error);
+  if (error == NULL || *error == ERROR_NONE) {
+    if (n_index > 0)
+      offset = offsets[0];
+    else
+      xyz_index_lookup(filename, 1, &first, &offset, &first_n_atom, n_frame, error);
+  }
+  free(offsets);
+  PASS_ERROR;
+
+  in = fopen(filename, "r");
+  if (in == NULL) {
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_query: cannot open file %s for reading", filename);
+  }
+  if (fseek(in, offset, SEEK_SET) == -1 || fgets(line, LINESIZE, in) == NULL || fgets(line, LINESIZE, in) == NULL) {
+    fclose(in);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_query: cannot read comment line of %s", filename);
+  }
+  fclose(in);
+  line[strcspn(line, "\r\n")] = '\0';
+
+  if (!xyz_comment_value(line, "Properties", properties, properties_length)) {
+    strncpy(properties, "species:S:1:pos:R:3", properties_length-1);
+    properties[properties_length-1] = '\0';
+  }
+}
+
+static void xyz_mmap_read_frames(char *filename, int n_index, int *indices, char *columns, double *data, int n_data_col,
+				 double **out, int *out_ncols, int n_out, int n_row, char *params, int n_param,
+				 double *param_data, double *lattice, int *error) {
+  struct stat xyz_stat;
+  long *offsets, row;
+  int *n_atoms, n_frame, fd, i;
+  char *map;
+
+  INIT_ERROR;
+
+  offsets = (long *) malloc(max(n_index, 1)*sizeof(long));
+  n_atoms = (int *) malloc(max(n_index, 1)*sizeof(int));
+  if (offsets == NULL || n_atoms == NULL) {
+    free(offsets);
+    free(n_atoms);
+    RAISE_ERROR("xyz_mmap_read: cannot allocate memory for %d frames", n_index);
+  }
+  xyz_index_lookup(filename, n_index, indices, offsets, n_atoms, &n_frame, error);
+  if (error != NULL && *error != ERROR_NONE) {
+    free(offsets);
+    free(n_atoms);
+    PASS_ERROR;
+  }
+
+  row = 0;
+  for (i=0; i<n_index; i++) row += n_atoms[i];
+  if (row != n_row) {
+    free(offsets);
+    free(n_atoms);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: frames have %ld atoms but n_row=%d", row, n_row);
+  }
+
+  fd = open(filename, O_RDONLY);
+  if (fd < 0 || fstat(fd, &xyz_stat) != 0) {
+    if (fd >= 0) close(fd);
+    free(offsets);
+    free(n_atoms);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: cannot open file %s for reading", filename);
+  }
+  map = mmap(NULL, xyz_stat.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+  if (map == MAP_FAILED) {
+    free(offsets);
+    free(n_atoms);
+    RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: cannot map file %s, errno=%d", filename, errno);
+  }
+  if (n_index > 1) madvise(map, xyz_stat.st_size, MADV_SEQUENTIAL);
+
+  row = 0;
+  for (i=0; i<n_index; i++) {
+    if (offsets[i] >= xyz_stat.st_size) {
+      munmap(map, xyz_stat.st_size);
+      free(offsets);
+      free(n_atoms);
+      RAISE_ERROR_WITH_KIND(ERROR_IO, "xyz_mmap_read: frame %d starts after the end of %s", indices[i], filename);
+    }
+    xyz_mmap_frame(map + offsets[i], map + xyz_stat.st_size, n_atoms[i], row, columns, data, n_data_col, out, out_ncols,
+		   n_out, params, n_param, param_data + (long) i*n_param, lattice + 9*i, error);
+    if (error != NULL && *error != ERROR_NONE) {
+      munmap(map, xyz_stat.st_size);
+      free(offsets);
+      free(n_atoms);
+      PASS_ERROR;
+    }
+    row += n_atoms[i];
+  }
+
+  munmap(map, xyz_stat.st_size);
+  free(offsets);
+  free(n_atoms);
+}
+
+/* xyz_mmap_read()
+ *
+ * Reads the properties named in columns, separated by colons, of the n_index frames
+ * indices[] (counted from 0) into data[n_row][n_data_col], one row per atom with the
+ * frames one after the other, the numbers of the n_param keys params (separated by
+ * colons) of each frame into param_data[n_index][n_param], NaN for missing keys, and
+ * the lattices into lattice[n_index][9], in the order of the Lattice key. Logical
+ * properties are read as 0 or 1, and species as atomic numbers.
+ */
+void xyz_mmap_read(char *filename, int n_index, int *indices, char *columns, int n_data_col, int n_row,
+		   double *data, char *params, int n_param, double *param_data, double *lattice, int *error) {
+  INIT_ERROR;
+
+  xyz_mmap_read_frames(filename, n_index, indices, columns, data, n_data_col, NULL, NULL, 0, n_row,
+		       params, n_param, param_data, lattice, error);
+  PASS_ERROR;
+}
+
+/* xyz_mmap_read_into()
+ *
+ * As xyz_mmap_read(), but each of the n_out properties in columns is read into its own
+ * array, at address addresses[q], of n_row rows of out_ncols[q] doubles. The numbers of
+ * columns of the properties must be out_ncols in all the frames.
+ */
+void xyz_mmap_read_into(char *filename, int n_index, int *indices, char *columns, int n_out, intptr_t *addresses,
+			int *out_ncols, int n_row, char *params, int n_param, double *param_data, double *lattice,
+			int *error) {
+  double **out;
+  int q;
+
+  INIT_ERROR;
+
+  out = (double **) malloc(max(n_out, 1)*sizeof(double *));
+  if (out == NULL) {
+    RAISE_ERROR("xyz_mmap_read_into: cannot allocate memory for %d outputs", n_out);
+  }
+  for (q=0; q<n_out; q++) out[q] = (double *) addresses[q];
+
+  xyz_mmap_read_frames(filename, n_index, indices, columns, NULL, 0, out, out_ncols, n_out, n_row,
+		       params, n_param, param_data, lattice, error);
+  free(out);
+  PASS_ERROR;
+}
@@ -0,0 +1,66 @@
+#!/bin/bash
+
+set -e
+
+if [ -z $QUIP_ROOT ]; then
+   echo "$0: Need QUIP_ROOT defined"
+   exit 1
+fi
+if [ -z $QUIP_ARCH ]; then
+   echo "$0: Need QUIP_ARCH defined"
+   exit 1
+fi
+
+TEST=test_async_write.sh
+
+mydir=`dirname $0`
+bindir=$mydir/../build/$QUIP_ARCH
+
+if [ ! -x $bindir/quip ]; then
+   (cd $QUIP_ROOT && make Programs) || exit 2
+fi
+
+cat<<EOF > ${TEST}.in.xyz
+8
+Lattice="5.428835          0.000000          0.000000          0.000000          5.428835          0.000000          0.000000          0.000000          5.428835" Properties=species:S:1:pos:R:3
+  Si      0.1000000      0.0000000      0.0000000
+  Si      2.7144176      2.6144176      0.0000000
+  Si      2.7144176      0.0000000      2.7144176
+  Si      0.0000000      2.7144176      2.7144176
+  Si      1.3572088      1.3572088      1.3572088
+  Si      4.0716264      4.0716264      1.3572088
+  Si      4.0716264      1.3572088      4.0716264
+  Si      1.3572088      4.0716264      4.0716264
+EOF
+
+relax() {
+   ${MPIRUN} $bindir/quip atoms_filename=${TEST}.in.xyz E F init_args='{IP SW}' param_filename=$QUIP_ROOT/share/Parameters/ip.parms.SW.xml relax "$@"
+}
+
+error=0
+echo -n "$0: "
+
+# the background writer gives the same trajectories as writing in the loop
+for ext in xyz qtraj; do
+   relax relax_iter=5 relax_print_filename=${TEST}.sync.$ext > /dev/null
+   relax relax_iter=5 relax_print_filename=${TEST}.async.$ext relax_print_async=T > /dev/null
+   cmp -s ${TEST}.sync.$ext ${TEST}.async.$ext || { echo -n "async $ext trajectory differs; "; error=1; }
+done
+
+# with relax_iter=1 only the first frame is written, so the failure of the writer thread
+# can only be raised when the trajectory is closed
+if relax relax_iter=1 relax_print_filename=${TEST}.missing/traj.xyz relax_print_async=T > ${TEST}.out 2>&1; then
+   echo -n "quip did not fail; "
+   error=1
+fi
+if grep -q 'async=T needs OpenMP' ${TEST}.out; then
+   echo -n "written synchronously without OpenMP; "
+else
+   grep -q 'async_writer_close: writing frame 0' ${TEST}.out || { echo -n "error of writer thread not raised on close; "; error=1; }
+   grep -q 'cannot open .*missing/traj.xyz' ${TEST}.out || { echo -n "traceback of writer thread lost; "; error=1; }
+fi
+
+[ $error == 0 ] && echo "async write is OK"
+
+rm -rf ${TEST}.*
+exit $error
@@ -18,12 +18,14 @@
 
 import unittest
 import os
+import tempfile
 
 import numpy as np
 import ase
 import ase.build
 
 import quippy
+import quippy.descriptor_store
 import quippytest
 
 
@@ -209,12 +211,14 @@ class Test_Descriptor(quippytest.QuippyTestCase):
         desc = quippy.descriptors.Descriptor("soap cutoff=1.3 l_max=4 n_max=4 atom_sigma=0.5 n_Z=2 Z={1 6}")
         data = desc.calc(self.at_C2H, grad=True)
 
-        # has_grad_data, pos, has_data - not tested
+        # pos, has_data - not tested
         self.assertTupleEqual(data['data'].shape, self.ref_shapes['descriptor'])
         self.assertTupleEqual(data['grad_data'].shape, self.ref_shapes['grad'])
         self.assertTupleEqual(data['covariance_cutoff'].shape, self.ref_shapes['cutoff'])
         self.assertTupleEqual(data['grad_covariance_cutoff'].shape, self.ref_shapes['cutoff_grad'])
         self.assertTupleEqual(data['grad_index_0based'].shape, self.ref_shapes['grad_index_0based'])
+        self.assertTupleEqual(data['has_grad_data'].shape, (len(data['grad_index_0based']),))
+        self.assertEqual(data['has_grad_data'].dtype, bool)
 
         # test the indices
         self.assertArrayIntEqual(data["grad_index_0based"], self.ref_grad_index_0based)
@@ -223,5 +227,181 @@ class Test_Descriptor(quippytest.QuippyTestCase):
         self.assertArrayAlmostEqual(data['grad_data'][:2], self.ref_grad_array)
 
 
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class Test_Descriptor_Connectivity(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.desc_str = "soap cutoff=3.0 l_max=4 n_max=4 atom_sigma=0.5 n_Z=1 Z={14}"
+        self.frames = []
+        at = ase.build.bulk('Si', 'diamond', 5.44, cubic=True)
+        for i in range(4):
+            at = at.copy()
+            at.rattle(0.05, seed=i)
+            self.frames.append(at)
+
+    def test_calc_connect_skipped(self):
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        quip_at = quippy.convert.ase_to_quip(self.frames[0])
+        desc.calc(quip_at)
+        key = desc._connect_cache.key
+        self.assertIs(desc._connect_cache.atoms, quip_at)
+
+        desc.count(quip_at)
+        self.assertEqual(desc._connect_cache.key, key)
+
+        quip_at.pos[0, 0] += 0.1
+        desc.count(quip_at)
+        self.assertNotEqual(desc._connect_cache.key, key)
+
+    def test_per_frame_properties(self):
+        # the Fortran object is reused for the next frame, without the velocities of the previous one
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        self.frames[0].set_momenta(np.ones((len(self.frames[0]), 3)))
+        desc.calc(self.frames[0])
+        quip_at = desc._quip_atoms
+        self.assertIn('velo', quippy.convert.get_dict_keys(quip_at.properties))
+        desc.calc(self.frames[1])
+        self.assertIs(desc._quip_atoms, quip_at)
+        self.assertNotIn('velo', quippy.convert.get_dict_keys(quip_at.properties))
+
+    def test_neighbour_skin(self):
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        desc_skin = quippy.descriptors.Descriptor(self.desc_str, neighbour_skin=1.0)
+        for at in self.frames:
+            self.assertArrayAlmostEqual(desc_skin.calc(at, grad=True)['grad_data'],
+                                        desc.calc(at, grad=True)['grad_data'])
+
+    def test_calc_many(self):
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        ref = [desc.calc_descriptor(at) for at in self.frames]
+
+        for kwargs in [dict(), dict(n_jobs=2, chunk_size=1)]:
+            data, offsets = desc.calc_many(self.frames, **kwargs)
+            self.assertEqual(len(offsets), len(self.frames) + 1)
+            for i, ref_data in enumerate(ref):
+                self.assertArrayAlmostEqual(data[offsets[i]:offsets[i + 1]], ref_data)
+
+        for i, frame_data in enumerate(desc.iter_calc(iter(self.frames), n_jobs=2)):
+            self.assertArrayAlmostEqual(frame_data, ref[i])
+
+    def test_dtype(self):
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        desc_single = quippy.descriptors.Descriptor(self.desc_str, dtype=np.float32)
+        ref = desc.calc(self.frames[0], grad=True)
+        out = desc_single.calc(self.frames[0], grad=True)
+        self.assertEqual(out['data'].dtype, np.float32)
+        self.assertEqual(out['grad_data'].dtype, np.float32)
+        self.assertEqual(out['covariance_cutoff'].dtype, np.float64)
+        self.assertArrayAlmostEqual(out['data'], ref['data'], tol=1e-6)
+        self.assertArrayAlmostEqual(out['grad_data'], ref['grad_data'], tol=1e-5)
+
+        data, offsets = desc_single.calc_many(self.frames, n_jobs=2, chunk_size=2)
+        self.assertEqual(data.dtype, np.float32)
+        self.assertArrayAlmostEqual(data, desc.calc_many(self.frames)[0], tol=1e-6)
+
+    def test_calc_many_memmap(self):
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'soap.npy')
+            data, offsets = desc.calc_many(self.frames, n_jobs=2, chunk_size=2, filename=filename)
+            self.assertIsInstance(data, np.memmap)
+            self.assertArrayAlmostEqual(np.load(filename), desc.calc_many(self.frames)[0])
+            del data
+
+    def test_calc_many_out(self):
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        ref, ref_offsets = desc.calc_many(self.frames)
+        out = np.zeros((len(ref) + 1, desc.n_dim))
+        data, offsets = desc.calc_many(self.frames, n_jobs=2, chunk_size=2, out=out)
+        self.assertTrue(np.shares_memory(data, out))
+        self.assertEqual(len(data), len(ref))
+        self.assertArrayAlmostEqual(data, ref)
+        self.assertArrayAlmostEqual(offsets, ref_offsets)
+        with self.assertRaises(ValueError):
+            desc.calc_many(self.frames, out=np.zeros((len(ref) - 1, desc.n_dim)))
+
+    def test_store(self):
+        desc = quippy.descriptors.Descriptor(self.desc_str)
+        ref = [desc.calc(at, grad=True) for at in self.frames]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'store')
+            with quippy.descriptor_store.DescriptorStore(path, mode='w') as store:
+                desc.calc(self.frames, grad=True, store=store)
+
+            store = quippy.descriptor_store.DescriptorStore(path)
+            self.assertEqual(len(store), len(self.frames))
+            self.assertEqual(store.data.shape, (sum(len(r['data']) for r in ref), desc.n_dim))
+            for i, ref_data in enumerate(ref):
+                frame = store.frame(i)
+                self.assertArrayAlmostEqual(frame['data'], ref_data['data'])
+                self.assertArrayAlmostEqual(frame['grad_data'], ref_data['grad_data'])
+                self.assertArrayIntEqual(frame['grad_index'][:, 0],
+                                         np.repeat(np.arange(len(ref_data['data'])), ref_data['n_grad']))
+                self.assertArrayIntEqual(frame['grad_index'][:, 1], ref_data['grad_index_0based'][:, 1])
+
+            grad, desc_index = store.atom_grad(2, 3)
+            rows = ref[2]['grad_index_0based'][:, 1] == 3
+            self.assertArrayAlmostEqual(grad, ref[2]['grad_data'][rows])
+            self.assertArrayIntEqual(desc_index, np.repeat(np.arange(len(ref[2]['data'])), ref[2]['n_grad'])[rows])
+
+
+class Test_DescriptorStore(quippytest.QuippyTestCase):
+    def descriptor_out(self, n_grad, n_dim=4):
+        # same keys as Descriptor.calc(), central atom i of descriptor i
+        n_desc = len(n_grad)
+        out = {'data': np.random.rand(n_desc, n_dim), 'covariance_cutoff': np.ones(n_desc)}
+        if sum(n_grad) > 0:
+            out['n_grad'] = np.array(n_grad)
+            out['grad_data'] = np.random.rand(sum(n_grad), 3, n_dim)
+            out['grad_covariance_cutoff'] = np.zeros((sum(n_grad), 3))
+            out['grad_index_0based'] = np.column_stack([np.repeat(np.arange(n_desc), n_grad),
+                                                        np.concatenate([np.arange(n) for n in n_grad])])
+        return out
+
+    def test_frame_without_gradients(self):
+        frames = [self.descriptor_out([2, 1]), self.descriptor_out([0, 0, 0]), self.descriptor_out([0, 3])]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'store')
+            with quippy.descriptor_store.DescriptorStore(path, mode='w') as store:
+                for out in frames:
+                    store.append(out, len(out['data']), grad=True)
+
+            store = quippy.descriptor_store.DescriptorStore(path)
+            self.assertArrayIntEqual(store.frame_grad_offsets, [0, 3, 3, 6])
+            self.assertEqual(store.frame(1)['grad_data'].shape, (0, 3, 4))
+            self.assertArrayAlmostEqual(store.frame(1)['data'], frames[1]['data'])
+
+            # descriptor rows, not central atoms
+            self.assertArrayIntEqual(store.frame(2)['grad_index'], [[1, 0], [1, 1], [1, 2]])
+            grad, desc_index = store.atom_grad(2, 1)
+            self.assertArrayAlmostEqual(grad, frames[2]['grad_data'][[1]])
+            self.assertArrayIntEqual(desc_index, [1])
+
+
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class Test_DescriptorSet(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.desc_strs = {'2b': "distance_2b cutoff=4.0",
+                          'soap': "soap cutoff=3.0 l_max=4 n_max=4 atom_sigma=0.5 n_Z=1 Z={14}"}
+        self.at = ase.build.bulk('Si', 'diamond', 5.44, cubic=True)
+        self.at.rattle(0.05, seed=0)
+
+    def test_calc(self):
+        desc_set = quippy.descriptors.DescriptorSet(self.desc_strs)
+        data = desc_set.calc(self.at, grad=True)
+        self.assertEqual(sorted(data.keys()), ['2b', 'soap'])
+        for name, desc_str in self.desc_strs.items():
+            ref = quippy.descriptors.Descriptor(desc_str).calc(self.at, grad=True)
+            self.assertArrayAlmostEqual(data[name]['data'], ref['data'])
+            self.assertArrayAlmostEqual(data[name]['grad_data'], ref['grad_data'])
+
+    def test_single_neighbour_list(self):
+        desc_set = quippy.descriptors.DescriptorSet(list(self.desc_strs.values()))
+        data = desc_set.calc_descriptor(self.at)
+        self.assertEqual(sorted(data.keys()), sorted(self.desc_strs.values()))
+        self.assertAlmostEqual(desc_set._quip_atoms.cutoff, 5.0)
+        for desc in desc_set.descriptors.values():
+            self.assertIs(desc._connect_cache, desc_set._connect_cache)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -24,12 +24,19 @@ classes, for carrying out molecular dynamics simulations.
    :synopsis: Run molecular dynamics simulations
 """
 
+import os
+import tempfile
+
 import quippy
+import quippy.dynamicalsystem
 import numpy as np
 
 import unittest
 import quippytest
 import ase.io
+import ase.build
+from ase.constraints import FixAtoms
+from ase.units import fs
 
 
 # class TestDynamicalSystem(quippytest.QuippyTestCase):
@@ -235,5 +242,151 @@ import ase.io
 #         self.dyn.run(10)
 #
 #
-# if __name__ == '__main__':
-#     unittest.main()
+
+class TestDynamics_Init(quippytest.QuippyTestCase):
+    """Dynamics of an ASE Atoms object without momenta"""
+
+    def test_zero_momenta(self):
+        at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        self.assertFalse(at.has('momenta'))
+        dyn = quippy.dynamicalsystem.Dynamics(at, 1.0 * fs, trajectory=None, logfile=None)
+        self.assertArrayAlmostEqual(at.get_momenta(), np.zeros((len(at), 3)))
+        self.assertArrayAlmostEqual(dyn._quip_atoms.velo, np.zeros((3, len(at))))
+        self.assertIn('acc', quippy.convert.get_dict_keys(dyn._quip_atoms.properties))
+
+
+class TestDynamics_FastPath(quippytest.QuippyTestCase):
+    """step() without ASE constraints against the path used with constraints"""
+
+    def make_dynamics(self, constraint=None):
+        at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        at.set_masses([28.085] * len(at))
+        at.rattle(0.05, seed=1)
+        if constraint is not None:
+            at.set_constraint(constraint)
+        at.calc = quippy.potential.Potential('IP SW', param_filename='SW_pot.xml')
+        return quippy.dynamicalsystem.Dynamics(at, 1.0 * fs, trajectory=None, logfile=None)
+
+    def test_same_trajectory(self):
+        fast = self.make_dynamics()
+        # a constraint which fixes no atom, so only the path taken differs
+        slow = self.make_dynamics(FixAtoms(indices=[]))
+        fast.run(10)
+        slow.run(10)
+        self.assertArrayAlmostEqual(fast.ase_atoms.get_positions(), slow.ase_atoms.get_positions())
+        self.assertArrayAlmostEqual(fast.ase_atoms.get_momenta(), slow.ase_atoms.get_momenta())
+        self.assertEqual(fast._quip_atoms.params['nsteps'], 10)
+
+    def test_positions_view(self):
+        dyn = self.make_dynamics()
+        forces = dyn.ase_atoms.get_forces()
+        momenta = dyn.ase_atoms.get_momenta()
+        dyn.step(forces)
+        self.assertArrayAlmostEqual(dyn.ase_atoms.positions, dyn._quip_atoms.pos.T)
+        # momenta are only copied by sync()
+        self.assertArrayAlmostEqual(dyn.ase_atoms.get_momenta(), momenta)
+        dyn.sync()
+        self.assertTrue(np.abs(dyn.ase_atoms.get_momenta() - momenta).max() > 0.0)
+
+
+class TestDynamics_RunNative(quippytest.QuippyTestCase):
+    """run_native() against the Python loop of run()"""
+
+    def make_dynamics(self):
+        at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        at.set_masses([28.085] * len(at))
+        at.rattle(0.05, seed=1)
+        at.calc = quippy.potential.Potential('IP SW', param_filename='SW_pot.xml')
+        return quippy.dynamicalsystem.Dynamics(at, 1.0 * fs, trajectory=None, logfile=None)
+
+    def test_same_trajectory(self):
+        python = self.make_dynamics()
+        native = self.make_dynamics()
+        python.run(10)
+        native.run_native(10)
+        self.assertEqual(native.nsteps, 10)
+        self.assertArrayAlmostEqual(native.ase_atoms.get_positions(), python.ase_atoms.get_positions())
+        self.assertArrayAlmostEqual(native.ase_atoms.get_momenta(), python.ase_atoms.get_momenta())
+
+    def test_observers(self):
+        dyn = self.make_dynamics()
+        steps = []
+        dyn.attach(lambda: steps.append((dyn.nsteps, dyn.ase_atoms.get_positions())), interval=5)
+        dyn.run_native(10)
+        self.assertEqual([n for n, pos in steps], [0, 5, 10])
+        self.assertArrayAlmostEqual(steps[-1][1], dyn.ase_atoms.get_positions())
+
+    def test_not_quippy_calculator(self):
+        dyn = self.make_dynamics()
+        dyn.ase_atoms.calc = None
+        self.assertRaises(TypeError, dyn.run_native, 10)
+
+    def test_barostat(self):
+        # the Fortran loop does not calculate the virial, so this would run at constant volume
+        dyn = self.make_dynamics()
+        dyn.set_barostat('BAROSTAT_HOOVER_LANGEVIN', p_ext=0.0, hydrostatic_strain=True, diagonal_strain=False,
+                         finite_strain_formulation=False, tau_epsilon=100.0, T=300.0)
+        self.assertRaises(RuntimeError, dyn.run_native, 10)
+        self.assertEqual(dyn.nsteps, 0)
+
+    def test_add_arrays(self):
+        dyn = self.make_dynamics()
+        dyn.ase_atoms.calc.add_arrays = ['momenta']
+        self.assertRaises(RuntimeError, dyn.run_native, 10)
+
+
+class TestDynamicalSystem_TrajectoryWriter(quippytest.QuippyTestCase):
+    """Frames of DynamicalSystem.run() streamed to a trajectory_writer"""
+
+    def setUp(self):
+        at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        at.rattle(0.05, seed=1)
+        self.ds = quippy.dynamicalsystem.DynamicalSystem(quippy.convert.ase_to_quip(at))
+        self.pot = quippy.potential.Potential('IP SW', param_filename='SW_pot.xml')
+
+    def force(self):
+        return quippy.convert.get_dict_arrays(self.ds.atoms.properties, keys=['force'])['force'].T
+
+    def run_ds(self, trajectory_writer):
+        return self.ds.run(self.pot, dt=1.0, n_steps=10, summary_interval=0, save_interval=5,
+                           trajectory_writer=trajectory_writer)
+
+    def test_buffer(self):
+        buffer = quippy.dynamicalsystem.TrajectoryBuffer(2, properties=['pos', 'force'])
+        self.assertIsNone(self.run_ds(buffer))
+        # frames at steps 0, 5 and 10, of which the last two are kept
+        self.assertEqual(buffer.n_written, 3)
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer.get_array('pos').shape, (2, 8, 3))
+        self.assertArrayAlmostEqual(buffer.get_array('pos')[-1], self.ds.atoms.pos.T)
+        self.assertArrayAlmostEqual(buffer.get_array('force')[-1], self.force())
+
+    def test_threaded_writer(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'traj.xyz')
+            with quippy.dynamicalsystem.TrajectoryWriter(filename, threaded=True, max_queue=1) as writer:
+                self.run_ds(writer)
+            frames = ase.io.read(filename, ':')
+        self.assertEqual(len(frames), 3)
+        self.assertArrayAlmostEqual(frames[-1].positions, self.ds.atoms.pos.T)
+        self.assertArrayAlmostEqual(frames[-1].arrays['force'], self.force())
+
+    def test_filename(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'traj.xyz')
+            self.run_ds(filename)
+            self.assertEqual(len(ase.io.read(filename, ':')), 3)
+
+    def test_missing_property(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'traj.xyz')
+            for threaded in (False, True):
+                with quippy.dynamicalsystem.TrajectoryWriter(filename, properties=['pos', 'no_such_property'],
+                                                             threaded=threaded) as writer:
+                    with self.assertRaises(KeyError):
+                        writer.write(self.ds.atoms)
+                    self.assertEqual(writer.n_written, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,8 +33,13 @@ $bash: python2
  [ 1.37788647  4.08297002  4.12304365]]
 """
 
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 import quippy
+import quippy.filepot_worker
 import numpy as np
 import quippytest
 import ase.build
@@ -127,5 +132,78 @@ class TestCalculator_SW_Potential(quippytest.QuippyTestCase):
     #    self.assertArrayAlmostEqual(self.pot.get_numeric_forces(self.at), self.f_ref.T, tol=1e-4)
 
 
+class TestFilePot_Persistent(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.at = ase.Atoms('Si8', positions=diamond_pos, pbc=True, cell=[5.44, 5.44, 5.44])
+        self.command = '{0} -m quippy.filepot_worker'.format(sys.executable)
+
+    def request(self, at):
+        return [(b'ARGS', b''), (b'WANT', b'energy:force:virial'),
+                (b'CELL', at.cell.array.tobytes()),
+                (b'PBC ', at.pbc.astype(np.int32).tobytes()),
+                (b'Z   ', at.numbers.astype(np.int32).tobytes()),
+                (b'POS ', at.positions.tobytes())]
+
+    def test_echo_driver(self):
+        worker = subprocess.Popen(self.command.split(), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        for i in range(3):
+            self.at.positions[0, 0] += 0.1
+            quippy.filepot_worker.write_message(worker.stdin, self.request(self.at))
+            reply = quippy.filepot_worker.read_message(worker.stdout)
+            energy = np.frombuffer(reply[b'ENRG'], dtype=np.float64)[0]
+            forces = np.frombuffer(reply[b'FORC'], dtype=np.float64).reshape(len(self.at), 3)
+            self.assertAlmostEqual(energy, 0.5 * np.sum(self.at.positions ** 2))
+            self.assertArrayAlmostEqual(forces, -self.at.positions)
+        worker.stdin.close()
+        self.assertEqual(worker.wait(), 0)
+
+    def test_error(self):
+        worker = subprocess.Popen(self.command.split(), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        quippy.filepot_worker.write_message(worker.stdin, self.request(self.at)[:-1])
+        reply = quippy.filepot_worker.read_message(worker.stdout)
+        self.assertIn(b'ERR ', reply)
+        worker.stdin.close()
+        worker.wait()
+
+    def test_potential(self):
+        pot = quippy.potential.Potential('FilePot command="{0}" persistent=T'.format(self.command),
+                                         calc_args='FilePot_log=F')
+        self.at.set_calculator(pot)
+        for i in range(3):
+            self.at.rattle(0.01, seed=i)
+            self.assertAlmostEqual(self.at.get_potential_energy(), 0.5 * np.sum(self.at.positions ** 2))
+            self.assertArrayAlmostEqual(self.at.get_forces(), -self.at.positions)
+
+    def test_potential_error(self):
+        # the command fails its first request only, and records every start in a file
+        fail_once = """
+import os, sys
+import quippy.filepot_worker
+with open(sys.argv[1] + '.starts', 'a') as f:
+    f.write('start\\n')
+def calculate(request):
+    if not os.path.exists(sys.argv[1] + '.failed'):
+        open(sys.argv[1] + '.failed', 'w').close()
+        raise ValueError('calculation failed')
+    return quippy.filepot_worker.echo_calculate(request)
+quippy.filepot_worker.serve(calculate)
+"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            script = os.path.join(tmpdir, 'fail_once.py')
+            with open(script, 'w') as f:
+                f.write(fail_once)
+            seed = os.path.join(tmpdir, 'worker')
+            pot = quippy.potential.Potential('FilePot command="{0} {1} {2}" persistent=T'.format(sys.executable, script, seed),
+                                             calc_args='FilePot_log=F')
+            self.at.set_calculator(pot)
+            with self.assertRaises(RuntimeError):
+                self.at.get_potential_energy()
+            self.at.rattle(0.01)
+            self.assertAlmostEqual(self.at.get_potential_energy(), 0.5 * np.sum(self.at.positions ** 2))
+            # the failed command was stopped, and a new one answered the second request
+            with open(seed + '.starts') as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,119 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright James Kermode 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   http://www.jrkermode.co.uk/quippy
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import ase.build
+import ase.io
+
+import quippy
+import quippy.frames
+import quippytest
+
+
+class TestReadFrames(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'frames.xyz')
+        self.frames = []
+        for i in range(6):
+            at = ase.build.bulk('Si', cubic=True).repeat((2 + i % 2, 2, 2))
+            at.rattle(0.05, seed=i)
+            at.arrays['force'] = np.random.RandomState(i).normal(size=(len(at), 3))
+            at.arrays['fixed'] = np.arange(len(at)) % 2 == 0
+            at.info['energy'] = -1.5 * i
+            self.frames.append(at)
+        ase.io.write(self.filename, self.frames, format='extxyz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_all(self):
+        frames = quippy.frames.read_frames(self.filename)
+        self.assertEqual(list(frames['n_atoms']), [len(at) for at in self.frames])
+        for i, at in enumerate(self.frames):
+            start, end = frames['offsets'][i], frames['offsets'][i + 1]
+            self.assertArrayAlmostEqual(frames['arrays']['pos'][start:end], at.positions)
+            self.assertArrayAlmostEqual(frames['arrays']['force'][start:end], at.arrays['force'])
+            self.assertEqual(list(frames['arrays']['numbers'][start:end]), list(at.numbers))
+            self.assertEqual(list(frames['arrays']['fixed'][start:end]), list(at.arrays['fixed']))
+            self.assertArrayAlmostEqual(frames['cell'][i], at.cell[:])
+
+    def test_selection(self):
+        frames = quippy.frames.read_frames(self.filename, index=slice(-1, 0, -2), properties=['force'])
+        self.assertEqual(list(frames['arrays'].keys()), ['force'])
+        self.assertArrayAlmostEqual(frames['arrays']['force'],
+                                    np.concatenate([self.frames[i].arrays['force'] for i in [5, 3, 1]]))
+
+    def test_appended(self):
+        self.assertEqual(len(quippy.frames.read_frames(self.filename, properties=['pos'])['n_atoms']), 6)
+        with open(self.filename + '.idx') as f:
+            self.assertEqual(int(f.readline().split()[0]), 6)
+        # the index is extended from the last frame, as by a running MD
+        extra = self.frames[0].copy()
+        extra.positions += 1.0
+        ase.io.write(self.filename, extra, format='extxyz', append=True)
+        frames = quippy.frames.read_frames(self.filename, index=-1, properties=['pos'])
+        self.assertArrayAlmostEqual(frames['arrays']['pos'], extra.positions)
+        with open(self.filename + '.idx') as f:
+            self.assertEqual(int(f.readline().split()[0]), 7)
+
+    def test_params(self):
+        frames = quippy.frames.read_frames(self.filename, properties=['pos'], params=['energy', 'missing'])
+        self.assertArrayAlmostEqual(frames['params']['energy'], [at.info['energy'] for at in self.frames])
+        self.assertTrue(np.isnan(frames['params']['missing']).all())
+
+    def test_into(self):
+        # frames 0, 2 and 4 all have 64 atoms
+        pos = np.zeros((3, 64, 3))
+        force = np.zeros((3, 64, 3))
+        frames = quippy.frames.read_frames_into(self.filename, dict(pos=pos, force=force), index=[0, 2, 4],
+                                                params=['energy'])
+        self.assertEqual(list(frames['n_atoms']), [64, 64, 64])
+        self.assertArrayAlmostEqual(pos, [self.frames[i].positions for i in [0, 2, 4]])
+        self.assertArrayAlmostEqual(force, [self.frames[i].arrays['force'] for i in [0, 2, 4]])
+        self.assertArrayAlmostEqual(frames['params']['energy'], [0.0, -3.0, -6.0])
+
+    def test_into_varying_n_atoms(self):
+        n_total = sum(len(at) for at in self.frames[:3])
+        force = np.zeros((n_total, 3))
+        frames = quippy.frames.read_frames_into(self.filename, dict(force=force), index=slice(0, 3))
+        for i in range(3):
+            self.assertArrayAlmostEqual(force[frames['offsets'][i]:frames['offsets'][i + 1]],
+                                        self.frames[i].arrays['force'])
+        with self.assertRaises(ValueError):
+            quippy.frames.read_frames_into(self.filename, dict(force=np.zeros((n_total, 2))), index=slice(0, 3))
+        with self.assertRaises(TypeError):
+            quippy.frames.read_frames_into(self.filename, dict(force=np.zeros((3, n_total)).T), index=slice(0, 3))
+
+    def test_iread(self):
+        chunks = list(quippy.frames.iread_frames(self.filename, properties=['pos'], chunk_size=4))
+        self.assertEqual([list(chunk['indices']) for chunk in chunks], [[0, 1, 2, 3], [4, 5]])
+        self.assertArrayAlmostEqual(chunks[1]['arrays']['pos'][-len(self.frames[5]):], self.frames[5].positions)
+
+    def test_missing_property(self):
+        with self.assertRaises(ValueError):
+            quippy.frames.read_frames(self.filename, properties=['velo'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -149,6 +149,35 @@ class TestCalculator_SW_Potential(quippytest.QuippyTestCase):
         f = pot2.get_forces(self.at)
         self.assertArrayAlmostEqual(f, self.forces_ref*1.01, tol=1E-06)
 
+    def test_calc_args_cache(self):
+        # the same arguments again reuse the args_str, and different ones give another one
+        pot2 = Potential('IP SW', param_str=self.xml, calculation_always_required=True)
+        pot2.calculate(self.at, properties=["forces"], E_scale=1.01, do_rescale_E=True)
+        pot2.calculate(self.at, properties=["forces"], E_scale=1.01, do_rescale_E=True)
+        self.assertEqual(len(pot2._calc_args_cache), 1)
+        self.assertArrayAlmostEqual(pot2.results['forces'], self.forces_ref*1.01, tol=1E-06)
+        pot2.calculate(self.at, properties=["forces"], do_rescale_E=True, E_scale=1.02)
+        self.assertEqual(len(pot2._calc_args_cache), 2)
+        self.assertArrayAlmostEqual(pot2.results['forces'], self.forces_ref*1.02, tol=1E-06)
+
+    def test_calc_args_cache_eviction(self):
+        # when the cache is full, the least recently used args_str makes way for a new one
+        size = quippy.potential._CALC_ARGS_CACHE_SIZE
+        pot2 = Potential('IP SW', param_str=self.xml)
+        strings = [pot2._calc_args_str(['forces'], None, {'E_scale': i}) for i in range(size)]
+        self.assertEqual(pot2._calc_args_str(['forces'], None, {'E_scale': 0}), strings[0])
+        pot2._calc_args_str(['forces'], None, {'E_scale': size})
+        self.assertEqual(len(pot2._calc_args_cache), size)
+        keys = [key[3] for key in pot2._calc_args_cache]
+        self.assertIn((('E_scale', 0),), keys)
+        self.assertNotIn((('E_scale', 1),), keys)
+
+    def test_preallocated_forces(self):
+        self.pot_calculator.calculate(self.at, properties=['forces'], forces=self.f)
+        self.assertArrayAlmostEqual(self.f.T, self.forces_ref, tol=1E-06)
+        # the result is the caller's array, not a copy of it
+        self.assertTrue(np.shares_memory(self.pot_calculator.results['forces'], self.f))
+
     # def test_numeric_forces(self):
     #    self.assertArrayAlmostEqual(self.pot.get_numeric_forces(self.at), self.f_ref.T, tol=1e-4)
 
@@ -183,5 +212,197 @@ class TestPotential(quippytest.QuippyTestCase):
         self.assertAlmostEqual(E1, E2)  
             
 
+class TestPotential_CalculateMany(quippytest.QuippyTestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.ats = [Atoms('Al{}'.format(n), cell=(5, 5, 5),
+                          scaled_positions=np.random.uniform(size=(n, 3)),
+                          pbc=[True] * 3) for n in (4, 4, 6, 4)]
+
+        LJ_str = """<LJ_params n_types="1" label="default">
+        <!-- dummy paramters for testing purposes, no physical meaning -->
+        <per_type_data type="1" atomic_num="13" />
+        <per_pair_data type1="1" type2="1" sigma="2.0" eps6="1.0" eps12="1.0" cutoff="6.0" energy_shift="T" linear_force_shift="F" />
+        </LJ_params>
+        """
+        self.calc = Potential(param_str=LJ_str, args_str='IP LJ')
+
+    def check_results(self, results):
+        self.assertEqual(results['energy'].shape, (len(self.ats),))
+        self.assertEqual(results['forces'].shape, (sum(len(at) for at in self.ats), 3))
+        for i, at in enumerate(self.ats):
+            at.calc = self.calc
+            self.assertAlmostEqual(results['energy'][i], at.get_potential_energy())
+            self.assertArrayAlmostEqual(results['forces'][results['forces_offsets'][i]:results['forces_offsets'][i + 1]],
+                                        at.get_forces())
+            self.assertArrayAlmostEqual(results['stress'][i], at.get_stress())
+
+    def test_serial(self):
+        self.check_results(self.calc.calculate_many(self.ats, properties=['energy', 'forces', 'stress']))
+
+    def test_workers(self):
+        self.check_results(self.calc.calculate_many(self.ats, properties=['energy', 'forces', 'stress'], n_workers=2))
+
+    def test_free_energy(self):
+        results = self.calc.calculate_many(self.ats, properties=['energy', 'free_energy'])
+        self.assertArrayAlmostEqual(results['free_energy'], results['energy'])
+
+    def test_mixed_momenta(self):
+        # the Fortran object reused for the second frame should not keep the velocities of the first
+        self.ats[0].set_momenta(np.ones((len(self.ats[0]), 3)))
+        self.check_results(self.calc.calculate_many(self.ats, properties=['energy', 'forces', 'stress']))
+
+
+class TestPotential_Incremental(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.pot = Potential('IP SW', param_filename='SW_pot.xml')
+        self.pot_incremental = Potential('IP SW', param_filename='SW_pot.xml', incremental=True)
+        self.at = Atoms('Si8', positions=diamond_pos, pbc=True, cell=[5.44, 5.44, 5.44])
+
+    def test_moved_atoms(self):
+        at = self.at.copy()
+        at.calc = self.pot_incremental
+        at.get_forces()
+        quip_atoms = self.pot_incremental._quip_atoms
+
+        at.rattle(0.05, seed=1)
+        at.set_cell(at.cell * 1.01, scale_atoms=True)
+        f = at.get_forces()
+        # the Fortran object is reused, but gives the same forces as a fresh one
+        self.assertIs(self.pot_incremental._quip_atoms, quip_atoms)
+        self.assertArrayAlmostEqual(f, self.pot.get_forces(at), tol=1E-06)
+        self.assertAlmostEqual(at.get_potential_energy(), self.pot.get_potential_energy(at))
+
+    def test_stale_results(self):
+        self.pot_incremental.calculate(self.at, properties=['energy', 'energies'])
+        self.assertIn('local_energy', self.pot_incremental.extra_results['atoms'])
+        self.at.rattle(0.05, seed=1)
+        self.pot_incremental.calculate(self.at, properties=['energy'])
+        self.assertNotIn('local_energy', self.pot_incremental.extra_results['atoms'])
+
+    def test_dropped_inputs(self):
+        # inputs of the previous call that are not passed again do not stay in the reused object
+        self.at.arrays['my_array'] = np.arange(len(self.at), dtype=float)
+        self.at.info['my_info'] = 1.0
+        self.at.set_momenta(np.ones((len(self.at), 3)))
+        self.pot_incremental.calculate(self.at, properties=['energy'], add_arrays='my_array', add_info='my_info')
+        properties = quippy.convert.get_dict_keys(self.pot_incremental._quip_atoms.properties)
+        params = quippy.convert.get_dict_keys(self.pot_incremental._quip_atoms.params)
+        self.assertIn('my_array', properties)
+        self.assertIn('velo', properties)
+        self.assertIn('my_info', params)
+
+        self.at.set_momenta(None)
+        self.at.rattle(0.05, seed=1)
+        self.pot_incremental.calculate(self.at, properties=['energy'])
+        quip_atoms = self.pot_incremental._quip_atoms
+        self.assertNotIn('my_array', quippy.convert.get_dict_keys(quip_atoms.properties))
+        self.assertNotIn('velo', quippy.convert.get_dict_keys(quip_atoms.properties))
+        self.assertNotIn('my_info', quippy.convert.get_dict_keys(quip_atoms.params))
+
+    def test_number_of_atoms_changed(self):
+        self.pot_incremental.get_potential_energy(self.at)
+        at = self.at * (2, 1, 1)
+        self.assertAlmostEqual(self.pot_incremental.get_potential_energy(at), self.pot.get_potential_energy(at))
+        self.assertEqual(self.pot_incremental._quip_atoms.n, len(at))
+
+
+class TestPotential_ExtraResults(quippytest.QuippyTestCase):
+    def setUp(self):
+        # the local energies under another name are a non-standard result
+        self.calc_args = 'local_energy=my_local_e'
+        self.at = Atoms('Si8', positions=diamond_pos, pbc=True, cell=[5.44, 5.44, 5.44])
+
+    def test_default(self):
+        # plain dicts, which can be copied or serialised as before
+        pot = Potential('IP SW', param_filename='SW_pot.xml', calc_args=self.calc_args, incremental=True)
+        energy = pot.get_potential_energy(self.at)
+        extra_results = pot.extra_results
+        self.assertIsInstance(extra_results['atoms'], dict)
+        self.assertIsInstance(extra_results['config'], dict)
+        self.at.rattle(0.05, seed=1)
+        pot.get_potential_energy(self.at)
+        self.assertAlmostEqual(extra_results['atoms']['my_local_e'].sum(), energy)
+
+    def test_lazy(self):
+        pot = Potential('IP SW', param_filename='SW_pot.xml', calc_args=self.calc_args, lazy_results=True)
+        energy = pot.get_potential_energy(self.at)
+        self.assertIsInstance(pot.extra_results['atoms'], quippy.potential.LazyResults)
+        self.assertIn('my_local_e', pot.extra_results['atoms'])
+        self.assertAlmostEqual(pot.extra_results['atoms']['my_local_e'].sum(), energy)
+
+    def test_keys(self):
+        pot = Potential('IP SW', param_filename='SW_pot.xml', calc_args=self.calc_args, extra_results_keys=[])
+        pot.calculate(self.at, properties=['energy', 'stress'])
+        self.assertNotIn('my_local_e', pot.extra_results['atoms'])
+        self.assertIn('virial', pot.extra_results['config'])
+
+    def test_invalidated(self):
+        pot = Potential('IP SW', param_filename='SW_pot.xml', calc_args=self.calc_args, incremental=True,
+                        lazy_results=True)
+        pot.get_potential_energy(self.at)
+        extra_results = pot.extra_results
+        self.at.rattle(0.05, seed=1)
+        pot.get_potential_energy(self.at)
+        with self.assertRaises(RuntimeError):
+            extra_results['atoms']['my_local_e']
+
+        # unless it is listed in extra_results_keys
+        pot = Potential('IP SW', param_filename='SW_pot.xml', calc_args=self.calc_args, incremental=True,
+                        lazy_results=True, extra_results_keys=['my_local_e'])
+        energy = pot.get_potential_energy(self.at)
+        extra_results = pot.extra_results
+        self.at.rattle(0.05, seed=2)
+        pot.get_potential_energy(self.at)
+        self.assertAlmostEqual(extra_results['atoms']['my_local_e'].sum(), energy)
+
+
+class TestPotential_NeighbourSkin(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.pot = Potential('IP SW', param_filename='SW_pot.xml')
+        self.pot_skin = Potential('IP SW', param_filename='SW_pot.xml', neighbour_skin=1.0)
+        self.at = Atoms('Si8', positions=diamond_pos, pbc=True, cell=[5.44, 5.44, 5.44])
+        self.at.calc = self.pot_skin
+
+    def test_rebuilds(self):
+        self.at.get_forces()
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_rebuilds'], 1)
+
+        # less than half of the skin: only the distances are updated
+        self.at.positions[0] += [0.1, 0.0, 0.0]
+        f = self.at.get_forces()
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_calls'], 2)
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_rebuilds'], 1)
+        self.assertArrayAlmostEqual(f, self.pot.get_forces(self.at), tol=1E-06)
+
+        # more than half of the skin
+        self.at.positions[0] += [0.6, 0.0, 0.0]
+        f = self.at.get_forces()
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_rebuilds'], 2)
+        self.assertArrayAlmostEqual(f, self.pot.get_forces(self.at), tol=1E-06)
+
+    def test_direct_calculate(self):
+        # calculate() called directly gets no system_changes, the list is still reused
+        self.pot_skin.calculate(self.at, properties=['energy', 'forces'])
+        quip_atoms = self.pot_skin._quip_atoms
+        self.at.positions[0] += [0.1, 0.0, 0.0]
+        self.pot_skin.calculate(self.at, properties=['energy', 'forces'])
+        self.assertIs(self.pot_skin._quip_atoms, quip_atoms)
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_calls'], 2)
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_rebuilds'], 1)
+
+        self.at.positions[0] += [0.6, 0.0, 0.0]
+        self.pot_skin.calculate(self.at, properties=['energy', 'forces'])
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_rebuilds'], 2)
+        self.assertArrayAlmostEqual(self.pot_skin.results['forces'], self.pot.get_forces(self.at), tol=1E-06)
+
+        # a change of pbc is found by comparing them
+        self.at.pbc = [True, True, False]
+        self.pot_skin.calculate(self.at, properties=['energy', 'forces'])
+        self.assertIsNot(self.pot_skin._quip_atoms, quip_atoms)
+        self.assertEqual(self.pot_skin.extra_results['config']['neighbour_rebuilds'], 3)
+        self.assertArrayAlmostEqual(self.pot_skin.results['forces'], self.pot.get_forces(self.at), tol=1E-06)
+
+
 if __name__ == '__main__':
     unittest.main()
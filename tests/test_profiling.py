@@ -0,0 +1,59 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright James Kermode 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   http://www.jrkermode.co.uk/quippy
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+import json
+import unittest
+import quippy
+import quippy.profiling
+import quippytest
+import ase.build
+from quippy.potential import Potential
+
+
+class TestProfile(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.pot = Potential('IP SW', param_filename='SW_pot.xml')
+        self.at = ase.build.bulk('Si', cubic=True)
+        self.at.calc = self.pot
+
+    def test_phases(self):
+        with quippy.profiling.Profile() as profile:
+            for i in range(3):
+                self.at.rattle(0.01, seed=i)
+                self.at.get_forces()
+        report = json.loads(profile.to_json())
+        for name in ['convert', 'calc_args', 'calc', 'results']:
+            self.assertEqual(report['phases'][name]['calls'], 3)
+        self.assertLessEqual(report['phases']['calc']['wall_time'], report['wall_time'])
+        # Fortran timers of the neighbour list and of the potential
+        self.assertEqual(report['fortran_timers']['calc_connect']['calls'], 3)
+        self.assertEqual(report['fortran_timers']['IP_Calc']['calls'], 3)
+
+    def test_disabled(self):
+        self.at.get_forces()
+        with quippy.profiling.Profile(fortran=False) as profile:
+            self.at.rattle(0.01)
+            self.at.get_forces()
+        self.at.rattle(0.01)
+        self.at.get_forces()
+        self.assertEqual(profile.report()['phases']['calc']['calls'], 1)
+        self.assertEqual(profile.report()['fortran_timers'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
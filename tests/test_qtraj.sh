@@ -0,0 +1,67 @@
+#!/bin/bash
+
+set -e
+
+if [ -z $QUIP_ROOT ]; then
+   echo "$0: Need QUIP_ROOT defined"
+   exit 1
+fi
+if [ -z $QUIP_ARCH ]; then
+   echo "$0: Need QUIP_ARCH defined"
+   exit 1
+fi
+
+TEST=test_qtraj.sh
+
+mydir=`dirname $0`
+bindir=$mydir/../build/$QUIP_ARCH
+
+if [ ! -x $bindir/convert ] || [ ! -x $bindir/merge_traj ]; then
+   (cd $QUIP_ROOT && make Structure_processors) || exit 2
+fi
+
+cat<<EOF > ${TEST}.in.xyz
+4
+Lattice="5.43 0.0 0.0 0.0 5.43 0.0 0.0 0.0 5.43" Properties=species:S:1:pos:R:3:velo:R:3:fixed:I:1 energy=-17.2345678912345 config_type=bulk pbc="T T T"
+Si  0.10000000  0.00000000  0.00000000  0.00100000 -0.00200000  0.00300000  0
+Si  2.71441760  2.61441760  0.00000000  0.00000000  0.00000000  0.00000000  1
+Si  2.71441760  0.00000000  2.71441760 -0.00100000  0.00200000  0.00000000  0
+Si  1.35720880  1.35720880  1.35720880  0.00000000  0.00000000 -0.00300000  0
+3
+Lattice="6.0 0.0 0.0 0.0 6.0 0.0 0.0 0.0 6.0" Properties=species:S:1:pos:R:3:velo:R:3:fixed:I:1 energy=-12.5 config_type=cluster pbc="T T T"
+Si  0.33333333  0.00000000  0.00000000  0.00000000  0.00000000  0.00000000  0
+Si  3.00000000  3.00000000  0.10000000  0.00000000  0.00000000  0.00000000  0
+Si  1.50000000  1.50000000  1.50000000  0.00000000  0.00000000  0.00000000  1
+EOF
+
+error=0
+echo -n "$0: "
+
+# xyz -> qtraj -> xyz keeps every digit, so a second round trip gives identical files
+$bindir/convert ${TEST}.in.xyz ${TEST}.1.qtraj > /dev/null
+$bindir/convert ${TEST}.1.qtraj ${TEST}.1.xyz > /dev/null
+$bindir/convert ${TEST}.1.xyz ${TEST}.2.qtraj > /dev/null
+$bindir/convert ${TEST}.2.qtraj ${TEST}.2.xyz > /dev/null
+cmp -s ${TEST}.1.xyz ${TEST}.2.xyz || { echo -n "round trip changed frames; "; error=1; }
+cmp -s ${TEST}.1.qtraj ${TEST}.2.qtraj || { echo -n "round trip changed qtraj file; "; error=1; }
+
+# every frame after the first is appended in place of the trailer, and read back through the index
+$bindir/merge_traj ${TEST}.merged.qtraj ${TEST}.1.qtraj ${TEST}.2.qtraj > /dev/null
+$bindir/convert ${TEST}.merged.qtraj ${TEST}.merged.xyz > /dev/null
+cat ${TEST}.1.xyz ${TEST}.2.xyz > ${TEST}.ref.xyz
+cmp -s ${TEST}.merged.xyz ${TEST}.ref.xyz || { echo -n "appended frames differ; "; error=1; }
+
+# without the trailer, e.g. after a crash, the frames are found from the record sizes
+head -c -24 ${TEST}.merged.qtraj > ${TEST}.no_trailer.qtraj
+$bindir/convert ${TEST}.no_trailer.qtraj ${TEST}.no_trailer.xyz > /dev/null
+cmp -s ${TEST}.no_trailer.xyz ${TEST}.ref.xyz || { echo -n "frames lost without trailer; "; error=1; }
+
+# and an incomplete last frame is skipped
+head -c -40 ${TEST}.merged.qtraj > ${TEST}.partial.qtraj
+$bindir/convert ${TEST}.partial.qtraj ${TEST}.partial.xyz > /dev/null
+head -17 ${TEST}.ref.xyz | cmp -s - ${TEST}.partial.xyz || { echo -n "complete frames lost after partial frame; "; error=1; }
+
+[ $error == 0 ] && echo "qtraj is OK"
+
+rm -f ${TEST}.*
+exit $error
@@ -0,0 +1,71 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright James Kermode 2019
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   http://www.jrkermode.co.uk/quippy
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+import unittest
+import quippy
+import quippy.filepot_worker
+import quippy.socket_server
+import numpy as np
+import quippytest
+import ase.build
+
+
+class TestSocketPot_Binary(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.at = ase.build.bulk('Si', cubic=True)
+        self.server = quippy.socket_server.SocketServer(quippy.filepot_worker.echo_calculate)
+        self.server.start()
+        self.args_str = 'SocketPot server_ip=127.0.0.1 server_port={0} protocol=2'.format(self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_potential(self):
+        pot = quippy.potential.Potential(self.args_str)
+        self.at.set_calculator(pot)
+        for i in range(3):
+            self.at.rattle(0.01, seed=i)
+            self.assertAlmostEqual(self.at.get_potential_energy(), 0.5 * np.sum(self.at.positions ** 2))
+            self.assertArrayAlmostEqual(self.at.get_forces(), -self.at.positions)
+
+        # one connection, with the cell and atomic numbers sent only with the first configuration
+        self.assertEqual(self.server.n_connections, 1)
+        self.assertEqual(self.server.sections_received[b'Z   '], 1)
+        self.assertEqual(self.server.sections_received[b'CELL'], 1)
+        self.assertEqual(self.server.sections_received[b'POS '], self.server.n_requests)
+
+    def test_error(self):
+        def fail_once(request):
+            if self.server.n_requests == 1:
+                raise ValueError('calculation failed')
+            return quippy.filepot_worker.echo_calculate(request)
+
+        self.server.calculate = fail_once
+        pot = quippy.potential.Potential(self.args_str)
+        self.at.set_calculator(pot)
+        with self.assertRaises(RuntimeError):
+            self.at.get_potential_energy()
+
+        # the connection is dropped after an error, and the next calculation reconnects
+        self.at.rattle(0.01)
+        self.assertAlmostEqual(self.at.get_potential_energy(), 0.5 * np.sum(self.at.positions ** 2))
+        self.assertEqual(self.server.n_connections, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,8 @@
 
 import unittest
 import os
+import sys
+import tempfile
 
 import ase.build
 import quippy
@@ -63,5 +65,43 @@ class TestCalculatorSumPotential(quippytest.QuippyTestCase):
         self.assertArrayAlmostEqual(*self.calcboth("energies"), tol=1E-06)
 
 
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class TestCalculatorSumPotentialConcurrent(TestCalculatorSumPotential):
+    def setUp(self):
+        TestCalculatorSumPotential.setUp(self)
+        # pot1 and pot2 evaluated at the same time, on two OpenMP threads
+        self.sumpot = quippy.potential.Potential(args_str="Potential Sum concurrent=T", pot1=self.pot1, pot2=self.pot2)
+
+
+class TestCalculatorSumPotentialConcurrentError(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # a persistent FilePot command that fails every request
+        script = os.path.join(self.tmpdir.name, 'fail.py')
+        with open(script, 'w') as f:
+            f.write('import quippy.filepot_worker\n'
+                    'def calculate(request):\n'
+                    '    raise ValueError("always fails")\n'
+                    'quippy.filepot_worker.serve(calculate)\n')
+        self.pot1 = quippy.potential.Potential('IP SW', param_filename='SW_pot.xml')
+        self.pot2 = quippy.potential.Potential('FilePot command="{0} {1}" persistent=T'.format(sys.executable, script),
+                                               calc_args='FilePot_log=F')
+        self.sumpot = quippy.potential.Potential(args_str="Potential Sum concurrent=T", pot1=self.pot1, pot2=self.pot2)
+        self.at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_pot2_error(self):
+        # pot2 runs on a thread of its own, its traceback has to be raised on the calling one,
+        # and nothing of it may be left behind for the next error
+        for i in range(2):
+            with self.assertRaises(RuntimeError) as cm:
+                self.sumpot.get_potential_energy(self.at)
+            self.assertEqual(str(cm.exception).count('Potential_Sum_calc: pot2 failed'), 1)
+            self.assertIn('persistent command', str(cm.exception))
+            self.assertNotIn('pot1 failed', str(cm.exception))
+
+
 if __name__ == '__main__':
     unittest.main()